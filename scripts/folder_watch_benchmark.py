@@ -0,0 +1,93 @@
+"""
+Measure how soon an image file saved into a watched folder joins the image
+list, as when a camera tethered to the computer saves each shot, in folders
+already holding many files.
+
+A writer thread saves a copy of an image file every second, in chunks as a
+camera would over USB, and the latency is the time from closing each copy to
+FolderIndex.newest_added for it. That includes waiting for the file to settle,
+and listing the whole folder again.
+
+usage: python scripts/folder_watch_benchmark.py IMAGE_FILE
+"""
+
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from PySide6 import QtCore
+
+from vmg.folder_index import FolderIndex
+
+FOLDER_SIZES = (100, 10000, 80000)
+SHOT_COUNT = 10
+SHOT_SECONDS = 1.0
+CHUNK_BYTES = 1 << 20
+CHUNK_SECONDS = 0.010
+
+
+def write_shots(data: bytes, folder: str, closed: dict[str, float]):
+    for shot in range(SHOT_COUNT):
+        time.sleep(SHOT_SECONDS)
+        file_name = os.path.join(folder, f"shot_{shot:04d}.jpg")
+        with open(file_name, "wb") as out:
+            for start in range(0, len(data), CHUNK_BYTES):
+                out.write(data[start:start + CHUNK_BYTES])
+                out.flush()
+                time.sleep(CHUNK_SECONDS)
+        closed[file_name] = time.perf_counter()
+
+
+def measure(app: QtCore.QCoreApplication, data: bytes, folder_size: int) -> list[float]:
+    folder = tempfile.mkdtemp()
+    try:
+        for index in range(folder_size):
+            open(os.path.join(folder, f"existing_{index:06d}.jpg"), "wb").close()
+        folder_index = FolderIndex()
+        closed = {}
+        latencies = []
+
+        def on_newest_added(file_name: str, _written_time: float):
+            if file_name in closed:
+                latencies.append(time.perf_counter() - closed[file_name])
+            if len(latencies) == SHOT_COUNT:
+                app.quit()
+
+        folder_index.newest_added.connect(on_newest_added)
+        folder_index.open_folder(os.path.join(folder, "existing_000000.jpg"))
+        writer = threading.Thread(target=write_shots, args=(data, folder, closed))
+        writer.start()
+        timeout = QtCore.QTimer()  # in case some files are missed
+        timeout.setSingleShot(True)
+        timeout.timeout.connect(app.quit)
+        timeout.start(int(1000 * SHOT_COUNT * (SHOT_SECONDS + 5)))
+        app.exec()
+        timeout.stop()
+        writer.join()
+        folder_index.stop()
+        return latencies
+    finally:
+        shutil.rmtree(folder)
+
+
+def main(file_name: str):
+    app = QtCore.QCoreApplication([])
+    with open(file_name, "rb") as f:
+        data = f.read()
+    print(f"{SHOT_COUNT} copies of {file_name}, {len(data) / 2**20:.1f} MB each")
+    for folder_size in FOLDER_SIZES:
+        latencies = sorted(measure(app, data, folder_size))
+        if len(latencies) == 0:
+            print(f"  {folder_size:6} files: no new files seen")
+            continue
+        print(
+            f"  {folder_size:6} files: median {statistics.median(latencies) * 1000:6.1f} ms,"
+            f" max {latencies[-1] * 1000:6.1f} ms, {len(latencies)} of {SHOT_COUNT} seen")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,71 @@
+"""
+Measure open-to-array time per image format, comparing the format sniffing
+dispatcher in TiledImage.load_from_file against the previous route, which
+tried tifffile on every file before opening it again with PIL.
+
+usage: python scripts/format_decode_benchmark.py IMAGE_FILE [IMAGE_FILE ...]
+"""
+
+from collections import defaultdict
+import sys
+import time
+
+import numpy
+from PIL import Image
+from pillow_heif import register_heif_opener
+import tifffile
+
+from vmg.image_formats import HEADER_SIZE, sniff_format
+from vmg.tiled_image import TiledImage
+
+REPEAT_COUNT = 3
+
+register_heif_opener()
+
+
+def load_with_sniffing(file_name: str) -> tuple[int, ...]:
+    image = TiledImage()
+    assert image.load_from_file(file_name)
+    return image.array.shape
+
+
+def load_tiff_first(file_name: str) -> tuple[int, ...]:
+    try:
+        with tifffile.TiffFile(file_name) as tif:
+            return tif.pages[0].asarray().shape
+    except tifffile.TiffFileError:
+        pass
+    return numpy.array(Image.open(file_name)).shape
+
+
+def best_seconds(load, file_name: str) -> float:
+    best = None
+    for _ in range(REPEAT_COUNT):
+        t0 = time.perf_counter()
+        load(file_name)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(file_names: list[str]):
+    totals = defaultdict(lambda: [0, 0.0, 0.0])  # format: [file count, sniffing seconds, tiff first seconds]
+    for file_name in file_names:
+        with open(file_name, "rb") as fh:
+            file_format = sniff_format(fh.read(HEADER_SIZE))
+        sniffing = best_seconds(load_with_sniffing, file_name)
+        tiff_first = best_seconds(load_tiff_first, file_name)
+        print(f"{file_format.name:5} {sniffing * 1000:8.1f} ms sniffed {tiff_first * 1000:8.1f} ms tiff first  {file_name}")
+        total = totals[file_format.name]
+        total[0] += 1
+        total[1] += sniffing
+        total[2] += tiff_first
+    print()
+    for name, (count, sniffing, tiff_first) in sorted(totals.items()):
+        print(
+            f"{name:5} {count} files: mean {sniffing / count * 1000:.1f} ms sniffed,"
+            f" {tiff_first / count * 1000:.1f} ms tiff first ({tiff_first / sniffing:.2f}x)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
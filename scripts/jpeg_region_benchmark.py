@@ -0,0 +1,49 @@
+"""
+Measure decoding one screen-sized corner of a large JPEG with libjpeg-turbo's
+partial decode, in vmg.pyjpeg.decode_region, against decoding the whole file.
+
+usage: python scripts/jpeg_region_benchmark.py JPEG_FILE [WIDTH HEIGHT]
+"""
+
+import io
+import sys
+import time
+
+from vmg.image_formats import decode_jpeg
+from vmg.pyjpeg import decode_region
+
+REPEAT_COUNT = 3
+
+
+def best_seconds(decode) -> float:
+    best = None
+    for _ in range(REPEAT_COUNT):
+        t0 = time.perf_counter()
+        decode()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(file_name: str, width: int = 1920, height: int = 1080):
+    with open(file_name, "rb") as fh:
+        data = fh.read()
+    full = decode_jpeg(data, "RGB")
+    ih, iw = full.shape[:2]
+    del full
+    width, height = min(width, iw), min(height, ih)
+    corners = {
+        "top left": (0, 0),
+        "center": ((iw - width) // 2, (ih - height) // 2),
+        "bottom right": (iw - width, ih - height),
+    }
+    whole = best_seconds(lambda: decode_jpeg(data, "RGB"))
+    print(f"{iw}x{ih} {file_name}")
+    print(f"  whole image   {whole * 1000:8.1f} ms")
+    for name, (left, top) in corners.items():
+        region = best_seconds(lambda: decode_region(io.BytesIO(data), left, top, width, height))
+        print(f"  {name:13} {region * 1000:8.1f} ms for {width}x{height} ({whole / region:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *(int(arg) for arg in sys.argv[2:4]))
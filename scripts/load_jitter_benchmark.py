@@ -0,0 +1,95 @@
+"""
+Measure how much loading images stalls the UI thread, decoding in threads of
+the viewer compared with decoding in worker processes.
+
+The main thread stands in for the UI thread, waking for a frame every 1/60 s to
+run a little Python, while loader threads decode the files over and over. Every
+Python step a decoder takes holds the GIL, so each frame that wakes late shows
+a stutter the user would see.
+
+usage: python scripts/load_jitter_benchmark.py IMAGE_FILE [IMAGE_FILE ...]
+"""
+
+import statistics
+import sys
+import threading
+import time
+from typing import Optional
+
+from vmg.image_prefetcher import DEFAULT_DECODE_WORKER_COUNT
+from vmg.process_decode import ProcessDecoder
+from vmg.tiled_image import TiledImage
+
+FRAME_SECONDS = 1 / 60
+MEASURE_SECONDS = 10.0
+
+
+def frame_times(seconds: float) -> list[float]:
+    """Interval between frames of a 60 Hz loop on this thread, for this many seconds"""
+    result = []
+    start = previous = time.perf_counter()
+    deadline = start + FRAME_SECONDS
+    while previous - start < seconds:
+        time.sleep(max(0.0, deadline - time.perf_counter()))
+        sum(range(1000))  # a little Python, like handling a paint event
+        now = time.perf_counter()
+        result.append(now - previous)
+        previous = now
+        deadline = max(deadline + FRAME_SECONDS, now)
+    return result
+
+
+def report(name: str, times: list[float], load_count: int = 0):
+    ordered = sorted(times)
+    late = sum(1 for t in times if t > 1.5 * FRAME_SECONDS)
+    print(
+        f"  {name:20} median {statistics.median(times) * 1000:5.1f} ms,"
+        f" p99 {ordered[int(0.99 * (len(ordered) - 1))] * 1000:6.1f} ms,"
+        f" max {ordered[-1] * 1000:6.1f} ms, {late / len(times):6.1%} frames late; {load_count} loads")
+
+
+def measure(file_names: list[str], decoder: Optional[ProcessDecoder] = None) -> tuple[list[float], int]:
+    stop = threading.Event()
+    load_count = 0
+    lock = threading.Lock()
+
+    def load_repeatedly(offset: int):
+        nonlocal load_count
+        index = offset
+        while not stop.is_set():
+            image = TiledImage()
+            file_name = file_names[index % len(file_names)]
+            if decoder is None:
+                image.load_from_file(file_name)
+            else:
+                decoder.load(image, file_name)
+            with lock:
+                load_count += 1
+            index += 1
+
+    loaders = [threading.Thread(target=load_repeatedly, args=(i,)) for i in range(DEFAULT_DECODE_WORKER_COUNT)]
+    for loader in loaders:
+        loader.start()
+    try:
+        times = frame_times(MEASURE_SECONDS)
+    finally:
+        stop.set()
+        for loader in loaders:
+            loader.join()
+    return times, load_count
+
+
+def main(file_names: list[str]):
+    print(f"{len(file_names)} files, {DEFAULT_DECODE_WORKER_COUNT} loaders, {MEASURE_SECONDS:.0f} s each")
+    report("idle", frame_times(MEASURE_SECONDS))
+    report("decode in threads", *measure(file_names))
+    decoder = ProcessDecoder(DEFAULT_DECODE_WORKER_COUNT)
+    try:
+        decoder.load(TiledImage(), file_names[0])  # start the worker processes before measuring
+        report("decode in processes", *measure(file_names, decoder))
+    finally:
+        decoder.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
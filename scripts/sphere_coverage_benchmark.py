@@ -0,0 +1,103 @@
+"""
+Compare spherical frame times with and without per-tile screen coverage geometry.
+
+Renders a large synthetic equirectangular panorama into an offscreen framebuffer,
+once drawing every tile as a full-screen quad, and once drawing each tile over
+just its projected screen rectangle.
+"""
+
+import time
+
+import numpy
+from OpenGL import GL
+from PIL import Image
+from PySide6.QtCore import QSize
+from PySide6.QtGui import (
+    QGuiApplication,
+    QOffscreenSurface,
+    QOpenGLContext,
+    QSurfaceFormat,
+)
+
+from vmg.display_projection import DisplayProjection
+from vmg.shader import SphericalShader
+from vmg.state import ViewState
+from vmg.tiled_image import TiledImage
+
+WIDTH, HEIGHT = 1920, 1080  # window size
+PANO_WIDTH, PANO_HEIGHT = 16384, 8192
+FRAME_COUNT = 50
+
+# Must create an application before creating a surface
+app = QGuiApplication([])
+fmt = QSurfaceFormat()
+fmt.setRenderableType(QSurfaceFormat.OpenGL)
+fmt.setProfile(QSurfaceFormat.CoreProfile)
+fmt.setVersion(4, 1)  # macOS maximum
+surface = QOffscreenSurface()
+surface.setFormat(fmt)
+context = QOpenGLContext()
+context.setFormat(surface.requestedFormat())
+context.create()
+assert context.isValid()
+surface.create()
+assert surface.isValid()
+context.makeCurrent(surface)
+print(GL.glGetString(GL.GL_RENDERER).decode())
+
+# Render target the size of a typical window
+fbo = GL.glGenFramebuffers(1)
+GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+color_buffer = GL.glGenRenderbuffers(1)
+GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, color_buffer)
+GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGBA8, WIDTH, HEIGHT)
+GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, color_buffer)
+assert GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) == GL.GL_FRAMEBUFFER_COMPLETE
+GL.glViewport(0, 0, WIDTH, HEIGHT)
+vao = GL.glGenVertexArrays(1)  # the image widget keeps one bound, too
+
+# Synthetic panorama with some structure in it
+x = numpy.linspace(0, 255, PANO_WIDTH, dtype=numpy.float32)
+y = numpy.linspace(0, 255, PANO_HEIGHT, dtype=numpy.float32)
+array = numpy.empty((PANO_HEIGHT, PANO_WIDTH, 3), dtype=numpy.uint8)
+array[..., 0] = x[None, :]
+array[..., 1] = y[:, None]
+array[..., 2] = 128
+image = TiledImage()
+image.load_from_pil_image(Image.fromarray(array), "synthetic_pano")
+del array
+image.initialize_gl()
+GL.glFinish()
+print(f"{PANO_WIDTH}x{PANO_HEIGHT} {image.md.input_format.name} image in {len(image.tiles)} tiles")
+
+state = ViewState(QSize(WIDTH, HEIGHT))
+state.set_image(image)
+shader = SphericalShader()
+shader.initialize_gl()
+
+for projection in DisplayProjection:
+    state.display_projection = projection
+    for zoom in (1.0, 4.0):
+        state._zoom = zoom
+        results = []
+        for use_tile_coverage in (False, True):
+            shader.use_tile_coverage = use_tile_coverage
+            shader.array_shader.use_tile_coverage = use_tile_coverage
+            GL.glBindVertexArray(vao)
+            shader.paint_gl(state, image)  # warm up
+            GL.glFinish()
+            t0 = time.perf_counter()
+            for frame in range(FRAME_COUNT):
+                # Pan a bit each frame, so cached tile bounds are recomputed
+                state.view_heading_degrees = 3.0 * frame
+                GL.glBindVertexArray(vao)
+                GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+                shader.paint_gl(state, image)
+                GL.glFinish()
+            results.append(1000.0 * (time.perf_counter() - t0) / FRAME_COUNT)
+        full, covered = results
+        print(
+            f"{projection.name:>16} zoom {zoom:3.1f}: "
+            f"full screen quads {full:7.2f} ms/frame, "
+            f"tile coverage {covered:7.2f} ms/frame "
+            f"({full / covered:4.1f}x)")
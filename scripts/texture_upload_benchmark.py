@@ -0,0 +1,72 @@
+"""
+Measure tile upload throughput on an offscreen context, like the one the
+image loader thread uses, comparing direct glTexImage2D from client memory
+against streaming through rings of pixel buffer objects.
+
+A software rasterizer, such as Mesa's llvmpipe, has no DMA transfer for the
+buffers to overlap, so expect them to make little difference there.
+"""
+
+import time
+
+import numpy
+from OpenGL import GL
+from PIL import Image
+from PySide6.QtGui import (
+    QGuiApplication,
+    QOffscreenSurface,
+    QOpenGLContext,
+    QSurfaceFormat,
+)
+
+from vmg.pixel_buffers import PixelBufferRing
+from vmg.tiled_image import TiledImage, generate_tiles
+
+IMAGE_WIDTH, IMAGE_HEIGHT = 16384, 8192
+REPEAT_COUNT = 3
+
+# Must create an application before creating a surface
+app = QGuiApplication([])
+fmt = QSurfaceFormat()
+fmt.setRenderableType(QSurfaceFormat.OpenGL)
+fmt.setProfile(QSurfaceFormat.CoreProfile)
+fmt.setVersion(4, 1)  # macOS maximum
+surface = QOffscreenSurface()
+surface.setFormat(fmt)
+context = QOpenGLContext()
+context.setFormat(surface.requestedFormat())
+context.create()
+assert context.isValid()
+surface.create()
+assert surface.isValid()
+context.makeCurrent(surface)
+print(GL.glGetString(GL.GL_RENDERER).decode())
+
+for channel_count in (3, 4):
+    array = numpy.random.default_rng(0).integers(
+        0, 255, size=(IMAGE_HEIGHT, IMAGE_WIDTH, channel_count), dtype=numpy.uint8)
+    image = TiledImage()
+    image.load_from_pil_image(Image.fromarray(array), f"synthetic_{channel_count}")
+    del array
+    megabytes = image.array.nbytes / 2**20
+    print(f"{IMAGE_WIDTH}x{IMAGE_HEIGHT}x{channel_count} image, {megabytes:.0f} MB")
+    for label, buffer_count in (
+        ("direct", 0),
+        ("2 PBOs", 2),
+        ("3 PBOs", 3),
+        ("4 PBOs", 4),
+    ):
+        pixel_buffers = PixelBufferRing(buffer_count) if buffer_count > 0 else None
+        best = None
+        for _ in range(REPEAT_COUNT):
+            GL.glFinish()
+            t0 = time.perf_counter()
+            tiles = list(generate_tiles(image, pixel_buffers=pixel_buffers))
+            GL.glFinish()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+            for tile in tiles:
+                tile.release_gl()
+        if pixel_buffers is not None:
+            pixel_buffers.release_gl()
+        print(f"  {label:>7}: {1000 * best:7.1f} ms, {megabytes / best:7.1f} MB/s")
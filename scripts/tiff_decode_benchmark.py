@@ -0,0 +1,55 @@
+"""
+Measure how decoding the strips or tiles of a TIFF or DNG page scales with
+the number of decode threads, and how soon the first band of GL tiles could
+upload, compared with tifffile decoding the page on one thread.
+
+usage: python scripts/tiff_decode_benchmark.py TIFF_FILE [TIFF_FILE ...]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import time
+
+import numpy
+import tifffile
+
+from vmg.tiled_image import main_tiff_page, TILE_SIZE
+from vmg.tiff_segments import iter_decode_segments
+
+
+def worker_counts() -> list[int]:
+    result = [1]
+    while result[-1] * 2 <= (os.cpu_count() or 1):
+        result.append(result[-1] * 2)
+    if result[-1] != os.cpu_count():
+        result.append(os.cpu_count())
+    return result
+
+
+def main(file_names: list[str]):
+    for file_name in file_names:
+        with tifffile.TiffFile(file_name) as tif:
+            page, _root_page = main_tiff_page(tif)
+            print(f"{file_name}: {page.shape} {page.dtype}, compression {page.compression.name},"
+                  f" {len(page.dataoffsets)} segments")
+            t0 = time.perf_counter()
+            page.asarray(maxworkers=1)
+            baseline = time.perf_counter() - t0
+            print(f"  tifffile, 1 thread  {baseline * 1000:8.1f} ms")
+            for worker_count in worker_counts():
+                out = numpy.zeros(page.shape, dtype=page.dtype)
+                with ThreadPoolExecutor(worker_count) as pool:
+                    t0 = time.perf_counter()
+                    first_band = None
+                    for row_count in iter_decode_segments(page, out, pool=pool):
+                        if first_band is None and row_count >= min(TILE_SIZE, page.shape[0]):
+                            first_band = time.perf_counter() - t0
+                    total = time.perf_counter() - t0
+                print(
+                    f"  {worker_count:2} threads  {total * 1000:8.1f} ms ({baseline / total:.1f}x),"
+                    f" first {TILE_SIZE} rows at {first_band * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
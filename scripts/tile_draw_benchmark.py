@@ -0,0 +1,93 @@
+"""
+Compare frame times for drawing an image of many tiles one draw call per tile,
+against tiles stored in texture arrays and drawn with instanced draw calls.
+
+Uses small tiles, so a modest synthetic image has well over 100 of them.
+"""
+
+import time
+
+import numpy
+from OpenGL import GL
+from PIL import Image
+from PySide6.QtCore import QSize
+from PySide6.QtGui import (
+    QGuiApplication,
+    QOffscreenSurface,
+    QOpenGLContext,
+    QSurfaceFormat,
+)
+
+from vmg.interfaces import InputFormat
+from vmg.shader import RectangularTileShader, SphericalShader
+from vmg.state import ViewState
+from vmg.tiled_image import TiledImage, generate_tiles
+
+WIDTH, HEIGHT = 1920, 1080  # window size
+IMAGE_WIDTH, IMAGE_HEIGHT = 8192, 4096
+TILE_SIZE = 512
+FRAME_COUNT = 100
+
+# Must create an application before creating a surface
+app = QGuiApplication([])
+fmt = QSurfaceFormat()
+fmt.setRenderableType(QSurfaceFormat.OpenGL)
+fmt.setProfile(QSurfaceFormat.CoreProfile)
+fmt.setVersion(4, 1)  # macOS maximum
+surface = QOffscreenSurface()
+surface.setFormat(fmt)
+context = QOpenGLContext()
+context.setFormat(surface.requestedFormat())
+context.create()
+assert context.isValid()
+surface.create()
+assert surface.isValid()
+context.makeCurrent(surface)
+print(GL.glGetString(GL.GL_RENDERER).decode())
+
+# Render target the size of a typical window
+fbo = GL.glGenFramebuffers(1)
+GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, fbo)
+color_buffer = GL.glGenRenderbuffers(1)
+GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, color_buffer)
+GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGBA8, WIDTH, HEIGHT)
+GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_RENDERBUFFER, color_buffer)
+assert GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) == GL.GL_FRAMEBUFFER_COMPLETE
+GL.glViewport(0, 0, WIDTH, HEIGHT)
+vao = GL.glGenVertexArrays(1)  # the image widget keeps one bound, too
+
+array = numpy.random.default_rng(0).integers(0, 255, size=(IMAGE_HEIGHT, IMAGE_WIDTH, 3), dtype=numpy.uint8)
+image = TiledImage()
+image.load_from_pil_image(Image.fromarray(array), "synthetic")
+del array
+state = ViewState(QSize(WIDTH, HEIGHT))
+shaders = {
+    InputFormat.STANDARD_PHOTO: RectangularTileShader(),
+    InputFormat.EQUIRECTANGULAR: SphericalShader(),
+}
+for shader in shaders.values():
+    shader.initialize_gl()
+
+for use_texture_arrays in (False, True):
+    image.texture_arrays = []
+    image.tiles = list(generate_tiles(image, tile_size=TILE_SIZE, use_texture_arrays=use_texture_arrays))
+    image.expected_tile_count = len(image.tiles)
+    GL.glFinish()
+    label = f"{len(image.texture_arrays)} texture arrays" if use_texture_arrays else "one texture per tile"
+    print(f"{len(image.tiles)} tiles, {label}")
+    for input_format, shader in shaders.items():
+        image.md.input_format = input_format
+        state.set_image(image)
+        GL.glBindVertexArray(vao)
+        shader.paint_gl(state, image)  # warm up
+        GL.glFinish()
+        t0 = time.perf_counter()
+        for frame in range(FRAME_COUNT):
+            GL.glBindVertexArray(vao)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+            shader.paint_gl(state, image)
+            GL.glFinish()
+        elapsed = (time.perf_counter() - t0) / FRAME_COUNT
+        print(f"  {input_format.name:>16}: {1000 * elapsed:7.2f} ms/frame")
+    image.release_render_gl()
+    image.release_gl()
@@ -0,0 +1,162 @@
+"""
+Measure how tile upload scales with the number of shared offscreen contexts,
+each current in its own thread, as in vmg.upload_contexts, and which stage of
+an upload the driver serializes.
+
+The first table times each stage of a tile upload separately, in 1, 2, 4 ...
+threads at once: copying the pixels into a texture, generating its mipmaps,
+and waiting for its fence. A stage the driver runs under a lock shared by the
+contexts gains no throughput from more threads. The second table times whole
+images through generate_tiles(), with and without texture arrays.
+
+For Mesa's software rasterizer:
+  LIBGL_ALWAYS_SOFTWARE=1 GALLIUM_DRIVER=llvmpipe python scripts/upload_context_benchmark.py
+"""
+
+import os
+import time
+
+import numpy
+from OpenGL import GL
+from PIL import Image
+from PySide6 import QtCore
+from PySide6.QtGui import (
+    QGuiApplication,
+    QOffscreenSurface,
+    QOpenGLContext,
+    QSurfaceFormat,
+)
+
+from vmg.offscreen_context import OffscreenContext
+from vmg.tiled_image import TILE_SIZE, TiledImage, generate_tiles
+from vmg.upload_contexts import UploadContextPool
+
+IMAGE_WIDTH, IMAGE_HEIGHT = 16384, 8192
+UPLOADS_PER_THREAD = 8
+REPEAT_COUNT = 3
+
+
+def context_counts() -> list[int]:
+    result = [1]
+    while result[-1] * 2 <= min(8, os.cpu_count() or 1):
+        result.append(result[-1] * 2)
+    return result
+
+
+class StageThread(QtCore.QThread):
+    """Uploads the same tile repeatedly, timing each stage"""
+    def __init__(self, context: OffscreenContext, pixels: numpy.ndarray):
+        super().__init__()
+        self.context = context
+        self.pixels = pixels
+        self.seconds = {"tex image": 0.0, "mipmaps": 0.0, "fence wait": 0.0}
+
+    def run(self):
+        with self.context:
+            texture_ids = GL.glGenTextures(UPLOADS_PER_THREAD)
+            GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+            for texture_id in texture_ids:
+                GL.glBindTexture(GL.GL_TEXTURE_2D, texture_id)
+                t0 = time.perf_counter()
+                GL.glTexImage2D(
+                    GL.GL_TEXTURE_2D, 0, GL.GL_RGB8, TILE_SIZE, TILE_SIZE, 0,
+                    GL.GL_RGB, GL.GL_UNSIGNED_BYTE, self.pixels)
+                t1 = time.perf_counter()
+                GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+                t2 = time.perf_counter()
+                sync = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+                GL.glClientWaitSync(sync, GL.GL_SYNC_FLUSH_COMMANDS_BIT, GL.GL_TIMEOUT_IGNORED)
+                GL.glDeleteSync(sync)
+                t3 = time.perf_counter()
+                self.seconds["tex image"] += t1 - t0
+                self.seconds["mipmaps"] += t2 - t1
+                self.seconds["fence wait"] += t3 - t2
+            GL.glDeleteTextures(texture_ids)
+
+
+def make_contexts(root: QOpenGLContext, fmt: QSurfaceFormat, count: int) -> list[OffscreenContext]:
+    """Contexts sharing with root, each to be moved into a thread of its own, and not moved back"""
+    result = []
+    for _index in range(count):
+        context = OffscreenContext(None, root, fmt)
+        context.init_gl()
+        result.append(context)
+    return result
+
+
+def measure_stages(root: QOpenGLContext, fmt: QSurfaceFormat):
+    pixels = numpy.random.default_rng(0).integers(0, 255, size=(TILE_SIZE, TILE_SIZE, 3), dtype=numpy.uint8)
+    megabytes = pixels.nbytes / 2**20
+    print(f"Stages of {TILE_SIZE}x{TILE_SIZE} RGB tile uploads, {UPLOADS_PER_THREAD} per thread")
+    single = None
+    for count in context_counts():
+        threads = [StageThread(context, pixels) for context in make_contexts(root, fmt, count)]
+        for thread in threads:
+            thread.context.context.moveToThread(thread)
+        t0 = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.wait()
+        elapsed = time.perf_counter() - t0
+        throughput = count * UPLOADS_PER_THREAD * megabytes / elapsed
+        single = throughput if single is None else single
+        # Mean seconds per call in each stage; a stage that doubles with twice the threads is serialized
+        stages = ", ".join(
+            f"{name} {1000 * sum(t.seconds[name] for t in threads) / (count * UPLOADS_PER_THREAD):6.1f} ms"
+            for name in threads[0].seconds)
+        print(f"  {count} threads: {throughput:7.1f} MB/s ({throughput / single:.1f}x); per call {stages}")
+
+
+def measure_images(root: QOpenGLContext, fmt: QSurfaceFormat):
+    array = numpy.random.default_rng(0).integers(0, 255, size=(IMAGE_HEIGHT, IMAGE_WIDTH, 3), dtype=numpy.uint8)
+    image = TiledImage()
+    image.load_from_pil_image(Image.fromarray(array), "synthetic")
+    del array
+    megabytes = image.array.nbytes / 2**20
+    print(f"Whole {IMAGE_WIDTH}x{IMAGE_HEIGHT} RGB image through generate_tiles(), {megabytes:.0f} MB")
+    for use_texture_arrays in (False, True):
+        label = "texture arrays" if use_texture_arrays else "texture per tile"
+        for count in [0] + context_counts():
+            pool = UploadContextPool(make_contexts(root, fmt, count)) if count > 0 else None
+            best = None
+            for _ in range(REPEAT_COUNT):
+                GL.glFinish()
+                t0 = time.perf_counter()
+                tiles = list(generate_tiles(image, use_texture_arrays=use_texture_arrays, upload_contexts=pool))
+                for tile in tiles:
+                    GL.glClientWaitSync(tile.load_sync, GL.GL_SYNC_FLUSH_COMMANDS_BIT, GL.GL_TIMEOUT_IGNORED)
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+                for tile in tiles:
+                    tile.release_gl()
+                for texture_array in image.texture_arrays:
+                    texture_array.release_gl()
+                image.texture_arrays = []
+            if pool is not None:
+                pool.stop()
+            name = "loader only" if count == 0 else f"{count} contexts"
+            print(f"  {label:16} {name:12} {1000 * best:7.1f} ms, {megabytes / best:7.1f} MB/s")
+
+
+def main():
+    app = QGuiApplication([])  # noqa  must exist before any surface
+    fmt = QSurfaceFormat()
+    fmt.setRenderableType(QSurfaceFormat.OpenGL)
+    fmt.setProfile(QSurfaceFormat.CoreProfile)
+    fmt.setVersion(4, 1)  # macOS maximum
+    surface = QOffscreenSurface()
+    surface.setFormat(fmt)
+    surface.create()
+    root = QOpenGLContext()
+    root.setFormat(fmt)
+    root.create()
+    assert root.isValid()
+    root.makeCurrent(surface)  # the loader's context, in this thread
+    print(GL.glGetString(GL.GL_RENDERER).decode())
+    measure_stages(root, fmt)
+    measure_images(root, fmt)
+
+
+if __name__ == "__main__":
+    main()
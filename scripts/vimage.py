@@ -20,6 +20,10 @@ try:
 except AttributeError:
     pass
 
+import multiprocessing
+
 from vmg import VimageApp
 
-VimageApp()
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # for decode worker processes, in packaged builds
+    VimageApp()
@@ -0,0 +1,66 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+from vmg.cancellation import CancellableReader, CancellationToken, LoadCanceled
+
+
+class TestCancellation(unittest.TestCase):
+    def setUp(self):
+        handle, self.file_name = tempfile.mkstemp(suffix=".png")
+        os.close(handle)
+        Image.new("RGB", (64, 48), (200, 100, 50)).save(self.file_name)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_token(self):
+        token = CancellationToken()
+        self.assertFalse(token.is_canceled)
+        token.raise_if_canceled()
+        thread = threading.Thread(target=token.cancel)  # from any thread
+        thread.start()
+        thread.join()
+        self.assertTrue(token.is_canceled)
+        with self.assertRaises(LoadCanceled):
+            token.raise_if_canceled()
+
+    def test_reader(self):
+        token = CancellationToken()
+        with open(self.file_name, "rb") as f:
+            expected = f.read()
+        with CancellableReader(self.file_name, token) as reader:
+            self.assertEqual(expected[:8], reader.read(8))
+            self.assertEqual(8, reader.tell())
+            reader.seek(0)
+            self.assertEqual(expected, reader.read())
+            reader.seek(0)
+            token.cancel()
+            with self.assertRaises(LoadCanceled):
+                reader.read(8)
+
+    def test_reader_decode(self):
+        token = CancellationToken()
+        with io.BufferedReader(CancellableReader(self.file_name, token)) as fh:
+            with Image.open(fh) as image:
+                self.assertEqual((64, 48), image.size)
+                self.assertEqual((200, 100, 50), image.getpixel((10, 10)))
+        with io.BufferedReader(CancellableReader(self.file_name, token)) as fh:
+            token.cancel()
+            with self.assertRaises(LoadCanceled):
+                Image.open(fh).load()
+
+    def test_reader_closes_file(self):
+        reader = CancellableReader(self.file_name, CancellationToken())
+        reader.close()
+        self.assertTrue(reader.closed)
+        with self.assertRaises(ValueError):
+            reader.read(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
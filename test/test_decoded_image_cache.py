@@ -0,0 +1,144 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+from vmg.decoded_image_cache import DecodedImageCache, image_byte_count
+from vmg.image_formats import can_decode_jpeg
+from vmg.tiled_image import TiledImage
+
+
+class FakeImage(object):
+    """Just the parts of a TiledImage that the cache uses"""
+    def __init__(self, array=None):
+        self.md = object()
+        self.array = array
+        self.tex_format = None
+        self.pil_image = None
+        self.is_decoding = False
+        self.pyramid = None
+
+    def load_from_decoded(self, md, array, pil_image, tex_format):
+        self.md = md
+        self.array = array
+        self.pil_image = pil_image
+        self.tex_format = tex_format
+
+
+class TestDecodedImageCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def file(self, name: str, data: bytes = b"x") -> str:
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as out:
+            out.write(data)
+        return path
+
+    def test_hit_and_miss(self):
+        cache = DecodedImageCache(budget_bytes=1000)
+        path = self.file("a.jpg")
+        array = numpy.zeros((10, 10), dtype=numpy.uint8)
+        cache.put(path, FakeImage(array))
+        self.assertIn(path, cache)
+        image = FakeImage()
+        self.assertTrue(cache.get(path, image))
+        self.assertIs(array, image.array)
+        self.assertFalse(cache.get(self.file("b.jpg"), FakeImage()))
+        self.assertEqual((1, 1), (cache.hit_count, cache.miss_count))
+
+    def test_lru_eviction(self):
+        cache = DecodedImageCache(budget_bytes=250)
+        paths = [self.file(f"{name}.jpg") for name in "abc"]
+        for path in paths[:2]:
+            cache.put(path, FakeImage(numpy.zeros(100, dtype=numpy.uint8)))
+        self.assertTrue(cache.get(paths[0], FakeImage()))  # now b is the least recently used
+        cache.put(paths[2], FakeImage(numpy.zeros(100, dtype=numpy.uint8)))
+        self.assertIn(paths[0], cache)
+        self.assertNotIn(paths[1], cache)
+        self.assertIn(paths[2], cache)
+        self.assertEqual(1, cache.eviction_count)
+
+    def test_too_large(self):
+        cache = DecodedImageCache(budget_bytes=250)
+        small = self.file("small.jpg")
+        cache.put(small, FakeImage(numpy.zeros(100, dtype=numpy.uint8)))
+        cache.put(self.file("large.jpg"), FakeImage(numpy.zeros(300, dtype=numpy.uint8)))
+        self.assertNotIn(self.file("large.jpg"), cache)
+        self.assertIn(small, cache)  # not evicted for an image that would not fit anyway
+
+    def test_changed_file(self):
+        cache = DecodedImageCache(budget_bytes=250)
+        path = self.file("a.jpg", b"x")
+        cache.put(path, FakeImage(numpy.zeros(100, dtype=numpy.uint8)))
+        self.file("a.jpg", b"xyz")  # a different size, so a different key
+        self.assertNotIn(path, cache)
+        cache.put(path, FakeImage(numpy.zeros(200, dtype=numpy.uint8)))  # replaces the stale entry
+        self.assertIn(path, cache)
+        self.assertEqual(0, cache.eviction_count)
+
+    def test_not_decoded(self):
+        cache = DecodedImageCache(budget_bytes=250)
+        path = self.file("a.jpg")
+        cache.put(path, FakeImage())
+        decoding = FakeImage(numpy.zeros(100, dtype=numpy.uint8))
+        decoding.is_decoding = True
+        cache.put(path, decoding)
+        self.assertNotIn(path, cache)
+        cache.put(os.path.join(self.folder, "missing.jpg"), FakeImage(numpy.zeros(100, dtype=numpy.uint8)))
+        self.assertNotIn(os.path.join(self.folder, "missing.jpg"), cache)
+
+    def test_memmap_byte_count(self):
+        mapped_file = self.file("pixels.raw", bytes(1000))
+        mapped = numpy.memmap(mapped_file, dtype=numpy.uint8, mode="r", shape=(1000,))
+        self.assertEqual(0, image_byte_count(FakeImage(mapped)))  # the OS manages mapped pages
+        self.assertEqual(1000, image_byte_count(FakeImage(numpy.zeros(1000, dtype=numpy.uint8))))
+
+    def test_memmap_not_kept(self):
+        mapped_file = self.file("pixels.raw", bytes(1000))
+        mapped = numpy.memmap(mapped_file, dtype=numpy.uint8, mode="r", shape=(1000,))
+        cache = DecodedImageCache(budget_bytes=2000)
+        path = self.file("a.ppm")
+        cache.put(path, FakeImage(mapped))
+        self.assertNotIn(path, cache)  # mapping the file again is as quick, and frees the file meanwhile
+
+    def jpeg_file(self, name: str) -> str:
+        path = os.path.join(self.folder, name)
+        pixels = numpy.random.default_rng(0).integers(0, 255, size=(200, 320, 3), dtype=numpy.uint8)
+        Image.fromarray(pixels).save(path)
+        return path
+
+    def test_header_only_pil_byte_count(self):
+        # As TiledImage._load_jpeg() leaves it: PIL parsed the header, and holds the compressed bytes
+        path = self.jpeg_file("a.jpg")
+        with open(path, "rb") as fh:
+            data = fh.read()
+        image = FakeImage(numpy.zeros((200, 320, 3), dtype=numpy.uint8))
+        image.pil_image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.array.nbytes + len(data), image_byte_count(image))
+        image.pil_image.load()
+        self.assertEqual(2 * image.array.nbytes, image_byte_count(image))  # decoded by PIL too, now
+
+    @unittest.skipUnless(can_decode_jpeg("RGB"), "TurboJPEG is not available")
+    def test_turbojpeg_byte_count(self):
+        path = self.jpeg_file("a.jpg")
+        image = TiledImage()
+        self.assertTrue(image.load_from_file(path))
+        byte_count = image.array.nbytes + os.path.getsize(path)
+        self.assertEqual(byte_count, image_byte_count(image))
+        cache = DecodedImageCache(budget_bytes=2 * byte_count)
+        cache.put(path, image)
+        other = self.file("b.jpg", open(path, "rb").read())
+        cache.put(other, image)
+        self.assertIn(path, cache)  # both fit, each counted once
+        self.assertIn(other, cache)
+
+if __name__ == '__main__':
+    unittest.main()
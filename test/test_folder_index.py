@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from PySide6.QtCore import QCoreApplication, QEventLoop
+
+from vmg.folder_index import FolderIndex
+from vmg.folder_scan import FolderChanges
+from vmg.natural_sort import natural_sort_key
+
+
+class TestFolderIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for index in (1, 2, 3, 10, 20):
+            open(self.path(index), "wb").close()
+        self.index = FolderIndex()
+        self.index.open_folder(self.path(3))
+        deadline = time.monotonic() + 10
+        while self.index.is_listing and time.monotonic() < deadline:
+            QCoreApplication.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents, 100)
+        self.assertFalse(self.index.is_listing)
+
+    def tearDown(self):
+        self.index.stop()
+        shutil.rmtree(self.folder)
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.folder, f"img{index}.jpg")
+
+    def change(self, added=(), removed=()):
+        changes = FolderChanges()
+        changes.added = sorted(((natural_sort_key(path), path) for path in added), key=lambda entry: entry[0])
+        changes.removed = list(removed)
+        self.index._on_files_changed(self.index._scan_id, changes)  # noqa
+
+    def test_listing(self):
+        self.assertEqual([self.path(i) for i in (1, 2, 3, 10, 20)], list(self.index.files))
+        self.assertEqual(self.path(3), self.index.current)
+        self.assertEqual(2, self.index.position)
+
+    def test_changes_keep_position(self):
+        self.change(added=[self.path(0), self.path(15)], removed=[self.path(2)])
+        self.assertEqual([self.path(i) for i in (0, 1, 3, 10, 15, 20)], list(self.index.files))
+        self.assertEqual(self.path(3), self.index.current)
+        self.assertEqual(2, self.index.position)
+
+    def test_current_removed(self):
+        self.change(removed=[self.path(3)])
+        self.assertEqual(self.path(3), self.index.current)  # stays listed while current
+        self.assertEqual(2, self.index.position)
+        self.change(added=[self.path(0)], removed=[self.path(1)])
+        self.assertEqual([self.path(i) for i in (0, 2, 3, 10, 20)], list(self.index.files))
+        self.assertEqual(2, self.index.position)
+        self.index.position = 3  # next, which leaves the removed file behind
+        self.assertEqual(self.path(10), self.index.current)
+        self.assertEqual([self.path(i) for i in (0, 2, 10, 20)], list(self.index.files))
+        self.assertEqual(2, self.index.position)
+
+    def test_current_removed_then_previous(self):
+        self.change(removed=[self.path(3)])
+        self.index.position = 1
+        self.assertEqual(self.path(2), self.index.current)
+        self.assertEqual([self.path(i) for i in (1, 2, 10, 20)], list(self.index.files))
+
+    def test_current_replaced(self):
+        self.change(removed=[self.path(3)])
+        self.change(added=[self.path(3)])  # written again under the same name
+        self.index.position = 3
+        self.assertEqual([self.path(i) for i in (1, 2, 3, 10, 20)], list(self.index.files))
+        self.assertEqual(self.path(10), self.index.current)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from vmg.folder_scan import SETTLE_SECONDS, FolderScanner
+from vmg.natural_sort import natural_sort_key
+
+
+class TestFolderScan(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.scanner = FolderScanner()
+        self.batches = []
+        self.finished = []
+        self.scanner.files_found.connect(lambda scan_id, batch: self.batches.append((scan_id, batch)))
+        self.scanner.scan_finished.connect(lambda scan_id, count: self.finished.append((scan_id, count)))
+        self.changes = []
+        self.scanner.files_changed.connect(lambda scan_id, changes: self.changes.append(changes))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name: str, data: bytes = b"x") -> str:
+        path = os.path.join(self.folder, name)
+        with open(path, "wb") as out:
+            out.write(data)
+        return path
+
+    def write_old(self, name: str, data: bytes = b"x") -> str:
+        """A file last written long enough ago to be listed at once"""
+        path = self.write(name, data)
+        then = time.time() - 10 * SETTLE_SECONDS
+        os.utime(path, (then, then))
+        return path
+
+    def test_scan(self):
+        names = ["img10.jpg", "img2.JPG", "img1.png", "opened.jpg", "notes.txt"]
+        for name in names:
+            self.write(name)
+        os.mkdir(os.path.join(self.folder, "folder.jpg"))
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.scan(scan_id, self.folder, "opened.jpg")
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual([(scan_id, 3)], self.finished)
+        found = [path for _key, path in self.batches[0][1]]
+        self.assertEqual(["img1.png", "img2.JPG", "img10.jpg"], [os.path.basename(path) for path in found])
+        for key, path in self.batches[0][1]:
+            self.assertEqual(natural_sort_key(path), key)
+
+    def test_scan_batches(self):
+        for index in range(20):
+            self.write(f"img{index}.jpg")
+        scan_id = self.scanner.new_scan_id()
+        with mock.patch("vmg.folder_scan.SCAN_BATCH_SECONDS", 0):
+            self.scanner.scan(scan_id, self.folder, "img0.jpg")
+        self.assertGreater(len(self.batches), 1)
+        found = []
+        for batch_scan_id, batch in self.batches:
+            self.assertEqual(scan_id, batch_scan_id)
+            self.assertEqual(sorted(batch, key=lambda entry: entry[0]), batch)
+            found += [os.path.basename(path) for _key, path in batch]
+        self.assertEqual(sorted(f"img{index}.jpg" for index in range(1, 20)), sorted(found))
+        self.assertEqual([(scan_id, 19)], self.finished)
+
+    def test_scan_canceled(self):
+        self.write("img1.jpg")
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.cancel()
+        self.scanner.scan(scan_id, self.folder, "opened.jpg")
+        self.assertEqual([], self.batches)
+        self.assertEqual([], self.finished)
+
+    def test_scan_missing_folder(self):
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.scan(scan_id, os.path.join(self.folder, "missing"), "opened.jpg")
+        self.assertEqual([], self.batches)
+        self.assertEqual([(scan_id, 0)], self.finished)
+
+    def test_rescan(self):
+        self.write_old("img1.jpg")
+        self.write_old("img2.jpg")
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.scan(scan_id, self.folder, "img1.jpg")
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertEqual([], self.changes)  # nothing changed
+        os.remove(os.path.join(self.folder, "img2.jpg"))
+        added = [self.write_old("img10.jpg", b"xyz"), self.write_old("img3.jpg")]
+        self.write_old("notes.txt")
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertEqual(1, len(self.changes))
+        changes = self.changes[0]
+        self.assertEqual([os.path.join(self.folder, "img2.jpg")], changes.removed)
+        self.assertEqual(sorted(added, key=natural_sort_key), [path for _key, path in changes.added])
+        self.assertIn(changes.newest, added)
+        self.assertEqual(os.stat(changes.newest).st_mtime, changes.newest_mtime)
+        self.assertFalse(changes.is_settling)
+
+    @mock.patch("vmg.folder_scan.SETTLE_SECONDS", 60)  # however slowly the test runs
+    def test_rescan_settle(self):
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.scan(scan_id, self.folder, "opened.jpg")
+        path = self.write("img1.jpg", b"partial")
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertEqual(1, len(self.changes))
+        self.assertTrue(self.changes[0].is_settling)  # just written, and its size is not yet known to hold
+        self.assertEqual([], self.changes[0].added)
+        with open(path, "ab") as out:
+            out.write(b" and the rest")
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertTrue(self.changes[1].is_settling)  # still growing
+        self.assertEqual([], self.changes[1].added)
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertFalse(self.changes[2].is_settling)  # the same size as at the listing before
+        self.assertEqual([path], [path for _key, path in self.changes[2].added])
+
+    @mock.patch("vmg.folder_scan.SETTLE_SECONDS", 60)  # however slowly the test runs
+    def test_rescan_settle_empty(self):
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.scan(scan_id, self.folder, "opened.jpg")
+        path = self.write("img1.jpg", b"")
+        self.scanner.rescan(scan_id, self.folder)
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertTrue(all(changes.is_settling and not changes.added for changes in self.changes))
+        then = time.time() - 120  # an empty file settles only with time
+        os.utime(path, (then, then))
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertEqual([path], [path for _key, path in self.changes[-1].added])
+
+    @mock.patch("vmg.folder_scan.SETTLE_SECONDS", 60)  # however slowly the test runs
+    def test_rescan_removed_while_settling(self):
+        scan_id = self.scanner.new_scan_id()
+        self.scanner.scan(scan_id, self.folder, "opened.jpg")
+        path = self.write("img1.jpg")
+        self.scanner.rescan(scan_id, self.folder)
+        os.remove(path)
+        self.scanner.rescan(scan_id, self.folder)
+        self.assertEqual(1, len(self.changes))  # never listed, so nothing to remove
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+from PIL import Image
+
+from vmg.image_formats import HEADER_SIZE, ImageFileFormat, map_pil_pixels, register_format, sniff_format
+
+
+def pil_header(file_format: str, **params) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(out, file_format, **params)
+    return out.getvalue()[:HEADER_SIZE]
+
+
+class TestSniffFormat(unittest.TestCase):
+    def test_jpeg(self):
+        self.assertEqual(ImageFileFormat.JPEG, sniff_format(b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"))
+        self.assertEqual(ImageFileFormat.JPEG, sniff_format(b"\xff\xd8\xff\xe1\x00\x10Exif\x00"))
+        self.assertEqual(ImageFileFormat.JPEG, sniff_format(pil_header("JPEG")))
+
+    def test_tiff(self):
+        for header in (b"II*\x00\x08\x00\x00\x00", b"MM\x00*\x00\x00\x00\x08", b"II+\x00\x08\x00\x00\x00",
+                       b"MM\x00+\x00\x08\x00\x00"):
+            self.assertEqual(ImageFileFormat.TIFF, sniff_format(header), header)
+        self.assertEqual(ImageFileFormat.TIFF, sniff_format(pil_header("TIFF")))
+
+    def test_heif(self):
+        for brand in (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1"):
+            header = b"\x00\x00\x00\x18ftyp" + brand + b"\x00\x00\x00\x00"
+            self.assertEqual(ImageFileFormat.HEIF, sniff_format(header), brand)
+        # Other ISO base media files, such as videos, are not still images
+        self.assertEqual(ImageFileFormat.OTHER, sniff_format(b"\x00\x00\x00\x18ftypisom\x00\x00\x00\x00"))
+
+    def test_other(self):
+        self.assertEqual(ImageFileFormat.OTHER, sniff_format(pil_header("PNG")))
+        self.assertEqual(ImageFileFormat.OTHER, sniff_format(pil_header("BMP")))
+        self.assertEqual(ImageFileFormat.OTHER, sniff_format(b"\xff\xd8"))  # too short for any signature
+        self.assertEqual(ImageFileFormat.OTHER, sniff_format(b""))
+        self.assertEqual(ImageFileFormat.OTHER, sniff_format(b"I*\x00II*\x00"))
+
+    def test_register_format(self):
+        with mock.patch("vmg.image_formats._signatures", []) as signatures:
+            signatures.append((ImageFileFormat.JPEG, lambda header: header[:3] == b"\xff\xd8\xff"))
+            register_format(ImageFileFormat.OTHER, lambda header: header[3:4] == b"\xdb")
+            self.assertEqual(ImageFileFormat.OTHER, sniff_format(b"\xff\xd8\xff\xdb"))  # the latest goes first
+            self.assertEqual(ImageFileFormat.JPEG, sniff_format(b"\xff\xd8\xff\xe0"))
+
+
+class TestMapPilPixels(unittest.TestCase):
+    def test_ppm_file(self):
+        pixels = numpy.random.default_rng(0).integers(0, 255, size=(30, 40, 3), dtype=numpy.uint8)
+        handle, file_name = tempfile.mkstemp(suffix=".ppm")
+        os.close(handle)
+        try:
+            Image.fromarray(pixels).save(file_name)
+            with Image.open(file_name) as pil_image:
+                mapped = map_pil_pixels(pil_image, file_name)
+            self.assertIsNotNone(mapped)
+            numpy.testing.assert_array_equal(pixels, mapped.array)
+        finally:
+            os.remove(file_name)
+
+    def test_in_memory(self):
+        pil_image = Image.new("RGB", (8, 8))  # no file, so nothing to map
+        self.assertIsNone(map_pil_pixels(pil_image, "synthetic"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import threading
+import time
+import unittest
+
+from PySide6 import QtCore
+
+from vmg.cancellation import CancellationToken
+from vmg.image_prefetcher import ImagePrefetcher, neighbor_indices
+
+
+class TestNeighborIndices(unittest.TestCase):
+    def test_direction(self):
+        self.assertEqual([6, 7, 4], neighbor_indices(5, 10, 2, 1))
+        self.assertEqual([4, 3, 6], neighbor_indices(5, 10, 2, -1))
+        self.assertEqual([6, 4, 7, 3], neighbor_indices(5, 10, 2, 0))
+        self.assertEqual([1, 2, 9], neighbor_indices(0, 10, 2, 1))  # wraps around
+
+
+class TestTake(unittest.TestCase):
+    def setUp(self):
+        self.thread = QtCore.QThread()
+        self.prefetcher = ImagePrefetcher(target_thread=self.thread)
+
+    def test_canceled_take(self):
+        # A prefetch of the file is in progress, in a worker that will not finish soon
+        decode_token = CancellationToken()
+        self.prefetcher._decoding["big.tif"] = decode_token
+        load_token = CancellationToken()
+        canceler = threading.Timer(0.1, load_token.cancel)
+        canceler.start()
+        t0 = time.perf_counter()
+        image = self.prefetcher.take("big.tif", load_token)
+        elapsed = time.perf_counter() - t0
+        canceler.join()
+        self.assertIsNone(image)
+        self.assertLess(elapsed, 1.0)
+        self.assertIn("big.tif", self.prefetcher._decoding)  # still decoding
+        self.assertFalse(decode_token.is_canceled)
+        self.assertIsNone(self.prefetcher._awaited)
+
+    def test_miss(self):
+        self.assertIsNone(self.prefetcher.take("missing.jpg", CancellationToken()))
+        self.assertEqual(1, self.prefetcher.miss_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import random
+import unittest
+from unittest import mock
+
+from vmg.natural_sort import NaturallySortedList, natural_sort_key
+
+
+def keyed(items) -> list:
+    return sorted(((natural_sort_key(item), item) for item in items), key=lambda entry: entry[0])
+
+
+class TestNaturallySortedList(unittest.TestCase):
+    def check(self, expected: list, actual: NaturallySortedList):
+        self.assertEqual(expected, list(actual))
+        self.assertEqual(len(expected), len(actual))
+        for index, item in enumerate(expected):
+            self.assertEqual(item, actual[index])
+            self.assertEqual(index, actual.index(item))
+        if len(expected) > 0:
+            self.assertEqual(expected[-1], actual[-1])
+
+    def test_natural_order(self):
+        items = NaturallySortedList(["img10.jpg", "IMG9.jpg", "img100.jpg", "img1.jpg"])
+        self.check(["img1.jpg", "IMG9.jpg", "img10.jpg", "img100.jpg"], items)
+
+    def test_add_and_remove(self):
+        items = NaturallySortedList(["b2", "b4"])
+        items.add_keyed(keyed(["b3", "a", "c"]))
+        self.check(["a", "b2", "b3", "b4", "c"], items)
+        items.remove("b3")
+        items.remove("a")
+        self.check(["b2", "b4", "c"], items)
+        with self.assertRaises(ValueError):
+            items.remove("b3")
+        with self.assertRaises(ValueError):
+            items.index("b10")
+        with self.assertRaises(IndexError):
+            _item = items[3]
+
+    def test_equal_keys(self):
+        items = NaturallySortedList(["x1", "X1"])
+        items.add_keyed(keyed(["x01"]))
+        self.check(["x1", "X1", "x01"], items)  # in the order added
+        items.remove("X1")
+        self.check(["x1", "x01"], items)
+
+    def test_empty(self):
+        items = NaturallySortedList()
+        self.check([], items)
+        items.add_keyed(keyed(["a"]))
+        items.remove("a")
+        self.check([], items)
+        items.add_keyed(keyed(["b"]))
+        self.check(["b"], items)
+
+    @mock.patch("vmg.natural_sort._CHUNK_SIZE", 4)  # many chunks, splitting and merging often
+    def test_random_changes(self):
+        rng = random.Random(0)
+        names = [f"img{rng.randrange(500)}.jpg" for _ in range(30)]
+        items = NaturallySortedList(names)
+        expected = sorted(names, key=natural_sort_key)
+        for _change in range(200):
+            if rng.random() < 0.5 or len(expected) == 0:
+                batch = [f"img{rng.randrange(500)}.jpg" for _ in range(rng.choice((1, 2, 3, 5, 8, 300)))]
+                items.add_keyed(keyed(batch))
+                expected = sorted(expected + batch, key=natural_sort_key)  # stable, like the list
+            else:
+                name = rng.choice(expected)
+                items.remove(name)
+                expected.remove(name)
+            self.assertEqual(expected, list(items))
+            for index in range(0, len(expected), 1 + len(expected) // 50):
+                self.assertEqual(expected[index], items[index])
+                self.assertEqual(expected.index(expected[index]), items.index(expected[index]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import unittest
+
+import numpy
+from PIL import Image
+
+from vmg.pyjpeg import decode_region, iter_progressive_scans
+
+
+def synthetic_jpeg(width: int, height: int, subsampling: int) -> bytes:
+    """Smooth gradients with noise, saved with the given PIL chroma subsampling, 0 for 4:4:4 or 2 for 4:2:0"""
+    y, x = numpy.mgrid[0:height, 0:width]
+    rgb = numpy.stack([(3 * x + y) % 256, (7 * x) % 256, (y // 3) % 256], axis=-1)
+    rgb += numpy.random.default_rng(0).integers(0, 40, size=rgb.shape)
+    out = io.BytesIO()
+    Image.fromarray(rgb.clip(0, 255).astype(numpy.uint8)).save(out, "JPEG", quality=90, subsampling=subsampling)
+    return out.getvalue()
+
+
+class TestDecodeRegion(unittest.TestCase):
+    regions = [
+        (32, 16, 64, 64),
+        (0, 0, 17, 9),  # top left corner
+        (283, 4990, 17, 10),  # bottom right corner
+        (5, 333, 100, 77),
+        (150, 1000, 150, 4000),
+    ]
+
+    def check_regions(self, subsampling: int):
+        data = synthetic_jpeg(300, 5000, subsampling)
+        full = numpy.array(Image.open(io.BytesIO(data)))
+        for left, top, width, height in self.regions:
+            region = decode_region(io.BytesIO(data), left, top, width, height)
+            self.assertEqual((height, width, 3), region.shape)
+            numpy.testing.assert_array_equal(full[top:top + height, left:left + width], region)
+
+    def test_region_444(self):
+        self.check_regions(subsampling=0)
+
+    def test_region_420(self):
+        self.check_regions(subsampling=2)
+
+    def test_region_outside_image(self):
+        data = synthetic_jpeg(64, 64, 0)
+        with self.assertRaises(ValueError):
+            decode_region(io.BytesIO(data), 32, 32, 64, 16)
+
+
+class TestProgressiveScans(unittest.TestCase):
+    def test_scans(self):
+        baseline = synthetic_jpeg(120, 80, 2)
+        out = io.BytesIO()
+        Image.open(io.BytesIO(baseline)).save(out, "JPEG", quality=90, progressive=True)
+        data = out.getvalue()
+        scan_numbers = []
+        pixels = None
+        for scan_number, pixels in iter_progressive_scans(io.BytesIO(data)):
+            scan_numbers.append(scan_number)
+        self.assertGreater(len(scan_numbers), 1)
+        self.assertEqual(sorted(set(scan_numbers)), scan_numbers)  # strictly increasing, so the last comes once
+        numpy.testing.assert_array_equal(numpy.array(Image.open(io.BytesIO(data))), pixels)
+
+    def test_throttled_scans(self):
+        out = io.BytesIO()
+        Image.open(io.BytesIO(synthetic_jpeg(64, 48, 0))).save(out, "JPEG", progressive=True)
+        scan_numbers = [scan_number for scan_number, _ in iter_progressive_scans(io.BytesIO(out.getvalue()), 60.0)]
+        self.assertEqual(2, len(scan_numbers))  # the first scan, then only the final one
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import io
+import unittest
+
+import numpy
+import tifffile
+
+from vmg.cancellation import CancellationToken, LoadCanceled
+from vmg.tiff_segments import iter_decode_segments
+
+
+def synthetic_pixels(height: int, width: int, samples: int, dtype=numpy.uint8):
+    rng = numpy.random.default_rng(0)
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    return rng.integers(0, numpy.iinfo(dtype).max, size=shape, dtype=dtype)
+
+
+class TestIterDecodeSegments(unittest.TestCase):
+    def check(self, pixels, **write_args):
+        out = io.BytesIO()
+        tifffile.imwrite(out, pixels, **write_args)
+        out.seek(0)
+        with tifffile.TiffFile(out) as tif:
+            page = tif.pages[0]
+            expected = page.asarray()
+            decoded = numpy.zeros_like(expected)
+            row_counts = list(iter_decode_segments(page, decoded))
+        numpy.testing.assert_array_equal(expected, decoded)
+        if write_args.get("compression") != "jpeg":  # lossy, so only the same as page.asarray()
+            numpy.testing.assert_array_equal(pixels, decoded)
+        self.assertEqual(sorted(set(row_counts)), row_counts)  # only ever grows
+        self.assertEqual(page.imagelength, row_counts[-1])
+        return row_counts
+
+    def test_strips(self):
+        row_counts = self.check(synthetic_pixels(100, 70, 3), rowsperstrip=16)
+        self.assertEqual([16, 32, 48, 64, 80, 96, 100], row_counts)
+
+    def test_compressed_strips(self):
+        self.check(synthetic_pixels(100, 70, 1, numpy.uint16), rowsperstrip=7, compression="zlib")
+
+    def test_tiles(self):
+        # Neither dimension is a whole number of tiles
+        row_counts = self.check(synthetic_pixels(100, 70, 3), tile=(32, 32))
+        self.assertEqual([32, 64, 96, 100], row_counts)
+
+    def test_compressed_tiles(self):
+        self.check(synthetic_pixels(90, 130, 1, numpy.uint16), tile=(32, 48), compression="zlib")
+        self.check(synthetic_pixels(90, 130, 3), tile=(32, 48), compression="jpeg")
+
+    def test_planar(self):
+        pixels = numpy.moveaxis(synthetic_pixels(50, 40, 3), -1, 0)
+        row_counts = self.check(pixels, photometric="rgb", planarconfig="separate", rowsperstrip=8)
+        self.assertEqual([8, 16, 24, 32, 40, 48, 50], row_counts)  # only once the last plane has them
+        self.check(pixels, photometric="rgb", planarconfig="separate", tile=(16, 16))
+
+    def test_canceled(self):
+        out = io.BytesIO()
+        tifffile.imwrite(out, synthetic_pixels(100, 70, 3), rowsperstrip=4)
+        out.seek(0)
+        token = CancellationToken()
+        with tifffile.TiffFile(out) as tif:
+            page = tif.pages[0]
+            decoded = numpy.zeros(page.shape, page.dtype)
+            segments = iter_decode_segments(page, decoded, token)
+            next(segments)
+            token.cancel()
+            with self.assertRaises(LoadCanceled):
+                list(segments)
+
+
+if __name__ == '__main__':
+    unittest.main()
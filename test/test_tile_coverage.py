@@ -0,0 +1,151 @@
+from math import pi
+import unittest
+
+import numpy
+
+from vmg.display_projection import DisplayProjection
+from vmg.interfaces import InputFormat
+from vmg.tile_coverage import FULL_SCREEN_NDC, SphereTileCoverage, ndc_bounds_for_tiles
+
+
+class Tile(object):
+    def __init__(self, rtc_bounds: tuple[float, float, float, float]):
+        self.rtc_bounds = rtc_bounds
+
+
+class Metadata(object):
+    def __init__(self, input_format: InputFormat):
+        self.input_format = input_format
+        self.pcm_R_geo = numpy.eye(3)
+        self.inscribed_fov_radians = pi
+        self.df_lens_rot_radians = 0.0
+
+
+class Image(object):
+    def __init__(self, input_format=InputFormat.EQUIRECTANGULAR, tiles=()):
+        self.md = Metadata(input_format)
+        self.tiles = list(tiles)
+
+
+class State(object):
+    def __init__(self, projection: DisplayProjection, geo_rot_usr, zoom: float, window_size=(800, 600)):
+        self.display_projection = projection
+        self.geo_rot_usr = geo_rot_usr
+        self.zoom = zoom
+        self.window_size = window_size
+
+
+def rotation(yaw: float, pitch: float) -> numpy.ndarray:
+    cy, sy = numpy.cos(yaw), numpy.sin(yaw)
+    cp, sp = numpy.cos(pitch), numpy.sin(pitch)
+    about_y = numpy.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    about_x = numpy.array([[1, 0, 0], [0, cp, -sp], [0, sp, cp]])
+    return about_y @ about_x
+
+
+def tile_grid(columns: int, rows: int) -> list[Tile]:
+    return [
+        Tile((c / columns, r / rows, (c + 1) / columns, (r + 1) / rows))
+        for r in range(rows)
+        for c in range(columns)
+    ]
+
+
+def sampled_ndc(tile: Tile, state: State, image: Image, count: int = 24) -> numpy.ndarray:
+    """Screen positions of points throughout an equirectangular tile, where the projection reaches them"""
+    u0, v0, u1, v1 = tile.rtc_bounds
+    u, v = numpy.meshgrid(numpy.linspace(u0, u1, count), numpy.linspace(v0, v1, count))
+    lon = (u - 0.5) * 2.0 * pi
+    lat = (v - 0.5) * pi
+    pcm = numpy.stack([numpy.cos(lat) * numpy.sin(lon), -numpy.sin(lat), -numpy.cos(lat) * numpy.cos(lon)], axis=-1)
+    usr = pcm.reshape(-1, 3) @ (image.md.pcm_R_geo @ state.geo_rot_usr)
+    x, y, z = usr[:, 0], usr[:, 1], usr[:, 2]
+    if state.display_projection == DisplayProjection.GNOMONIC:
+        keep = z < -0.01
+        nic = numpy.stack([x, y], axis=-1)[keep] / -z[keep, None]
+    elif state.display_projection == DisplayProjection.STEREOGRAPHIC:
+        keep = z < 0.99
+        nic = 2.0 * numpy.stack([x, y], axis=-1)[keep] / (1.0 - z[keep, None])
+    else:  # equidistant
+        d = numpy.arccos(numpy.clip(-z, -1.0, 1.0))
+        keep = (d > 1e-6) & (d < pi - 0.01)
+        nic = numpy.stack([x, y], axis=-1)[keep] * (d[keep] / numpy.sin(d[keep]))[:, None]
+    w, h = state.window_size
+    scale = pi / 2.0 / min(w, h) / state.zoom
+    return nic / numpy.array([scale * w, scale * h])
+
+
+class TestNdcBoundsForTiles(unittest.TestCase):
+    def test_bounds_contain_projected_points(self):
+        image = Image()
+        tiles = tile_grid(16, 8)
+        for projection in (DisplayProjection.GNOMONIC, DisplayProjection.STEREOGRAPHIC, DisplayProjection.EQUIDISTANT):
+            for yaw, pitch in ((0.0, 0.0), (1.0, 0.4), (-2.5, -1.2), (0.3, pi / 2)):
+                for zoom in (0.5, 1.0, 4.0):
+                    state = State(projection, rotation(yaw, pitch), zoom)
+                    bounds = ndc_bounds_for_tiles(tiles, state, image)
+                    self.assertEqual(len(tiles), len(bounds))
+                    for tile, rect in zip(tiles, bounds):
+                        ndc = sampled_ndc(tile, state, image)
+                        on_screen = ndc[numpy.all(numpy.abs(ndc) <= 1.0, axis=1)]
+                        context = (projection, yaw, pitch, zoom, tile.rtc_bounds)
+                        if rect is None:
+                            self.assertEqual(0, len(on_screen), context)
+                            continue
+                        x0, y0, x1, y1 = rect
+                        self.assertTrue(numpy.all(on_screen[:, 0] >= x0) and numpy.all(on_screen[:, 0] <= x1), context)
+                        self.assertTrue(numpy.all(on_screen[:, 1] >= y0) and numpy.all(on_screen[:, 1] <= y1), context)
+
+    def test_bounds_are_tight_when_zoomed_in(self):
+        image = Image()
+        tiles = tile_grid(16, 8)
+        state = State(DisplayProjection.GNOMONIC, numpy.eye(3), 4.0)
+        bounds = ndc_bounds_for_tiles(tiles, state, image)
+        drawn = [rect for rect in bounds if rect is not None]
+        self.assertLess(len(drawn), len(tiles) // 4)  # most tiles are behind, or beside, the view
+        self.assertNotIn(FULL_SCREEN_NDC, drawn)  # even those reaching behind the viewer
+
+    def test_behind_viewer(self):
+        # Stereographic sends the direction behind the viewer, at the seam of the image, to infinity
+        image = Image()
+        tiles = tile_grid(16, 8)
+        state = State(DisplayProjection.STEREOGRAPHIC, numpy.eye(3), 1.0)
+        bounds = ndc_bounds_for_tiles(tiles, state, image)
+        u0, v0, u1, v1 = numpy.array([tile.rtc_bounds for tile in tiles]).T
+        surrounding = (u1 == 1.0) & (v0 <= 0.5) & (0.5 <= v1)
+        self.assertEqual(2, numpy.count_nonzero(surrounding))
+        behind = [rect for rect, is_surrounding in zip(bounds, surrounding) if is_surrounding]
+        self.assertEqual([FULL_SCREEN_NDC] * 2, behind)
+
+    def test_dual_fisheye_lens(self):
+        image = Image(InputFormat.DUAL_FISHEYE)
+        tiles = [Tile((0.0, 0.0, 0.5, 1.0)), Tile((0.5, 0.0, 1.0, 1.0))]
+        state = State(DisplayProjection.GNOMONIC, numpy.eye(3), 1.0)
+        front = ndc_bounds_for_tiles(tiles, state, image, render_pass=1)
+        rear = ndc_bounds_for_tiles(tiles, state, image, render_pass=2)
+        self.assertIsNone(front[0])  # the rear lens, on the left
+        self.assertIsNotNone(front[1])
+        self.assertIsNotNone(rear[0])
+        self.assertIsNone(rear[1])
+
+    def test_empty_window(self):
+        tiles = tile_grid(2, 1)
+        state = State(DisplayProjection.GNOMONIC, numpy.eye(3), 1.0, window_size=(0, 0))
+        self.assertEqual([FULL_SCREEN_NDC] * 2, ndc_bounds_for_tiles(tiles, state, Image()))
+        self.assertEqual([], ndc_bounds_for_tiles([], state, Image()))
+
+
+class TestSphereTileCoverage(unittest.TestCase):
+    def test_new_layout(self):
+        coverage = SphereTileCoverage()
+        state = State(DisplayProjection.STEREOGRAPHIC, rotation(0.3, 0.2), zoom=2.0)
+        image = Image(tiles=tile_grid(4, 2))
+        self.assertIs(coverage.ndc_bounds(state, image), coverage.ndc_bounds(state, image))  # cached
+        # Same object, tile count and metadata, as for a new image that reuses a freed image's id()
+        image.tiles = [Tile((0.0, 0.0, 0.5, 0.25 * (r + 1))) for r in range(8)]
+        expected = ndc_bounds_for_tiles(image.tiles, state, image)
+        self.assertEqual(expected, coverage.ndc_bounds(state, image))
+
+
+if __name__ == '__main__':
+    unittest.main()
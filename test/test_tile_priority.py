@@ -0,0 +1,106 @@
+import threading
+import unittest
+
+from vmg.exif_orientation import ExifOrientation
+from vmg.tile_priority import FlatView, ViewHint
+
+
+class Region(object):
+    def __init__(self, left: int, top: int, width: int, height: int):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+
+class Metadata(object):
+    def __init__(self, size_rpx: tuple[int, int], orientation: ExifOrientation):
+        self.size_rpx = size_rpx
+        self.orientation = orientation
+
+
+class Image(object):
+    def __init__(self, size_rpx=(1000, 600), orientation=ExifOrientation.ROTATE_0):
+        self.md = Metadata(size_rpx, orientation)
+
+
+def grid(size_rpx: tuple[int, int], tile_size: int) -> list[Region]:
+    return [
+        Region(left, top, tile_size, tile_size)
+        for top in range(0, size_rpx[1], tile_size)
+        for left in range(0, size_rpx[0], tile_size)
+    ]
+
+
+class TestFlatView(unittest.TestCase):
+    def test_visible_first(self):
+        image = Image()
+        view = FlatView(center_opx=(250.0, 150.0), half_size_opx=(100.0, 100.0))
+        on_screen = view.key(Region(200, 100, 100, 100), image)
+        touching = view.key(Region(300, 200, 100, 100), image)
+        near = view.key(Region(400, 100, 100, 100), image)
+        far = view.key(Region(800, 500, 100, 100), image)
+        self.assertEqual((0, 0.0), on_screen)
+        self.assertEqual(0, touching[0])
+        self.assertEqual(1, near[0])
+        self.assertEqual(1, far[0])
+        self.assertLess(on_screen, touching)
+        self.assertLess(touching, near)
+        self.assertLess(near, far)
+
+    def test_order_spreads_from_center(self):
+        image = Image()
+        view = FlatView(center_opx=(500.0, 300.0), half_size_opx=(150.0, 150.0))
+        tiles = grid(image.md.size_rpx, 100)
+        ordered = sorted(tiles, key=lambda tci: view.key(tci, image))
+        first = ordered[0]
+        self.assertTrue(first.left <= 500 <= first.left + first.width)
+        self.assertTrue(first.top <= 300 <= first.top + first.height)
+        keys = [view.key(tci, image) for tci in ordered]
+        visible = sum(1 for key in keys if key[0] == 0)
+        self.assertEqual(16, visible)  # 4 x 4 tiles meet the 300 x 300 pixel view
+        self.assertEqual(keys, sorted(keys))
+
+    def test_orientation(self):
+        # Raw tiles along the left edge are at the top of an image rotated a quarter turn clockwise
+        image = Image(size_rpx=(1000, 600), orientation=ExifOrientation.ROTATE_90_CW)
+        view = FlatView(center_opx=(300.0, 50.0), half_size_opx=(50.0, 50.0))
+        left_edge = view.key(Region(0, 200, 100, 200), image)
+        right_edge = view.key(Region(900, 200, 100, 200), image)
+        self.assertEqual(0, left_edge[0])
+        self.assertEqual(1, right_edge[0])
+
+    def test_equality(self):
+        self.assertEqual(FlatView((1.0, 2.0), (3.0, 4.0)), FlatView((1.0, 2.0), (3.0, 4.0)))
+        self.assertNotEqual(FlatView((1.0, 2.0), (3.0, 4.0)), FlatView((1.0, 2.0), (3.0, 5.0)))
+
+
+class TestViewHint(unittest.TestCase):
+    def test_revision(self):
+        hint = ViewHint()
+        image = Image()
+        other = Image()
+        view = FlatView((1.0, 2.0), (3.0, 4.0))
+        revision, published = hint.view_for(image)
+        self.assertIsNone(published)
+        hint.publish(image, view)
+        revision2, published = hint.view_for(image)
+        self.assertEqual(view, published)
+        self.assertGreater(revision2, revision)
+        hint.publish(image, FlatView((1.0, 2.0), (3.0, 4.0)))  # no change
+        self.assertEqual(revision2, hint.view_for(image)[0])
+        hint.publish(image, FlatView((5.0, 2.0), (3.0, 4.0)))
+        self.assertGreater(hint.view_for(image)[0], revision2)
+        self.assertIsNone(hint.view_for(other)[1])  # a view of another image
+
+    def test_window_size(self):
+        hint = ViewHint()
+        self.assertEqual((0, 0), hint.window_size)
+        thread = threading.Thread(target=hint.set_window_size, args=(640.0, 480.0))
+        thread.start()
+        thread.join()
+        self.assertEqual((640, 480), hint.window_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
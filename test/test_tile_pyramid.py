@@ -0,0 +1,142 @@
+import unittest
+from unittest import mock
+
+import numpy
+
+from vmg.cancellation import CancellationToken, LoadCanceled
+from vmg.exif_orientation import ExifOrientation
+from vmg.tile_pyramid import downsample_2x, level_sizes, TilePixelStore, TilePyramid
+from vmg.tiled_image import tile_layout
+
+
+def block_means(array) -> numpy.ndarray:
+    h, w = array.shape[0] // 2, array.shape[1] // 2
+    blocks = array[:2 * h, :2 * w].astype(numpy.float64).reshape((h, 2, w, 2) + array.shape[2:])
+    return blocks.mean(axis=(1, 3))
+
+
+class TestDownsample(unittest.TestCase):
+    def test_rounding(self):
+        array = numpy.array([[1, 2], [3, 4]], dtype=numpy.uint8)
+        self.assertEqual([[3]], downsample_2x(array).tolist())  # 2.5 rounds up
+        array = numpy.array([[1, 1], [1, 2]], dtype=numpy.uint8)
+        self.assertEqual([[1]], downsample_2x(array).tolist())  # 1.25 rounds down
+
+    def test_no_overflow(self):
+        for dtype in (numpy.uint8, numpy.uint16):
+            array = numpy.full((4, 6, 3), numpy.iinfo(dtype).max, dtype=dtype)
+            result = downsample_2x(array)
+            self.assertEqual(dtype, result.dtype)
+            self.assertTrue(numpy.all(result == numpy.iinfo(dtype).max))
+
+    def test_matches_block_means(self):
+        rng = numpy.random.default_rng(0)
+        for shape, dtype in (((37, 53), numpy.uint8), ((20, 31, 3), numpy.uint16), ((9, 8, 4), numpy.float32)):
+            array = (rng.random(shape) * 1000).astype(dtype)
+            with mock.patch("vmg.tile_pyramid._DOWNSAMPLE_BAND_ROWS", 4):  # several bands
+                result = downsample_2x(array)
+            self.assertEqual((shape[0] // 2, shape[1] // 2) + shape[2:], result.shape)
+            tolerance = 1e-4 if dtype == numpy.float32 else 0.5  # integers round to nearest
+            numpy.testing.assert_allclose(block_means(array), result, atol=tolerance)
+
+    def test_thin(self):
+        row = numpy.arange(8, dtype=numpy.uint8).reshape(1, 8)
+        self.assertEqual([[1, 3, 5, 7]], downsample_2x(row).tolist())  # 0.5, 2.5, ... round up
+        column = numpy.arange(8, dtype=numpy.float32).reshape(8, 1)
+        self.assertEqual([[0.5], [2.5], [4.5], [6.5]], downsample_2x(column).tolist())
+
+    def test_canceled(self):
+        token = CancellationToken()
+        token.cancel()
+        with self.assertRaises(LoadCanceled):
+            downsample_2x(numpy.zeros((4, 4), dtype=numpy.uint8), token)
+
+
+class TestLevelSizes(unittest.TestCase):
+    def test_level_sizes(self):
+        self.assertEqual(
+            [(5000, 3000), (2500, 1500), (1250, 750), (625, 375)],
+            level_sizes((5000, 3000), 1024))
+        self.assertEqual([(1024, 1024)], level_sizes((1024, 1024), 1024))
+        self.assertEqual([(1025, 3), (512, 1)], level_sizes((1025, 3), 1024))
+
+    def test_downsampling_gives_level_sizes(self):
+        for size in ((1000, 700), (999, 1), (1, 333), (257, 3)):
+            sizes = level_sizes(size, 64)
+            array = numpy.zeros((size[1], size[0]), dtype=numpy.uint8)
+            for level_size in sizes[1:]:
+                array = downsample_2x(array)
+                self.assertEqual(level_size, (array.shape[1], array.shape[0]), size)
+            self.assertLessEqual(max(sizes[-1]), 64)
+
+
+class Metadata(object):
+    def __init__(self, size_rpx: tuple[int, int]):
+        self.size_rpx = size_rpx
+        self.orientation = ExifOrientation.ROTATE_0
+        self.channel_count = 3
+        self.file_name = "synthetic"
+
+
+class Image(object):
+    def __init__(self, array):
+        self.md = Metadata((array.shape[1], array.shape[0]))
+        self.array = array
+        self.tex_format = None
+
+
+class TestTilePixelStore(unittest.TestCase):
+    def test_blocks(self):
+        store = TilePixelStore()
+        store.reserve((0, 0), (5, 7, 3), numpy.dtype(numpy.uint8))
+        store.reserve((0, 0), (2, 3, 3), numpy.dtype(numpy.uint8))
+        store.reserve((0, 1), (4, 4), numpy.dtype(numpy.uint16))
+        store.allocate()
+        for key, mip_level, value in (((0, 0), 0, 1), ((0, 0), 1, 2), ((0, 1), 0, 3)):
+            store.pixels(key, mip_level)[...] = value
+        store.page_out((0, 0))
+        self.assertTrue(numpy.all(store.pixels((0, 0), 0) == 1))  # read back from the file
+        self.assertTrue(numpy.all(store.pixels((0, 0), 1) == 2))
+        self.assertTrue(numpy.all(store.pixels((0, 1), 0) == 3))
+        self.assertEqual((4, 4), store.pixels((0, 1), 0).shape)
+        self.assertNotIn((1, 0), store)
+
+
+class TestTilePyramid(unittest.TestCase):
+    def test_fine_tiles_paged(self):
+        # Levels of 50x38, 25x19, 12x9 and 6x4, in tiles of 8: the two finest go in the store
+        array = numpy.random.default_rng(0).integers(0, 255, size=(38, 50, 3), dtype=numpy.uint8)
+        image = Image(array)
+        pyramid = TilePyramid(image, 8)
+        pyramid.build_levels(tile_layout)
+        self.assertEqual(2, pyramid.first_resident_level)
+        self.assertIsNone(pyramid.levels[0].array)  # no longer held in client memory
+        self.assertIsNone(pyramid.levels[1].array)
+        levels = [array]
+        for _level in pyramid.levels[1:]:
+            levels.append(downsample_2x(levels[-1]))
+        for level in pyramid.levels:
+            if level.is_coarsest:
+                self.assertIsNone(level.mip_level_count)
+                continue
+            self.assertEqual(1, level.mip_level_count)
+            for index, tci in enumerate(level.layout):
+                key = (level.level, index)
+                self.assertEqual(level.level < 2, key in pyramid.store)
+                for mip_level in range(level.mip_level_count + 1):
+                    # Pads are whole pixels at every mipmap level
+                    left = tci.left - tci.left_pad
+                    top = tci.top - tci.top_pad
+                    self.assertEqual(0, left % 2 ** mip_level)
+                    self.assertEqual(0, top % 2 ** mip_level)
+                    width = (tci.width + tci.left_pad + tci.right_pad) >> mip_level
+                    height = (tci.height + tci.top_pad + tci.bottom_pad) >> mip_level
+                    left >>= mip_level
+                    top >>= mip_level
+                    expected = levels[level.level + mip_level][top:top + height, left:left + width]
+                    self.assertEqual((height, width, 3), expected.shape)
+                    numpy.testing.assert_array_equal(expected, pyramid.tile_pixels(key, mip_level))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+from vmg.tiled_image import TiledImage
+
+
+class TestMappedImage(unittest.TestCase):
+    def setUp(self):
+        # 24-bit rows of 40 pixels are a multiple of 4 bytes, so BMP stores them unpadded, and they map
+        self.pixels = numpy.random.default_rng(0).integers(0, 255, size=(30, 40, 3), dtype=numpy.uint8)
+        handle, self.file_name = tempfile.mkstemp(suffix=".bmp")
+        os.close(handle)
+        Image.fromarray(self.pixels).save(self.file_name)
+
+    def tearDown(self):
+        os.remove(self.file_name)
+
+    def test_crop_after_load(self):
+        image = TiledImage()
+        self.assertTrue(image.load_from_file(self.file_name))
+        self.assertIsInstance(image.array, numpy.memmap)
+        # The file handle used for loading is closed by now
+        cropped = image.pil_image.crop((5, 6, 25, 16))
+        numpy.testing.assert_array_equal(self.pixels[6:16, 5:25], numpy.array(cropped))
+        copied = image.pil_image.convert("RGBA")
+        numpy.testing.assert_array_equal(self.pixels, numpy.array(copied)[:, :, :3])
+        image.pil_image.close()
+
+    def test_release_mapped_pixels(self):
+        image = TiledImage()
+        self.assertTrue(image.load_from_file(self.file_name))
+        image.release_mapped_pixels()
+        self.assertIsNone(image.array)
+        cropped = image.pil_image.crop((0, 0, 10, 10))  # still possible, through the file
+        numpy.testing.assert_array_equal(self.pixels[:10, :10], numpy.array(cropped))
+        image.pil_image.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
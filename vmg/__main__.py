@@ -1,3 +1,7 @@
-from vmg import VimageApp
-
-VimageApp()
+import multiprocessing
+
+from vmg import VimageApp
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # for decode worker processes, in packaged builds
+    VimageApp()
@@ -0,0 +1,71 @@
+"""
+Cooperative cancellation of long image loads.
+
+The UI thread cancels a token directly, so a decode running in another thread
+notices at its next chunk, without waiting for that thread's event loop.
+"""
+
+import io
+import threading
+
+
+class LoadCanceled(Exception):
+    """Raised inside a decode or upload when its token has been canceled"""
+    pass
+
+
+class CancellationToken(object):
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        """Request cancellation; safe to call from any thread"""
+        self._event.set()
+
+    @property
+    def is_canceled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_canceled(self) -> None:
+        if self._event.is_set():
+            raise LoadCanceled()
+
+
+class CancellableReader(io.RawIOBase):
+    """
+    Binary file that raises LoadCanceled from read() once its token is canceled.
+    PIL decoders read compressed data in blocks of 64 KB or so,
+    so opening an image through this interrupts its decode at the next block.
+    """
+    def __init__(self, file_name: str, token: CancellationToken):
+        super().__init__()
+        self._file = open(file_name, "rb")
+        self._token = token
+        self.name = file_name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        self._token.raise_if_canceled()
+        return self._file.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+__all__ = [
+    "CancellableReader",
+    "CancellationToken",
+    "LoadCanceled",
+]
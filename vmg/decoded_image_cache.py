@@ -0,0 +1,150 @@
+"""
+Recently decoded images, kept in client memory so returning to one skips decoding it.
+
+Entries are keyed on the file path, modification time and size, so an image
+that changes on disk is decoded afresh. Entries hold only metadata and pixels;
+each display of a cached image gets a new TiledImage, with its own GL resources.
+Pixels mapped from the file are not kept, since mapping them again is as quick,
+and a long-lived mapping would keep the file locked on Windows.
+"""
+
+import copy
+from collections import OrderedDict
+import io
+import logging
+import os
+import threading
+from typing import Optional
+
+import numpy
+from PIL import Image
+
+from vmg.gl_resources import MEBIBYTE
+from vmg.interfaces import TiledImageLike
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DECODED_CACHE_MB = 2048
+
+CacheKey = tuple[str, int, int]  # (absolute path, st_mtime_ns, st_size)
+
+
+def image_byte_count(image: TiledImageLike) -> int:
+    """Client memory held by a decoded image"""
+    result = 0
+    if image.array is not None and not isinstance(image.array, numpy.memmap):  # the OS manages mapped pages
+        result += image.array.nbytes
+    if image.pil_image is not None:
+        result += _pil_byte_count(image.pil_image)
+    return result
+
+
+def _pil_byte_count(pil: Image.Image) -> int:
+    """Pixels of a loaded PIL image, or the compressed bytes of one that has only parsed its header"""
+    # Pillow 11 renamed the core image to _im, behind a property that fails until it is loaded
+    core = vars(pil).get("_im", vars(pil).get("im"))
+    if core is not None:
+        return pil.width * pil.height * len(pil.getbands())
+    if isinstance(pil.fp, io.BytesIO):
+        return pil.fp.getbuffer().nbytes  # such as the JPEG bytes that TurboJPEG decoded the pixels from
+    return 0  # reads from the file as needed
+
+
+def cache_key(file_name: str) -> Optional[CacheKey]:
+    """Identity of the current contents of a file, or None if it cannot be read"""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size
+
+
+class _CacheEntry(object):
+    def __init__(self, image: TiledImageLike):
+        self.md = image.md
+        self.array = image.array
+        self.tex_format = image.tex_format
+        self.pil_image = image.pil_image
+        self.byte_count = image_byte_count(image)
+
+
+class DecodedImageCache(object):
+    """
+    Least recently used cache of decoded images, under a byte budget.
+    Used by the loader thread; membership may be checked from other threads.
+    """
+    def __init__(self, budget_bytes: int = DEFAULT_DECODED_CACHE_MB * MEBIBYTE):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[CacheKey, _CacheEntry] = OrderedDict()
+        self._byte_count = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+
+    def __contains__(self, file_name: str) -> bool:
+        key = cache_key(file_name)
+        with self._lock:
+            return key is not None and key in self._entries
+
+    def __str__(self):
+        return (
+            f"decoded image cache {self._byte_count / MEBIBYTE:.0f} of {self.budget_bytes / MEBIBYTE:.0f} MB"
+            f" in {len(self._entries)} images; {self.hit_count} hits, {self.miss_count} misses,"
+            f" {self.eviction_count} evictions"
+        )
+
+    def get(self, file_name: str, image: TiledImageLike) -> bool:
+        """Fill a new image from the cache, returning True on a hit"""
+        key = cache_key(file_name)
+        with self._lock:
+            entry = None if key is None else self._entries.get(key)
+            if entry is None:
+                self.miss_count += 1
+            else:
+                self.hit_count += 1
+                self._entries.move_to_end(key)
+        logger.info(f"{'Hit' if entry is not None else 'Miss'} for {file_name} in {self}")
+        if entry is None:
+            return False
+        # Copy the metadata, because the display changes some of it, such as the input format
+        image.load_from_decoded(copy.copy(entry.md), entry.array, entry.pil_image, entry.tex_format)
+        return True
+
+    def put(self, file_name: str, image: TiledImageLike) -> None:
+        """Remember a freshly decoded image"""
+        key = cache_key(file_name)
+        if key is None or image.array is None or image.is_decoding:
+            return  # nothing to keep yet
+        if image.pyramid is not None:
+            return  # too large to keep whole; its tile pyramid pages the pixels instead
+        if isinstance(image.array, numpy.memmap):
+            return  # mapped from the file, which must not stay mapped
+        entry = _CacheEntry(image)
+        if entry.byte_count > self.budget_bytes:
+            return  # would evict everything else, and still not fit
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._byte_count -= previous.byte_count
+            # Drop entries for older versions of the same file
+            for stale_key in [k for k in self._entries if k[0] == key[0]]:
+                self._byte_count -= self._entries.pop(stale_key).byte_count
+            self._entries[key] = entry
+            self._byte_count += entry.byte_count
+            while self._byte_count > self.budget_bytes:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._byte_count -= old_entry.byte_count
+                self.eviction_count += 1
+                evicted.append(old_key[0])
+        for path in evicted:
+            logger.info(f"Evicted {path} from {self}")
+
+
+__all__ = [
+    "cache_key",
+    "DEFAULT_DECODED_CACHE_MB",
+    "DecodedImageCache",
+    "image_byte_count",
+]
@@ -0,0 +1,171 @@
+"""
+The images the viewer steps through with Next and Previous: the image files
+of one folder in natural sort order, and which of them is current.
+
+The folder is watched with a QFileSystemWatcher, which reports that the folder
+changed, though not how. So the scanner thread lists the folder again, and
+sends only the files added and removed, each of which is then put in or taken
+out of the list at a position found by bisection, without sorting anything
+again. The current image keeps its place through any changes, even when its
+own file is removed, until another image becomes current.
+"""
+
+import logging
+import os
+from pathlib import Path
+import time
+from typing import Optional
+
+from PySide6 import QtCore
+from PySide6.QtCore import Qt
+
+from vmg.folder_scan import SETTLE_SECONDS, FolderChanges, FolderScanner
+from vmg.natural_sort import NaturallySortedList
+
+logger = logging.getLogger(__name__)
+
+# How long after a change notice the folder is listed again, so that the
+# burst of notices from copying in one file costs only one listing
+RESCAN_DELAY_MS = 50
+
+QueuedConnection = Qt.ConnectionType.QueuedConnection
+
+
+class FolderIndex(QtCore.QObject):
+    """Image files in natural sort order, and the current one among them; create and use in the UI thread"""
+    changed = QtCore.Signal()  # files were added or removed, or the folder listing finished
+    newest_added = QtCore.Signal(str, float)  # most recently written of the files just added, and when
+    scan_requested = QtCore.Signal(int, str, str)
+    rescan_requested = QtCore.Signal(int, str)
+
+    def __init__(self, parent: Optional[QtCore.QObject] = None):
+        super().__init__(parent)
+        self.files = NaturallySortedList()
+        self.current: Optional[str] = None
+        self.is_listing = False  # the first listing of the folder is still in progress
+        self._position = 0
+        self._is_current_removed = False  # its file is gone, but it stays listed while current
+        self._folder: Optional[str] = None
+        self._scan_id: Optional[int] = None
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_folder_changed)  # noqa
+        self._rescan_timer = QtCore.QTimer(self)
+        self._rescan_timer.setSingleShot(True)
+        self._rescan_timer.timeout.connect(self._request_rescan)  # noqa
+        self._scan_thread = QtCore.QThread()
+        self._scanner = FolderScanner()
+        self._scanner.moveToThread(self._scan_thread)
+        self._scan_thread.start()
+        self.scan_requested.connect(self._scanner.scan, QueuedConnection)
+        self.rescan_requested.connect(self._scanner.rescan, QueuedConnection)
+        self._scanner.files_found.connect(self._on_files_found, QueuedConnection)
+        self._scanner.scan_finished.connect(self._on_scan_finished, QueuedConnection)
+        self._scanner.files_changed.connect(self._on_files_changed, QueuedConnection)
+
+    @property
+    def position(self) -> int:
+        """Index of the current file"""
+        return self._position
+
+    @position.setter
+    def position(self, index: int) -> None:
+        if self._is_current_removed and index != self._position:
+            self.files.remove(self.current)
+            self._is_current_removed = False
+            if index > self._position:
+                index -= 1
+        self._position = index
+        self.current = self.files[index]
+
+    def set_files(self, file_names: list, current_index: int = 0) -> None:
+        """Step through just these files, such as several dropped at once, starting with one of them"""
+        self._close_folder()
+        current = file_names[current_index]
+        self.files = NaturallySortedList(file_names)
+        self._is_current_removed = False
+        self.current = current
+        self._position = self.files.index(current)
+
+    def open_folder(self, file_name: str) -> None:
+        """Make a file current, listing the rest of its folder in the background, and keeping up with changes"""
+        path = Path(file_name)
+        folder = str(path.parent.absolute())
+        self.set_files([os.path.join(folder, path.name)])
+        self._folder = folder
+        self._scan_id = self._scanner.new_scan_id()
+        self.is_listing = True
+        if not self._watcher.addPath(folder):
+            logger.warning(f"Could not watch {folder}; its image list will not follow changes")
+        self.scan_requested.emit(self._scan_id, folder, path.name)  # noqa
+
+    def _close_folder(self) -> None:
+        if self._folder is not None:
+            self._watcher.removePath(self._folder)
+            self._folder = None
+        if self._scan_id is not None:
+            self._scanner.cancel()
+            self._scan_id = None
+        self._rescan_timer.stop()
+        self.is_listing = False
+
+    def stop(self) -> None:
+        """Stop watching, and end the scanner thread"""
+        self._close_folder()
+        self._scan_thread.quit()
+        self._scan_thread.wait()
+
+    @QtCore.Slot(str)  # noqa
+    def _on_folder_changed(self, _folder: str) -> None:
+        if not self._rescan_timer.isActive():
+            self._rescan_timer.start(RESCAN_DELAY_MS)
+
+    @QtCore.Slot()  # noqa
+    def _request_rescan(self) -> None:
+        if self._scan_id is not None:
+            self.rescan_requested.emit(self._scan_id, self._folder)  # noqa
+
+    @QtCore.Slot(int, object)  # noqa
+    def _on_files_found(self, scan_id: int, keyed_files: list) -> None:
+        if scan_id != self._scan_id:
+            return  # from a folder no longer shown
+        self.files.add_keyed(keyed_files)
+        self._position = self.files.index(self.current)
+        self.changed.emit()  # noqa
+
+    @QtCore.Slot(int, int)  # noqa
+    def _on_scan_finished(self, scan_id: int, _count: int) -> None:
+        if scan_id != self._scan_id:
+            return
+        self.is_listing = False
+        self.changed.emit()  # noqa
+
+    @QtCore.Slot(int, object)  # noqa
+    def _on_files_changed(self, scan_id: int, changes: FolderChanges) -> None:
+        if scan_id != self._scan_id:
+            return
+        if changes.is_settling:
+            self._rescan_timer.start(int(SETTLE_SECONDS * 1000))
+        for file_name in changes.removed:
+            if file_name == self.current:
+                self._is_current_removed = True
+            else:
+                self.files.remove(file_name)
+        added = [entry for entry in changes.added if entry[1] != self.current]
+        if len(added) < len(changes.added):
+            self._is_current_removed = False  # replaced by a new file of the same name
+        self.files.add_keyed(added)
+        self._position = self.files.index(self.current)
+        if len(changes.added) + len(changes.removed) == 0:
+            return
+        logger.info(f"{self._folder} changed: {len(changes.added)} images added, {len(changes.removed)} removed")
+        self.changed.emit()  # noqa
+        if changes.newest is not None:
+            # Clocks of network storage may differ from ours, making this latency approximate
+            latency = time.time() - changes.newest_mtime
+            logger.info(f"Listed new image {Path(changes.newest).name} {latency:.3f} s after it was written")
+            self.newest_added.emit(changes.newest, changes.newest_mtime)  # noqa
+
+
+__all__ = [
+    "FolderIndex",
+]
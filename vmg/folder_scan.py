@@ -0,0 +1,179 @@
+"""
+Listing the images of a folder in a background thread.
+
+Reading a folder of tens of thousands of files, on network storage, can take
+seconds. So the viewer shows the opened image at once, with a list of only
+that image, and the scanner adds the rest of its folder to the list in
+batches, as it finds them. Each batch arrives sorted, with the natural sort
+key of every file already computed, so the UI thread only merges it.
+
+Later, whenever the folder changes, the scanner lists it again and sends only
+the files added and removed since, holding back new files until they seem
+completely written.
+"""
+
+import logging
+import os
+import time
+from typing import Optional
+
+from PySide6 import QtCore
+
+from vmg.natural_sort import natural_sort_key
+
+logger = logging.getLogger(__name__)
+
+# File name suffixes of the image types the viewer opens from a folder
+IMAGE_SUFFIXES = frozenset((
+    ".bmp",
+    ".dng",
+    ".heic",
+    ".heif",
+    ".gif",
+    ".pbm",
+    ".pgm",
+    ".ppm",
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".tif",
+    ".tiff",
+    ".webp",
+))
+# Longest the scanner collects files before sending them on, so Next and Previous
+# become available soon on a slow folder, without flooding the UI thread on a fast one
+SCAN_BATCH_SECONDS = 0.100
+# A new file is listed once its size holds still between two listings this far
+# apart, or as soon as it was last written at least this long ago
+SETTLE_SECONDS = 0.250
+
+
+def is_image_file_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES
+
+
+def _is_file(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_file()  # usually known without a stat() call
+    except OSError:
+        return False
+
+
+class FolderChanges(object):
+    """Differences between two listings of a folder"""
+    def __init__(self):
+        self.added: list[tuple[list, str]] = []  # sorted (natural sort key, file path)
+        self.removed: list[str] = []
+        self.newest: Optional[str] = None  # most recently written of the added files
+        self.newest_mtime = 0.0  # when it was written, in seconds since the epoch
+        self.is_settling = False  # new files seem still being written; list the folder again soon
+
+
+class FolderScanner(QtCore.QObject):
+    """Lists the image files of a folder, in batches; lives in a thread of its own"""
+    files_found = QtCore.Signal(int, object)  # scan id, sorted list of (natural sort key, file path)
+    scan_finished = QtCore.Signal(int, int)  # scan id, number of files found
+    files_changed = QtCore.Signal(int, object)  # scan id, FolderChanges
+
+    def __init__(self):
+        super().__init__()
+        self._latest_scan_id = 0
+        # Only touched in the scanner thread
+        self._known: set[str] = set()  # names of the files sent so far, in the latest scan
+        self._unsettled: dict[str, int] = {}  # size of each new file not yet sent, by name
+
+    def new_scan_id(self) -> int:
+        """An id for a scan about to be requested; any earlier scan stops. Run in the UI thread."""
+        self._latest_scan_id += 1
+        return self._latest_scan_id
+
+    def cancel(self) -> None:
+        """Stop any scan in progress; run in the UI thread"""
+        self._latest_scan_id += 1
+
+    @QtCore.Slot(int, str, str)  # noqa
+    def scan(self, scan_id: int, folder: str, skip_name: str) -> None:
+        """Find the image files in a folder, except skip_name, emitting them in batches"""
+        if scan_id != self._latest_scan_id:
+            return
+        self._known = {skip_name}
+        self._unsettled.clear()
+        t0 = time.perf_counter()
+        batch = []
+        batch_start = t0
+        count = 0
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if scan_id != self._latest_scan_id:
+                        logger.info(f"Stopped listing {folder} after {count + len(batch)} images")
+                        return
+                    if entry.name == skip_name or not is_image_file_name(entry.name) or not _is_file(entry):
+                        continue
+                    self._known.add(entry.name)
+                    batch.append((natural_sort_key(entry.path), entry.path))
+                    if time.perf_counter() - batch_start >= SCAN_BATCH_SECONDS:
+                        count += self._send(scan_id, batch)
+                        batch = []
+                        batch_start = time.perf_counter()
+        except OSError as exc:
+            logger.warning(f"Could not list folder {folder}: {exc}")
+        count += self._send(scan_id, batch)
+        logger.info(f"Listed {count} more images in {folder} in {time.perf_counter() - t0:.2f} s")
+        self.scan_finished.emit(scan_id, count)  # noqa
+
+    @QtCore.Slot(int, str)  # noqa
+    def rescan(self, scan_id: int, folder: str) -> None:
+        """List a folder again, after the scan with this id, emitting files_changed if anything changed"""
+        if scan_id != self._latest_scan_id:
+            return
+        present = set()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if is_image_file_name(entry.name) and _is_file(entry):
+                        present.add(entry.name)
+        except OSError as exc:
+            logger.warning(f"Could not list folder {folder}: {exc}")
+            return
+        changes = FolderChanges()
+        for name in sorted(self._known - present):
+            self._known.remove(name)
+            changes.removed.append(os.path.join(folder, name))
+        for name in list(self._unsettled):
+            if name not in present:
+                del self._unsettled[name]
+        now = time.time()
+        for name in present - self._known:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # gone again already
+            is_recent = now - stat.st_mtime < SETTLE_SECONDS
+            if is_recent and (stat.st_size == 0 or self._unsettled.get(name) != stat.st_size):
+                self._unsettled[name] = stat.st_size
+                changes.is_settling = True
+                continue
+            self._unsettled.pop(name, None)
+            self._known.add(name)
+            changes.added.append((natural_sort_key(path), path))
+            if changes.newest is None or stat.st_mtime > changes.newest_mtime:
+                changes.newest, changes.newest_mtime = path, stat.st_mtime
+        if len(changes.added) + len(changes.removed) > 0 or changes.is_settling:
+            changes.added.sort(key=lambda entry: entry[0])
+            self.files_changed.emit(scan_id, changes)  # noqa
+
+    def _send(self, scan_id: int, batch: list) -> int:
+        if len(batch) > 0:
+            batch.sort(key=lambda entry: entry[0])
+            self.files_found.emit(scan_id, batch)  # noqa
+        return len(batch)
+
+
+__all__ = [
+    "FolderChanges",
+    "FolderScanner",
+    "IMAGE_SUFFIXES",
+    "is_image_file_name",
+]
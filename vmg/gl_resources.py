@@ -0,0 +1,103 @@
+"""
+Byte accounting for OpenGL objects owned by images.
+
+Textures and buffers are created in the loader thread's OffscreenContext, while
+vertex array objects are created in the UI thread's context. VAOs are not shared
+between contexts, so each must be deleted in the context that created it:
+
+  * Tile.release_render_gl() - UI thread, with the widget context current
+  * Tile.release_gl() - loader thread, with the offscreen context current
+"""
+
+import logging
+import threading
+
+from OpenGL import GL
+
+logger = logging.getLogger(__name__)
+
+MEBIBYTE = 1024 * 1024
+DEFAULT_VRAM_BUDGET_MB = 2048
+
+# Approximate bytes per texel as stored by the driver
+bytes_per_texel_for_internal_format = {
+    GL.GL_RED: 1,
+    GL.GL_RG: 2,
+    GL.GL_RGB: 4,  # drivers usually pad RGB to RGBA
+    GL.GL_RGBA: 4,
+    GL.GL_R16: 2,
+    GL.GL_RG16: 4,
+    GL.GL_RGB16: 8,
+    GL.GL_RGBA16: 8,
+}
+
+
+def texture_byte_count(width: int, height: int, internal_format: int, mipmapped: bool = True) -> int:
+    """Estimated video memory used by a 2D texture"""
+    texel_count = width * height
+    if mipmapped:
+        texel_count = texel_count * 4 // 3  # full mip chain adds one third
+    return texel_count * bytes_per_texel_for_internal_format.get(internal_format, 4)
+
+
+class VramBudget(object):
+    """
+    Running total of video memory used by image textures and buffers,
+    compared against a configurable budget.
+
+    Updated from both the loader thread and the UI thread.
+    """
+    def __init__(self, budget_bytes: int = DEFAULT_VRAM_BUDGET_MB * MEBIBYTE):
+        self._lock = threading.Lock()
+        self.budget_bytes = budget_bytes
+        self._used_bytes = 0
+        self._peak_bytes = 0
+
+    def allocate(self, byte_count: int) -> None:
+        with self._lock:
+            self._used_bytes += byte_count
+            self._peak_bytes = max(self._peak_bytes, self._used_bytes)
+            used = self._used_bytes
+        if used > self.budget_bytes >= used - byte_count:
+            logger.warning(f"Video memory use exceeds budget: {self}")
+
+    def free(self, byte_count: int) -> None:
+        with self._lock:
+            self._used_bytes -= byte_count
+            if self._used_bytes < 0:
+                logger.error(f"Video memory accounting went negative ({self._used_bytes} bytes)")
+                self._used_bytes = 0
+
+    @property
+    def available_bytes(self) -> int:
+        return self.budget_bytes - self.used_bytes
+
+    def is_over_budget(self) -> bool:
+        return self.used_bytes > self.budget_bytes
+
+    @property
+    def peak_bytes(self) -> int:
+        return self._peak_bytes
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used_bytes
+
+    def __str__(self):
+        return (
+            f"{self.used_bytes / MEBIBYTE:.1f} MB used of {self.budget_bytes / MEBIBYTE:.0f} MB budget"
+            f" (peak {self.peak_bytes / MEBIBYTE:.1f} MB)"
+        )
+
+
+# One ledger for the whole process, since all contexts share one GPU
+vram_budget = VramBudget()
+
+
+__all__ = [
+    "DEFAULT_VRAM_BUDGET_MB",
+    "MEBIBYTE",
+    "texture_byte_count",
+    "vram_budget",
+    "VramBudget",
+]
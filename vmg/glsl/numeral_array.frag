@@ -0,0 +1,28 @@
+#pragma include "shared.frag"
+#pragma include "shared_array.frag"
+
+uniform sampler2DArray tiles;
+uniform sampler2D numerals;
+
+uniform int   channel_count = 3;  // set from host
+uniform float format_max = 255;
+uniform float data_max = 255;
+uniform int pixel_numerals = NUMERALS_HEXADECIMAL;
+uniform mat2 rotation = mat2(1);
+
+in  vec2 p_ttc;   // from vertex shader
+flat in float p_layer;
+out vec4 fragColor;
+
+void main()
+{
+    fragColor = numeral_color(
+            vec3(p_ttc, p_layer),
+            tiles,
+            numerals,
+            channel_count,
+            format_max,
+            data_max,
+            rotation,
+            pixel_numerals);
+}
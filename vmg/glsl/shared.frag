@@ -262,9 +262,12 @@ mat2 texel_rotation(vec2 tc)
     else return mat2(-1, 0, 0, -1);  // still too noisy!
 }
 
-vec4 numeral_color(
+// Numeral overlay for one texel, given its value and level of detail
+vec4 numeral_color_for_texel(
         vec2 p_ttc,
-        sampler2D tile,
+        float lod,  // from textureQueryLod(...).y
+        vec2 texture_pixels,  // tile size in texels
+        vec4 intensity_v,  // texel value at p_ttc
         sampler2D numerals,
         int channel_count,
         float format_max,
@@ -281,12 +284,10 @@ vec4 numeral_color(
         return vec4(0);
     }
 
-    float lod = textureQueryLod(tile, p_ttc).y;
     float fade = smoothstep(-5.0, -8.0, lod);  // smoothly blend in at high zoom
     if (fade <= 0) return vec4(0);
 
     // pixel-relative texture coordinates
-    vec2 texture_pixels = textureSize(tile, 0);
     vec2 local_coords = fract(texture_pixels * p_ttc);
 
     // additional rotation if texels are rotated on screen
@@ -352,8 +353,6 @@ vec4 numeral_color(
     if (channel_count == 2 && c == 1)
         c = 3;
 
-    vec4 intensity_v = texture(tile, p_ttc);
-
     // Not needed because all vimage texture values are as-found.
     // if (srgb_gamma)
     //     intensity_v = sRGB_gamma_correct(intensity_v);
@@ -413,6 +412,29 @@ vec4 numeral_color(
     return vec4(color, 0.75 * alpha * fade);
 }
 
+vec4 numeral_color(
+        vec2 p_ttc,
+        sampler2D tile,
+        sampler2D numerals,
+        int channel_count,
+        float format_max,
+        float data_max,
+        mat2 rotation,
+        int pixel_numerals)
+{
+    return numeral_color_for_texel(
+            p_ttc,
+            textureQueryLod(tile, p_ttc).y,
+            textureSize(tile, 0),
+            texture(tile, p_ttc),
+            numerals,
+            channel_count,
+            format_max,
+            data_max,
+            rotation,
+            pixel_numerals);
+}
+
 // modify image color to show selection box
 vec4 selection_box(
     in vec2 p_omp,
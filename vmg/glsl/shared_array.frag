@@ -0,0 +1,94 @@
+// Overloads of the shared.frag sampling functions for tiles stored as layers of a texture array.
+// Texture coordinates are (u, v, layer).
+
+// Set line numbers correctly for this file
+#line 5 1
+
+vec4 equirect_color(sampler2DArray image, vec3 tex_coord)
+{
+    // Use explicit gradients, to preserve anisotropic filtering during mipmap lookup
+    vec2 dpdx = dFdx(tex_coord.xy);
+    vec2 dpdy = dFdy(tex_coord.xy);
+
+    if (dpdx.x > 0.5) dpdx.x -= 1; // use "repeat" wrapping on gradient
+    if (dpdx.x < -0.5) dpdx.x += 1;
+    if (dpdy.x > 0.5) dpdy.x -= 1; // use "repeat" wrapping on gradient
+    if (dpdy.x < -0.5) dpdy.x += 1;
+
+    return textureGrad(image, tex_coord, dpdx, dpdy);
+}
+
+vec4 catrom(sampler2DArray image, vec3 textureCoordinate, bool wrap) {
+    vec2 size = textureSize(image, 0).xy;
+    vec2 texel = textureCoordinate.xy * size - vec2(0.5);
+    ivec2 texel1 = ivec2(floor(texel));
+    vec2 param = texel - texel1;
+    vec4 weightsX = catrom_weights(param.x);
+    vec4 weightsY = catrom_weights(param.y);
+    vec4 combined = vec4(0);
+    float rgb_weight = 0;  // for pseudo pre/post multiply alpha
+    for (int y = 0; y < 4; ++y) {
+        float wy = weightsY[y];
+        for (int x = 0; x < 4; ++x) {
+            float wx = weightsX[x];
+            vec2 texel2 = vec2(x , y) + texel1 - vec2(0.5);
+            vec3 tc = vec3(texel2 / size, textureCoordinate.z);
+            vec4 rgba;
+            if (wrap)
+                rgba = equirect_color(image, tc);
+            else
+                rgba = texture(image, tc);
+            rgb_weight += wx * wy * rgba.a;
+            combined += wx * wy * vec4(rgba.rgb * rgba.a, rgba.a);  // premultiply alpha
+        }
+    }
+    if (rgb_weight > 0)
+        combined.rgb /= rgb_weight;  // un-premultiply alpha
+    return combined;
+}
+
+vec4 clip_n_filter(sampler2DArray image, vec3 tc, int pixelFilter, bool wrap)
+{
+    // clip to image boundary
+    if (tc.x < 0 || tc.y < 0 || tc.x > 1 || tc.y > 1) {
+        return vec4(0);
+    }
+
+    float mipmapLevel = textureQueryLod(image, tc.xy).x;
+    if (mipmapLevel > 0 || pixelFilter == FILTER_NEAREST)
+    {
+        if (wrap)
+            return equirect_color(image, tc);
+        else
+            return texture(image, tc);
+    }
+    else {
+        return catrom(image, tc, wrap);
+    }
+}
+
+vec4 numeral_color(
+        vec3 p_ttc,
+        sampler2DArray tile,
+        sampler2D numerals,
+        int channel_count,
+        float format_max,
+        float data_max,
+        mat2 rotation,
+        int pixel_numerals)
+{
+    return numeral_color_for_texel(
+            p_ttc.xy,
+            textureQueryLod(tile, p_ttc.xy).y,
+            textureSize(tile, 0).xy,
+            texture(tile, p_ttc),
+            numerals,
+            channel_count,
+            format_max,
+            data_max,
+            rotation,
+            pixel_numerals);
+}
+
+// Prepare to set line numbers correctly for the next file
+#line 1 2
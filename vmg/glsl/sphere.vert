@@ -40,14 +40,18 @@ mat3 translate(vec2 t) {
 
 uniform ivec2 window_size;
 uniform float window_zoom = 1.0;
+// Screen rectangle (x_min, y_min, x_max, y_max) that might contain this tile
+uniform vec4 ndc_bounds = vec4(-1, -1, 1, 1);
 
 out vec2 p_nic;
 
 const float PI = 3.1415926535897932384626433832795;
 
 void main() {
-    // set position for each corner vertex
-    gl_Position = SCREEN_QUAD[gl_VertexID];
+    // set position for each corner vertex, shrunk to the bounds of this tile
+    vec4 corner = SCREEN_QUAD[gl_VertexID];
+    vec2 t = 0.5 * (corner.xy + vec2(1));
+    gl_Position = vec4(mix(ndc_bounds.xy, ndc_bounds.zw, t), corner.zw);
     vec2 p_ndc = gl_Position.xy / gl_Position.w;
     float scale = PI / 2.0 / window_size.y / window_zoom;  // scale by height
     float window_aspect = window_size.x / float(window_size.y);
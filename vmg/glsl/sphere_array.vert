@@ -0,0 +1,55 @@
+#version 410
+
+// Vertex shader for instanced display of spherical panoramas,
+// one instance per tile, with tiles stored as texture array layers
+
+// host side draw call should be "glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, tile_count)"
+const vec4 SCREEN_QUAD[4] = vec4[4](
+    vec4( 1, -1, 0.5, 1),  // lower right
+    vec4( 1,  1, 0.5, 1),  // upper right
+    vec4(-1, -1, 0.5, 1),  // lower left
+    vec4(-1,  1, 0.5, 1)   // upper left
+);
+
+// Keep these in sync with tile_array.py
+const int MAX_TILE_INSTANCES = 64;
+
+struct TileInstance {
+    vec4 corners[4];  // (opx_x, opx_y, ttc_x, ttc_y) for each quad corner
+    mat3 tile_X_img;
+    vec4 uv_bounds;  // (u_min, v_min, u_max, v_max)
+    vec4 ndc_bounds;  // (x_min, y_min, x_max, y_max)
+    vec4 layer;  // texture array layer in x
+};
+
+layout(std140) uniform TileInstances {
+    TileInstance tile_instances[MAX_TILE_INSTANCES];
+};
+
+uniform ivec2 window_size;
+uniform float window_zoom = 1.0;
+
+out vec2 p_nic;
+flat out mat3 tile_X_img;
+flat out vec4 uv_bounds;
+flat out float p_layer;
+
+const float PI = 3.1415926535897932384626433832795;
+
+void main() {
+    TileInstance tile = tile_instances[gl_InstanceID];
+    // set position for each corner vertex, shrunk to the screen bounds of this tile
+    vec4 corner = SCREEN_QUAD[gl_VertexID];
+    vec2 t = 0.5 * (corner.xy + vec2(1));
+    gl_Position = vec4(mix(tile.ndc_bounds.xy, tile.ndc_bounds.zw, t), corner.zw);
+    vec2 p_ndc = gl_Position.xy / gl_Position.w;
+    float scale = PI / 2.0 / window_size.y / window_zoom;  // scale by height
+    float window_aspect = window_size.x / float(window_size.y);
+    if (window_aspect < 1.0) { // narrow window, so scale by width
+        scale = PI / 2.0 / window_size.x / window_zoom;
+    }
+    p_nic = p_ndc * vec2(scale * window_size.x, scale * window_size.y);
+    tile_X_img = tile.tile_X_img;
+    uv_bounds = tile.uv_bounds;
+    p_layer = tile.layer.x;
+}
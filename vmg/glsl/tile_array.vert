@@ -0,0 +1,36 @@
+#version 410
+// Vertex shader for instanced display of rectangular images,
+// one instance per tile, with tiles stored as texture array layers
+
+// Keep these in sync with tile_array.py
+const int MAX_TILE_INSTANCES = 64;
+
+struct TileInstance {
+    vec4 corners[4];  // (opx_x, opx_y, ttc_x, ttc_y) for each quad corner
+    mat3 tile_X_img;
+    vec4 uv_bounds;  // (u_min, v_min, u_max, v_max)
+    vec4 ndc_bounds;  // (x_min, y_min, x_max, y_max)
+    vec4 layer;  // texture array layer in x
+};
+
+layout(std140) uniform TileInstances {
+    TileInstance tile_instances[MAX_TILE_INSTANCES];
+};
+
+uniform mat3 ndc_X_opx = mat3(1);  // converts image pixels to normalized device coordinates
+
+out vec2 p_opx;  // output image pixel coordinates
+out vec2 p_ttc;  // output tile texture coordinates
+flat out float p_layer;  // texture array layer of this tile
+
+// host side draw call should be "glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, tile_count)"
+void main()
+{
+    TileInstance tile = tile_instances[gl_InstanceID];
+    vec4 corner = tile.corners[gl_VertexID];
+    vec3 p_ndc = ndc_X_opx * vec3(corner.xy, 1);
+    gl_Position = vec4(p_ndc.xy/p_ndc.z, 0.5, 1);
+    p_opx = corner.xy;
+    p_ttc = corner.zw;
+    p_layer = tile.layer.x;
+}
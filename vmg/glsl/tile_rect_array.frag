@@ -0,0 +1,31 @@
+#pragma include "shared.frag"
+#pragma include "shared_array.frag"
+// rectangular shader, for tiles stored as texture array layers
+
+uniform sampler2DArray tiles;
+uniform vec4 background_color = vec4(0.5);
+uniform int pixel_filter = FILTER_NEAREST;
+uniform float brightness = 0.0;
+uniform bool input_is_linear = false;
+
+in vec2 p_opx;
+in vec2 p_ttc;
+flat in float p_layer;
+
+out vec4 image_color;
+
+void main()
+{
+    image_color = clip_n_filter(tiles, vec3(p_ttc, p_layer), pixel_filter, false);
+
+    // Apply brightness
+    vec4 linear;
+    if (input_is_linear) linear = image_color;
+    else linear = linear_from_srgb(image_color);
+    vec4 brightened = vec4(pow(2.0, brightness) * linear.rgb, linear.a);  // apply to linear...
+
+    image_color = srgb_from_linear(brightened);
+
+    // OK to do texel boundary composition in sRGB space...
+    image_color = texel_boundaries(image_color, p_ttc * textureSize(tiles, 0).xy);
+}
@@ -0,0 +1,270 @@
+"""
+Choosing a decoder for an image file from its first few bytes.
+
+TiledImage.load_from_file opens the file once, through a buffered reader
+shared by every decode attempt, sniffs its signature here, and hands it to
+the best decoder for that format:
+
+  * JPEG - TurboJPEG
+  * TIFF, including DNG - tifffile
+  * HEIF - pillow-heif, through its PIL plugin
+  * anything else - PIL, which sniffs for itself
+"""
+
+import enum
+import functools
+import io
+import logging
+import os
+from typing import Callable, Optional
+
+import numpy
+from numpy.typing import NDArray
+from PIL import ExifTags, Image
+import tifffile
+import turbojpeg
+
+from vmg.cancellation import CancellableReader, CancellationToken
+
+logger = logging.getLogger(__name__)
+
+# Enough bytes to recognize every registered signature
+HEADER_SIZE = 16
+# Large enough for tifffile and PIL to read headers without many small reads
+READ_BUFFER_SIZE = 256 * 1024
+# Reduced sizes libjpeg-turbo decodes fastest, by skipping DCT coefficients; smallest first
+PREVIEW_SCALING_FACTORS = ((1, 8), (1, 4), (1, 2))
+
+
+class ImageFileFormat(enum.Enum):
+    JPEG = 1
+    TIFF = 2  # including DNG and BigTIFF
+    HEIF = 3
+    OTHER = 4
+
+
+def _is_heif(header: bytes) -> bool:
+    # ISO base media file, with a still image brand
+    return header[4:8] == b"ftyp" and header[8:12] in (
+        b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1",
+    )
+
+
+# Signature tests, checked in order; extend with register_format()
+_signatures: list[tuple[ImageFileFormat, Callable[[bytes], bool]]] = [
+    (ImageFileFormat.JPEG, lambda header: header[:3] == b"\xff\xd8\xff"),
+    (ImageFileFormat.TIFF, lambda header: header[:4] in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")),
+    (ImageFileFormat.HEIF, _is_heif),
+]
+
+
+def register_format(file_format: ImageFileFormat, matches: Callable[[bytes], bool]) -> None:
+    """Recognize files whose first HEADER_SIZE bytes pass the test, ahead of earlier registrations"""
+    _signatures.insert(0, (file_format, matches))
+
+
+def sniff_format(header: bytes) -> ImageFileFormat:
+    """Format of a file, from its first HEADER_SIZE bytes"""
+    for file_format, matches in _signatures:
+        if matches(header):
+            return file_format
+    return ImageFileFormat.OTHER
+
+
+def open_image_file(file_name: str, cancel_token: CancellationToken) -> io.BufferedReader:
+    """Buffered, cancellable handle for every decoder to share; peek() it to sniff the format"""
+    return io.BufferedReader(CancellableReader(file_name, cancel_token), READ_BUFFER_SIZE)
+
+
+def read_header(fh: io.BufferedReader) -> bytes:
+    """The first bytes of a file just opened, without moving past them"""
+    return fh.peek(HEADER_SIZE)[:HEADER_SIZE]
+
+
+def pil_formats(file_format: ImageFileFormat) -> Optional[list[str]]:
+    """PIL plugins worth trying for a format, or None to let PIL try them all"""
+    if file_format == ImageFileFormat.HEIF and "HEIF" in Image.ID:  # once pillow-heif is registered
+        return ["HEIF"]
+    if file_format == ImageFileFormat.JPEG:
+        return ["JPEG"]
+    if file_format == ImageFileFormat.TIFF:
+        return ["TIFF"]
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def _turbo_jpeg() -> Optional[turbojpeg.TurboJPEG]:
+    try:
+        return turbojpeg.TurboJPEG()
+    except (OSError, RuntimeError) as exc:
+        logger.warning(f"TurboJPEG unavailable; decoding JPEG with PIL: {exc}")
+        return None
+
+
+# TurboJPEG pixel formats giving the same array as numpy.array() of a PIL image of each mode
+_TURBO_PIXEL_FORMATS = {
+    "RGB": turbojpeg.TJPF_RGB,
+    "L": turbojpeg.TJPF_GRAY,
+}
+
+
+@functools.lru_cache(maxsize=1)
+def pyjpeg_module():
+    """The libjpeg bindings in vmg.pyjpeg, or None if the library could not be loaded"""
+    try:
+        from vmg import pyjpeg
+    except OSError as exc:
+        logger.info(f"libjpeg unavailable; progressive JPEGs will load all at once: {exc}")
+        return None
+    return pyjpeg
+
+
+def can_decode_jpeg(mode: str) -> bool:
+    """Whether decode_jpeg() handles JPEG files PIL opens in this mode"""
+    return mode in _TURBO_PIXEL_FORMATS and _turbo_jpeg() is not None
+
+
+def decode_jpeg(data: bytes, mode: str, scaling_factor: Optional[tuple[int, int]] = None) -> NDArray:
+    """
+    Decode a whole JPEG file with TurboJPEG, shaped like numpy.array() of the PIL image.
+    A scaling factor such as (1, 4) decodes a reduced size image, quickly, by DCT scaling.
+    """
+    if scaling_factor is None:
+        array = _turbo_jpeg().decode(data, pixel_format=_TURBO_PIXEL_FORMATS[mode])
+    else:
+        array = _turbo_jpeg().decode(
+            data,
+            pixel_format=_TURBO_PIXEL_FORMATS[mode],
+            scaling_factor=scaling_factor,
+            flags=turbojpeg.TJFLAG_FASTDCT | turbojpeg.TJFLAG_FASTUPSAMPLE,
+        )
+    if mode == "L":
+        array = array[:, :, 0]
+    return numpy.ascontiguousarray(array)
+
+
+class MappedPixels(object):
+    """
+    Pixels of an uncompressed image file, mapped read-only from the page cache instead of copied,
+    so the OS can drop and reread them under memory pressure.
+    Touching pages beyond the end of a file truncated while it is mapped raises SIGBUS, which kills
+    the process, and on Windows a mapped file cannot be renamed or deleted. So the loader drops the
+    mapping as soon as the tiles are uploaded, and the caches never keep one.
+    """
+    def __init__(self, array: NDArray, is_bgr: bool = False, is_bottom_up: bool = False):
+        self.array = array
+        self.is_bgr = is_bgr  # color channels in blue, green, red order
+        self.is_bottom_up = is_bottom_up  # first row is the bottom of the image
+
+
+# Bytes per pixel of the PIL modes we can map, when PIL's raw mode matches
+_MAPPABLE_PIL_MODES = {"L": 1, "RGB": 3, "RGBA": 4}
+
+
+def map_pil_pixels(pil_image: Image.Image, file_name: str) -> Optional[MappedPixels]:
+    """
+    Memory map the pixels of a PPM, PGM or BMP file, or anything else PIL reads with its "raw" decoder,
+    using the offset and row stride PIL found in the header. None if the pixels need decoding.
+    """
+    tiles = getattr(pil_image, "tile", [])  # only images opened from a file have any
+    if len(tiles) != 1 or not os.path.isfile(file_name):
+        return None
+    decoder, extents, offset, args = tiles[0]
+    w, h = pil_image.size
+    if decoder != "raw" or tuple(extents) != (0, 0, w, h):
+        return None
+    if isinstance(args, str):
+        args = (args,)
+    raw_mode, stride, orientation = (tuple(args) + (0, 1))[:3]
+    mode = pil_image.mode
+    if mode not in _MAPPABLE_PIL_MODES:
+        return None
+    is_bgr = raw_mode == "BGR" and mode == "RGB"
+    if raw_mode != mode and not is_bgr:
+        return None  # such as 16-bit big endian PGM, or BMP padding bytes
+    if orientation < 0 and pil_image.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+        return None  # we only flip rows when there is no other orientation to combine with
+    pixel_bytes = _MAPPABLE_PIL_MODES[mode]
+    if stride not in (0, w * pixel_bytes):
+        return None  # padded rows, as in BMP files whose rows are not a multiple of 4 bytes; uploads need them packed
+    if os.path.getsize(file_name) < offset + w * h * pixel_bytes:
+        return None  # truncated
+    shape = (h, w) if pixel_bytes == 1 else (h, w, pixel_bytes)
+    array = numpy.memmap(file_name, dtype=numpy.uint8, mode="r", offset=offset, shape=shape)
+    return MappedPixels(array, is_bgr=is_bgr, is_bottom_up=orientation < 0)
+
+
+def map_tiff_page(page: tifffile.TiffPage, file_name: str) -> Optional[NDArray]:
+    """
+    Memory map an uncompressed, contiguous TIFF or DNG page in the native byte order,
+    shaped like page.asarray(), with the caveats of MappedPixels. None if the pixels need decoding.
+    """
+    if not page.is_memmappable or not os.path.isfile(file_name):
+        return None
+    if page.samplesperpixel > 1 and page.planarconfig != tifffile.PLANARCONFIG.CONTIG:
+        return None  # one plane per color channel
+    if page.shape[:2] != (page.imagelength, page.imagewidth):
+        return None  # such as a volume
+    dtype = numpy.dtype(page.dtype).newbyteorder(page.parent.byteorder)
+    if not dtype.isnative:
+        return None  # needs a byte swapped copy
+    return numpy.memmap(file_name, dtype=dtype, mode="r", offset=page.dataoffsets[0], shape=page.shape)
+
+
+def exif_thumbnail(pil_image: Image.Image) -> Optional[NDArray]:
+    """RGB pixels of the thumbnail in the EXIF data of a JPEG, or None if it has none"""
+    exif_bytes = pil_image.info.get("exif")
+    ifd1_id = getattr(ExifTags.IFD, "IFD1", None)  # Pillow 10 and later
+    if exif_bytes is None or ifd1_id is None:
+        return None
+    try:
+        ifd1 = pil_image.getexif().get_ifd(ifd1_id)
+        offset = ifd1.get(0x0201)  # JPEGInterchangeFormat, from the start of the TIFF header
+        length = ifd1.get(0x0202)  # JPEGInterchangeFormatLength
+        if offset is None or not length:
+            return None
+        if exif_bytes.startswith(b"Exif\x00\x00"):
+            exif_bytes = exif_bytes[6:]
+        thumbnail = Image.open(io.BytesIO(exif_bytes[offset:offset + length]), formats=["JPEG"])
+        return numpy.array(thumbnail.convert("RGB"))
+    except (KeyError, OSError, SyntaxError, ValueError) as exc:
+        logger.debug(f"Unreadable EXIF thumbnail: {exc}")
+        return None
+
+
+def preview_scaling_factor(
+        image_size: tuple[float, float],
+        window_size: tuple[int, int],
+) -> Optional[tuple[int, int]]:
+    """
+    Smallest DCT scaling factor that still fills the window when the image is fit to it,
+    or None if the window is unknown, or would need at least half the image resolution anyway.
+    """
+    iw, ih = image_size
+    ww, wh = window_size
+    if ww <= 0 or wh <= 0 or iw <= 0 or ih <= 0:
+        return None
+    fit_scale = min(ww / iw, wh / ih)
+    for numerator, denominator in PREVIEW_SCALING_FACTORS:
+        if numerator / denominator >= fit_scale:
+            return numerator, denominator
+    return None
+
+
+__all__ = [
+    "can_decode_jpeg",
+    "decode_jpeg",
+    "exif_thumbnail",
+    "HEADER_SIZE",
+    "ImageFileFormat",
+    "map_pil_pixels",
+    "map_tiff_page",
+    "MappedPixels",
+    "open_image_file",
+    "pil_formats",
+    "preview_scaling_factor",
+    "pyjpeg_module",
+    "read_header",
+    "register_format",
+    "sniff_format",
+]
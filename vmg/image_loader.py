@@ -1,40 +1,95 @@
 import logging
+import threading
 import time
 from typing import Optional
 
-import turbojpeg
+from OpenGL import GL
 from PIL import Image
 from PySide6 import QtCore
-from PySide6.QtCore import QCoreApplication
 
+from vmg.cancellation import CancellationToken, LoadCanceled
+from vmg.decoded_image_cache import DecodedImageCache
+from vmg.gl_resources import vram_budget
+from vmg.image_prefetcher import ImagePrefetcher
 from vmg.interfaces import TiledImageLike
 from vmg.offscreen_context import OffscreenContext
-from vmg.tiled_image import TiledImage
+from vmg.pixel_buffers import PixelBufferRing
+from vmg.texture_residency import texture_pool
+from vmg.tile_priority import ViewHint
+from vmg.tiled_image import PyramidTile, TiledImage
+from vmg.upload_contexts import UploadContextPool
 from vmg.load_progress import LoadProgress
 
 
-jpeg = turbojpeg.TurboJPEG()  # TODO: cache this?
 logger = logging.getLogger(__name__)
 
+# How long to block on the upload fence between checks for cancellation
+UPLOAD_WAIT_TIMEOUT_NS = 100_000_000
+# Tiles created within this interval are shown together, with one repaint
+TILE_BATCH_SECONDS = 0.050
+# Progressive JPEG scans decoded within this interval are shown together, with one refresh
+PROGRESSIVE_SCAN_SECONDS = 0.100
+
 
 class ImageLoader(QtCore.QObject):
     def __init__(self):
         super().__init__()
         self.current_image: Optional[TiledImageLike] = None
         self.offscreen_context = None
+        self.upload_contexts: Optional[UploadContextPool] = None  # more contexts, to upload tiles in parallel
         self.image_data_is_pending = False
+        self.view_hint = ViewHint()  # updated by the image widget, to upload visible tiles first
+        # Stream tiles through pixel buffer objects, instead of copying from client memory
+        self.use_pixel_buffers = False
+        self._pixel_buffers: Optional[PixelBufferRing] = None
+        # Store same-size tiles in texture arrays, so each array draws in one instanced call
+        self.use_texture_arrays = True
+        # Show progressive JPEGs scan by scan, sharpening the same tiles in place
+        self.use_progressive_jpeg = True
+        # Decode large JPEGs band by band, and TIFF pages segment by segment, during upload,
+        # so tiles appear before the whole image is decoded
+        self.decode_during_upload = True
+        self.prefetcher: Optional[ImagePrefetcher] = None  # decoded neighbors of the current image
+        self.decoded_cache = DecodedImageCache()  # recently viewed images
+        # Token of the latest load request, canceled directly from the UI thread, whether that load
+        # is in progress or still queued; the only way a load is canceled
+        self._cancel_lock = threading.Lock()
+        self._cancel_token = CancellationToken()
+        # Full image whose preview is on screen, handed to the display once all its tiles are uploaded
+        self._deferred_handover: Optional[TiledImageLike] = None
 
     load_failed = QtCore.Signal(str)
+    # Emitted as soon as the image metadata and tile layout are known; tiles arrive later
     texture_created = QtCore.Signal(TiledImageLike)
+    # Emitted after each batch of tiles is ready for display
+    tiles_uploaded = QtCore.Signal(TiledImageLike)
 
     @QtCore.Slot(str)  # noqa
     def cancel_load(self):
+        self.cancel_load_in_progress()
         if self.current_image is None:
             return  # already canceled?
         self.current_image = None
 
+    def cancel_load_in_progress(self) -> CancellationToken:
+        """
+        Stop the decode or upload in progress at its next chunk, and skip the load requests still queued.
+        Returns the token for the next load request to carry, so the next call cancels that load in turn.
+        Call directly from the UI thread; the loader thread may be too busy to take a queued signal.
+        """
+        with self._cancel_lock:
+            self._cancel_token.cancel()
+            self._cancel_token = CancellationToken()
+            return self._cancel_token
+
+    def _make_current(self, image: TiledImageLike):
+        image.sq.image_displayed.connect(self.on_image_displayed)
+        image.sq.progress_changed.connect(self.on_progress_changed)
+        self.current_image = image
+
     def _is_current(self, image: TiledImageLike) -> bool:
-        QCoreApplication.processEvents()  # drain queue, in case load was canceled
+        if self.current_image is image and image.cancel_token.is_canceled:
+            self.current_image = None
         if self.current_image is not image:
             try:
                 image.setParent(None)  # noqa  allow deletion of image maybe
@@ -45,20 +100,44 @@ class ImageLoader(QtCore.QObject):
         else:
             return True
 
-    @QtCore.Slot(str)  # noqa
-    def load_from_file_name(self, file_name: str):
+    @QtCore.Slot(str, CancellationToken)  # noqa
+    def load_from_file_name(self, file_name: str, cancel_token: CancellationToken):
+        if cancel_token.is_canceled:
+            logger.info(f"Skipping superseded load of {file_name}")
+            return
+        self._deferred_handover = None  # left behind its preview by a load that failed or was canceled
         try:
-            image = TiledImage()
-            image.sq.image_displayed.connect(self.on_image_displayed)
-            image.sq.progress_changed.connect(self.on_progress_changed)
-            image.set_progress(LoadProgress.OBJECT_CREATED)
-            if not image.load_from_file(file_name):
-                self.load_failed.emit(file_name)  # noqa
-                return
-            if image is None:
-                self.load_failed.emit(file_name)  # noqa
-                return
-            self.current_image = image
+            image = None
+            if file_name not in self.decoded_cache and self.prefetcher is not None:
+                image = self.prefetcher.take(file_name, cancel_token)
+                if image is None and cancel_token.is_canceled:
+                    logger.info(f"Canceled load of {file_name}")
+                    return
+            if image is not None:
+                self._adopt_prefetched_image(image, cancel_token)
+                self.decoded_cache.put(file_name, image)
+            else:
+                image = TiledImage()
+                image.cancel_token = cancel_token
+                self._make_current(image)
+                image.set_progress(LoadProgress.OBJECT_CREATED)
+                if not self.decoded_cache.get(file_name, image):
+                    if self._load_progressive(image, file_name):
+                        return  # already uploaded, scan by scan
+                    image.decode_during_upload = self.decode_during_upload
+                    if self.prefetcher is not None and self.offscreen_context is not None:
+                        # Decode in a worker, leaving this thread free to upload the preview meanwhile;
+                        # on_current_decoded() uploads the full image
+                        self.prefetcher.decode_current(image, file_name)
+                        self._show_preview(image, file_name)
+                        return
+                    self._show_preview(image, file_name)
+                    if self.current_image is not image:
+                        return  # canceled while previewing
+                    if not image.load_from_file(file_name):
+                        self.load_failed.emit(file_name)  # noqa
+                        return
+                    self.decoded_cache.put(file_name, image)
             if self.offscreen_context is None:
                 self.image_data_is_pending = True
                 logger.debug(
@@ -66,19 +145,127 @@ class ImageLoader(QtCore.QObject):
                 )
             else:
                 self.upload_image(image)  # noqa
+                if image.array is not None and file_name not in self.decoded_cache:
+                    self.decoded_cache.put(file_name, image)  # finished decoding during the upload
+        except LoadCanceled:
+            logger.info(f"Canceled load of {file_name}")
         except BaseException as exc:
             logger.error(exc)
             self.load_failed.emit(file_name)
 
-    @QtCore.Slot(Image.Image, str)  # noqa
-    def load_from_pil_image(self, pil_image: Image.Image, file_name: str):
+    @QtCore.Slot(TiledImageLike, str, bool)  # noqa
+    def on_current_decoded(self, image: TiledImageLike, file_name: str, is_loaded: bool):
+        """A decode started by load_from_file_name() finished, in one of the prefetcher's workers"""
+        if not self._is_current(image):
+            if image is self._deferred_handover:
+                self._deferred_handover = None
+            return
+        if not is_loaded:
+            if not image.cancel_token.is_canceled:
+                self.load_failed.emit(file_name)  # noqa
+            return
+        try:
+            self.decoded_cache.put(file_name, image)
+            self.upload_image(image)
+            if image.array is not None and file_name not in self.decoded_cache:
+                self.decoded_cache.put(file_name, image)  # finished decoding during the upload
+        except LoadCanceled:
+            logger.info(f"Canceled load of {file_name}")
+        except BaseException as exc:
+            logger.error(exc)
+            self.load_failed.emit(file_name)  # noqa
+
+    def _load_progressive(self, image: TiledImageLike, file_name: str) -> bool:
+        """
+        Display a progressive JPEG as each scan decodes, uploading the first, blurriest scan
+        as usual, then replacing the pixels of the same tiles with each sharper scan.
+        Returns False, having loaded nothing, for other files.
+        """
+        if not self.use_progressive_jpeg or self.offscreen_context is None:
+            return False
+        scans = image.iter_progressive_scans(file_name, PROGRESSIVE_SCAN_SECONDS)
+        if scans is None:
+            return False
+        t0 = time.perf_counter()
+        try:
+            for scan_number in scans:
+                if len(image.tiles) == 0:
+                    self.upload_image(image)
+                    if len(image.tiles) < image.expected_tile_count:
+                        return True  # failed or canceled
+                elif not self._is_current(image) or not self._refresh_image(image):
+                    return True
+                if self.current_image is not image:
+                    return True
+                logger.debug(f"Displayed scan {scan_number} of {file_name} at {time.perf_counter() - t0:.3f} s")
+        finally:
+            scans.close()
+        self.decoded_cache.put(file_name, image)
+        return True
+
+    def _refresh_image(self, image: TiledImageLike) -> bool:
+        """Upload the pixels of an image again, into its displayed tiles; False on error"""
+        with self.offscreen_context:
+            image.refresh_gl()
+            # A fence of our own, so the tiles' load_sync stays valid for the display
+            sync = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            is_uploaded = self._wait_for_sync(sync)
+            GL.glDeleteSync(sync)
+        if is_uploaded is None:
+            logger.error(f"Failed waiting for texture refresh of {image.md.file_name}")
+        else:
+            self.tiles_uploaded.emit(image)  # noqa
+        return is_uploaded is not None
+
+    def _show_preview(self, image: TiledImageLike, file_name: str):
+        """
+        Decode and upload a reduced size version of a large image, for the initial fit-to-window view,
+        before the full resolution image loads behind it.
+        """
+        if self.offscreen_context is None:
+            return
+        preview = TiledImage()
+        preview.cancel_token = image.cancel_token  # one cancel stops both
+        t0 = time.perf_counter()
+        if not preview.load_preview_from_file(file_name, self.view_hint.window_size):
+            return
+        w, h = preview.preview_level.md.size_rpx
+        logger.info(f"Decoded {w}x{h} preview of {file_name} in {time.perf_counter() - t0:.3f} s")
+        self._deferred_handover = image
+        self.current_image = preview
+        self.texture_created.emit(preview)  # noqa
+        self.upload_image(preview)
+        if self.current_image is preview:
+            self.current_image = image  # any decode that finished meanwhile is queued, for on_current_decoded()
+
+    def _adopt_prefetched_image(self, image: TiledImageLike, cancel_token: CancellationToken):
+        """Make an already decoded image current, replaying its load progress to hand it to the display"""
+        image.cancel_token = cancel_token  # the prefetcher's token is not this load's
+        self._make_current(image)
+        for progress in (
+            LoadProgress.OBJECT_CREATED,
+            LoadProgress.FILE_OPENED,
+            LoadProgress.METADATA_LOADED,
+            LoadProgress.ARRAY_CREATED,
+        ):
+            image.set_progress(progress)
+
+    @QtCore.Slot(Image.Image, str, CancellationToken)  # noqa
+    def load_from_pil_image(self, pil_image: Image.Image, file_name: str, cancel_token: CancellationToken):
         """Load a PIL image without a corresponding file"""
+        if cancel_token.is_canceled:
+            logger.info(f"Skipping superseded load of {file_name}")
+            return
+        self._deferred_handover = None
         image = TiledImage()
-        image.sq.image_displayed.connect(self.on_image_displayed)
-        image.sq.progress_changed.connect(self.on_progress_changed)
+        image.cancel_token = cancel_token
+        self._make_current(image)
         image.set_progress(LoadProgress.OBJECT_CREATED)
-        image.load_from_pil_image(pil_image, file_name)
-        self.current_image = image
+        try:
+            image.load_from_pil_image(pil_image, file_name)
+        except LoadCanceled:
+            logger.info(f"Canceled load of {file_name}")
+            return
         if self.offscreen_context is None:
             self.image_data_is_pending = True
             logger.debug(
@@ -100,14 +287,51 @@ class ImageLoader(QtCore.QObject):
             if self.current_image is not None:
                 self.upload_image(self.current_image)
 
-    @staticmethod
-    def _loaded_tile_count(image: TiledImageLike) -> int:
-        """Count ready tiles; offscreen context must already be current."""
-        loaded_tile_count = 0
-        for tile in image.tiles:
-            if tile.is_ready():
-                loaded_tile_count += 1
-        return loaded_tile_count
+    @QtCore.Slot(UploadContextPool)  # noqa
+    def on_upload_contexts_created(self, upload_contexts: UploadContextPool) -> None:
+        self.upload_contexts = upload_contexts
+
+    def _wait_for_upload(self, image: TiledImageLike, timeout_ns: int) -> Optional[bool]:
+        """
+        Block until all tiles are uploaded, or until timeout.
+        Returns True when complete, False on timeout, and None on error.
+        Offscreen context must already be current.
+        """
+        if len(image.tiles) == 0:
+            return True
+        if self.upload_contexts is None:
+            # Fences in one context signal in order, so the last tile's fence covers all the others
+            syncs = [image.tiles[-1].load_sync]
+        else:
+            syncs = [tile.load_sync for tile in image.tiles]  # fences from several contexts, in any order
+        for sync in syncs:
+            if sync is None:
+                return None
+            status = GL.glClientWaitSync(sync, GL.GL_SYNC_FLUSH_COMMANDS_BIT, timeout_ns)
+            if status == GL.GL_TIMEOUT_EXPIRED:
+                return False
+            if status not in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED):
+                return None  # GL_WAIT_FAILED
+        return True
+
+    @QtCore.Slot(TiledImageLike)  # noqa
+    def release_image(self, image: TiledImageLike):
+        """Free the textures and buffers of an image that is no longer displayed"""
+        if image is self.current_image:
+            return  # still in use
+        if self.offscreen_context is None:
+            return  # nothing was ever uploaded
+        with self.offscreen_context:
+            image.release_gl()
+            logger.debug(texture_pool)
+
+    @QtCore.Slot(TiledImageLike, CancellationToken)  # noqa
+    def reactivate_image(self, image: TiledImageLike, cancel_token: CancellationToken):
+        """Make a still uploaded image current again; the request canceled any load in progress"""
+        if cancel_token.is_canceled:
+            return  # superseded while queued
+        image.cancel_token = cancel_token  # its old token was canceled when it left the screen
+        self.current_image = image
 
     @QtCore.Slot(TiledImageLike)  # noqa
     def on_image_displayed(self, image: TiledImageLike):
@@ -118,27 +342,149 @@ class ImageLoader(QtCore.QObject):
     def on_progress_changed(self, progress: int, image: TiledImageLike):
         if image is self.current_image:
             self.progress_changed.emit(progress)  # noqa
-            QCoreApplication.processEvents()
+            if progress == LoadProgress.METADATA_LOADED.value and image is not self._deferred_handover:
+                # Hand the image to the display now; tiles will appear as they are uploaded
+                self.texture_created.emit(image)  # noqa
+
+    def _await_tiles(self, image: TiledImageLike) -> bool:
+        """
+        Block until the tiles created so far are on the GPU.
+        Returns False if the load failed or was canceled meanwhile.
+
+        The image has already been handed to the display by now, so its GL
+        resources are released by the main window, via release_image(), not here.
+        """
+        while True:
+            is_uploaded = self._wait_for_upload(image, UPLOAD_WAIT_TIMEOUT_NS)
+            if is_uploaded is None:
+                logger.error(f"Failed waiting for texture upload of {image.md.file_name}")
+                self.load_failed.emit(image.md.file_name)  # noqa
+                return False
+            if is_uploaded:
+                return True
+            # Still uploading; check whether the load was canceled meanwhile
+            if not self._is_current(image):
+                logger.debug("image data is not current")
+                return False
+
+    def _get_pixel_buffers(self) -> Optional[PixelBufferRing]:
+        """Offscreen context must already be current"""
+        if not self.use_pixel_buffers:
+            return None
+        if self._pixel_buffers is None:
+            self._pixel_buffers = PixelBufferRing()
+        return self._pixel_buffers
+
+    def _emit_tile_progress(self, image: TiledImageLike, created_count: int, uploaded_count: int):
+        """Interpolate from ARRAY_CREATED to TILES_UPLOADED as tiles are created and uploaded"""
+        if image.is_preview:
+            return  # the full image reports progress
+        tile_count = max(1, image.expected_tile_count, created_count)
+        begin = LoadProgress.ARRAY_CREATED.value
+        created_span = LoadProgress.TILES_CREATED.value - begin
+        uploaded_span = LoadProgress.TILES_UPLOADED.value - LoadProgress.TILES_CREATED.value
+        progress = begin + (created_span * created_count + uploaded_span * uploaded_count) / tile_count
+        self.progress_changed.emit(int(progress))  # noqa
 
     def upload_image(self, image: TiledImageLike):
         if not self._is_current(image):
             return
+        is_uploaded = False
+        try:
+            is_uploaded = self._upload_image(image)
+        except LoadCanceled:
+            logger.info(f"Canceled upload of {image.md.file_name}")
+        finally:
+            image.release_mapped_pixels()  # the tiles have the pixels now, or are no longer wanted
+        if image is self._deferred_handover:
+            self._deferred_handover = None
+            if is_uploaded:
+                self.texture_created.emit(image)  # noqa  replaces the preview, with every tile ready
+            else:
+                with self.offscreen_context:  # never reached the display, so it is ours to release
+                    image.release_gl()
+
+    def _upload_image(self, image: TiledImageLike) -> bool:
+        """Returns False if the load failed or was canceled"""
         with self.offscreen_context:
-            image.initialize_gl()
-            if not self._is_current(image):
-                return
-            num_loaded_tiles = self._loaded_tile_count(image)
-            n_tiles = len(list(image.tiles))
-            while num_loaded_tiles < n_tiles:
-                logger.debug("waiting for tile upload")
-                time.sleep(0.050)
+            batch_start = None
+            uploaded_count = 0
+            tiles = image.iter_initialize_gl(
+                self.view_hint, self._get_pixel_buffers(), self.use_texture_arrays, self.upload_contexts)
+            for created_count, _tile in enumerate(tiles, start=1):
+                self._emit_tile_progress(image, created_count, uploaded_count)
+                if batch_start is not None and time.perf_counter() - batch_start < TILE_BATCH_SECONDS:
+                    continue  # keep filling this batch
+                # Show this batch, starting with the very first tile
+                if not self._await_tiles(image):
+                    return False
+                uploaded_count = created_count
+                self._emit_tile_progress(image, created_count, uploaded_count)
+                self.tiles_uploaded.emit(image)  # noqa
                 if not self._is_current(image):
-                    logger.debug("image data is not current")
-                    return
-                num_loaded_tiles = self._loaded_tile_count(image)
-            self.progress_changed.emit(90)  # noqa
-            assert image.md.file_name is not None
-            self.texture_created.emit(image)  # noqa
+                    return False
+                batch_start = time.perf_counter()
+            if not self._await_tiles(image):
+                return False
+            logger.info(f"Uploaded {image.gpu_byte_count / 2**20:.1f} MB of textures; {vram_budget}; {texture_pool}")
+            if not image.is_preview:
+                self.progress_changed.emit(LoadProgress.TILES_UPLOADED.value)  # noqa
+            self.tiles_uploaded.emit(image)  # noqa
+            return True
+
+    @QtCore.Slot(TiledImageLike)  # noqa
+    def upload_pyramid_tiles(self, image: TiledImageLike):
+        """
+        Upload the pyramid tiles the current view needs, and release the tiles it no longer keeps.
+        Newer views reach the pyramid directly from the UI thread, and a new load cancels the image's token.
+        """
+        pyramid = image.pyramid
+        if pyramid is None or self.offscreen_context is None:
+            return
+        with self.offscreen_context:
+            for tile in pyramid.take_evicted():
+                tile.release_gl()
+            batch = []
+            batch_start = time.perf_counter()
+            key = None  # requested, but not yet in the batch
+            try:
+                while image is self.current_image and not image.cancel_token.is_canceled:
+                    request = pyramid.next_request()
+                    if request is not None:
+                        key, tci = request
+                        tci.pixel_buffers = self._get_pixel_buffers()
+                        tile = PyramidTile(tci, key[1])
+                        tile.initialize_gl()
+                        batch.append(tile)
+                        key = None
+                    is_batch_full = time.perf_counter() - batch_start >= TILE_BATCH_SECONDS
+                    if len(batch) > 0 and (request is None or is_batch_full):
+                        # Hand over tiles only once they are on the GPU, so each repaint shows them
+                        if self._wait_for_sync(batch[-1].load_sync) is None:
+                            logger.error(f"Failed waiting for pyramid tile upload of {image.md.file_name}")
+                            break
+                        for uploaded in batch:
+                            pyramid.deliver(uploaded)
+                        batch = []
+                        self.tiles_uploaded.emit(image)  # noqa
+                        batch_start = time.perf_counter()
+                    if request is None:
+                        break
+            finally:
+                # Canceled or failed; the tiles never delivered may be requested again
+                pyramid.abandon([tile.pyramid_key for tile in batch] + ([] if key is None else [key]))
+                for tile in batch:
+                    tile.release_gl()
+
+    @staticmethod
+    def _wait_for_sync(sync) -> Optional[bool]:
+        """Block until a fence signals; True when it has, and None on error"""
+        while True:
+            status = GL.glClientWaitSync(sync, GL.GL_SYNC_FLUSH_COMMANDS_BIT, UPLOAD_WAIT_TIMEOUT_NS)
+            if status in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED):
+                return True
+            if status != GL.GL_TIMEOUT_EXPIRED:
+                return None
 
     progress_changed = QtCore.Signal(int)
     image_displayed = QtCore.Signal(TiledImageLike)
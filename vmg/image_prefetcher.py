@@ -0,0 +1,290 @@
+"""
+Background decoding, on a small pool of worker threads, of the current image
+and the images next to it in the folder, so Next and Previous find them
+already in memory.
+
+Decoding is one stage of a pipeline, and GL upload, in the loader thread, the
+other. The loader hands the current image to the pool ahead of everything else,
+and uploads it once decoded, while the other workers decode its neighbors. The
+main window sets the plan of neighbors, in priority order, from the UI thread,
+and the loader thread takes finished images from it. Decoded images wait within
+a memory cap, so decoding never runs far ahead of what will be shown.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from PySide6 import QtCore
+
+from vmg.cancellation import CancellationToken, LoadCanceled
+from vmg.decoded_image_cache import DecodedImageCache, image_byte_count
+from vmg.gl_resources import MEBIBYTE
+from vmg.interfaces import TiledImageLike
+from vmg.process_decode import ProcessDecoder
+from vmg.tiled_image import TiledImage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFETCH_DEPTH = 2
+DEFAULT_PREFETCH_MEMORY_MB = 2048
+# Enough to decode the current image and its next neighbor at once, leaving cores for the GL thread and the UI
+DEFAULT_DECODE_WORKER_COUNT = max(1, min(4, (os.cpu_count() or 2) // 2))
+# How long take() blocks on a decode in progress between checks for cancellation
+TAKE_WAIT_TIMEOUT_SECONDS = 0.050
+
+
+def neighbor_indices(index: int, count: int, depth: int, direction: int) -> list[int]:
+    """
+    Indices of images to prefetch around index, most urgent first, wrapping around the list.
+    Looks depth images ahead in the direction of travel, and one behind.
+    With no direction yet, alternates ahead and behind.
+    """
+    if direction == 0:
+        offsets = []
+        for step in range(1, depth + 1):
+            offsets.extend((step, -step))
+    else:
+        offsets = [direction * step for step in range(1, depth + 1)]
+        if depth > 0:
+            offsets.append(-direction)
+    result = []
+    for offset in offsets:
+        neighbor = (index + offset) % count
+        if neighbor != index and neighbor not in result:
+            result.append(neighbor)
+    return result
+
+
+class ImagePrefetcher(QtCore.QObject):
+    def __init__(
+            self,
+            target_thread: QtCore.QThread,
+            depth: int = DEFAULT_PREFETCH_DEPTH,
+            memory_cap_bytes: int = DEFAULT_PREFETCH_MEMORY_MB * MEBIBYTE,
+            decoded_cache: Optional[DecodedImageCache] = None,
+    ):
+        super().__init__()
+        self.decoded_cache = decoded_cache  # files already in here need no prefetch
+        self.target_thread = target_thread  # decoded images are handed to objects in this thread
+        self.depth = depth
+        self.memory_cap_bytes = memory_cap_bytes
+        self.process_decoder: Optional[ProcessDecoder] = None  # decodes in worker processes, instead of threads
+        self._condition = threading.Condition()
+        # Shared between threads, under the condition lock
+        self._plan: list[str] = []  # file names, most urgent first
+        self._decoded: dict[str, TiledImageLike] = {}
+        self._decoding: dict[str, CancellationToken] = {}  # prefetches in progress
+        self._current_jobs: collections.deque[tuple[TiledImageLike, str]] = collections.deque()
+        self._awaited: Optional[str] = None  # the loader is waiting for this one
+        self._direction = 0
+        self._idle_worker_count = 0
+        self._is_stopping = False
+        self._workers: list[threading.Thread] = []
+        self.hit_count = 0
+        self.miss_count = 0
+
+    # Emitted from a worker thread when decode_current() finishes: the image, its file name, and success
+    current_decoded = QtCore.Signal(TiledImageLike, str, bool)
+
+    def start(self, worker_count: int = DEFAULT_DECODE_WORKER_COUNT) -> None:
+        """Start the decode worker threads"""
+        for index in range(max(1, worker_count)):
+            worker = threading.Thread(target=self._work, name=f"image_decode_{index}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def stop(self) -> None:
+        """Cancel every decode in progress, and wait for the workers to finish"""
+        with self._condition:
+            self._is_stopping = True
+            for token in self._decoding.values():
+                token.cancel()
+            for image, _file_name in self._current_jobs:
+                image.cancel_token.cancel()
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self._workers.clear()
+        if self.process_decoder is not None:
+            self.process_decoder.shutdown()
+
+    def decode_current(self, image: TiledImageLike, file_name: str) -> None:
+        """
+        Decode a file into an image the loader has made current, ahead of every prefetch,
+        then emit current_decoded. If every worker is busy, the least urgent prefetch
+        in progress is canceled, to start over later. Run in the loader thread.
+        """
+        with self._condition:
+            self._current_jobs.append((image, file_name))
+            if self._idle_worker_count < len(self._current_jobs) and len(self._decoding) > 0:
+                least_urgent = max(self._decoding, key=self._urgency)
+                logger.info(f"Pausing prefetch of {least_urgent} to decode {file_name}")
+                self._decoding[least_urgent].cancel()
+            self._condition.notify_all()
+
+    def set_plan(self, file_names: list[str], direction: int) -> None:
+        """
+        Replace the files to prefetch, most urgent first; run in the UI thread.
+        Decodes in progress of files no longer planned are canceled, as happens to those
+        ahead in the old direction when the direction of travel changes.
+        """
+        with self._condition:
+            is_turning = direction != self._direction and self._direction != 0 and direction != 0
+            self._direction = direction
+            self._plan = list(file_names)
+            for file_name in list(self._decoded):
+                if file_name not in self._plan:
+                    del self._decoded[file_name]
+            canceled_count = 0
+            for file_name, token in self._decoding.items():
+                if file_name not in self._plan and file_name != self._awaited and not token.is_canceled:
+                    token.cancel()
+                    canceled_count += 1
+            if canceled_count > 0:
+                reason = "Direction changed" if is_turning else "Plan changed"
+                logger.info(f"{reason}; canceled prefetch of {canceled_count} images")
+            self._condition.notify_all()
+
+    def take(self, file_name: str, cancel_token: Optional[CancellationToken] = None) -> Optional[TiledImageLike]:
+        """
+        Remove and return the decoded image for a file, or None.
+        Waits if that file is being decoded right now, as that is quicker than starting over,
+        unless the load waiting for it is canceled meanwhile. Run in the loader thread.
+        """
+        with self._condition:
+            if file_name in self._plan:
+                self._plan.remove(file_name)  # so the prefetcher will not start it now
+            self._awaited = file_name
+            while file_name in self._decoding:
+                if cancel_token is not None and cancel_token.is_canceled:
+                    self._awaited = None  # the decode goes on, in case the file is planned again
+                    logger.info(f"Canceled wait for prefetch of {file_name}")
+                    return None
+                self._condition.wait(TAKE_WAIT_TIMEOUT_SECONDS)
+            self._awaited = None
+            image = self._decoded.pop(file_name, None)
+            if image is None:
+                self.miss_count += 1
+            else:
+                self.hit_count += 1
+            hits, misses = self.hit_count, self.miss_count
+        outcome = "hit" if image is not None else "miss"
+        logger.info(f"Prefetch {outcome} for {file_name}; {hits} hits, {misses} misses")
+        return image
+
+    def _next_file_name(self) -> Optional[str]:
+        """Most urgent planned file not yet decoded, or None; call with the lock held"""
+        decoded_bytes = sum(image_byte_count(image) for image in self._decoded.values())
+        if decoded_bytes >= self.memory_cap_bytes:
+            return None
+        for file_name in self._plan:
+            if file_name in self._decoded or file_name in self._decoding:
+                continue
+            if self.decoded_cache is not None and file_name in self.decoded_cache:
+                continue
+            return file_name
+        return None
+
+    def _urgency(self, file_name: str) -> int:
+        """Position in the plan, where lower is more urgent; call with the lock held"""
+        return self._plan.index(file_name) if file_name in self._plan else len(self._plan)
+
+    def _enforce_memory_cap(self) -> None:
+        """Drop the least urgent decoded images until under the cap; call with the lock held"""
+        while len(self._decoded) > 1:
+            decoded_bytes = sum(image_byte_count(image) for image in self._decoded.values())
+            if decoded_bytes <= self.memory_cap_bytes:
+                break
+            least_urgent = max(self._decoded, key=self._urgency)
+            logger.debug(f"Prefetch memory cap reached; dropping {least_urgent}")
+            del self._decoded[least_urgent]
+
+    def _work(self):
+        """
+        Decode the current image whenever there is one, and otherwise planned files,
+        until stopped; run in each worker thread
+        """
+        while True:
+            with self._condition:
+                current_job = None
+                file_name = None
+                while not self._is_stopping:
+                    if len(self._current_jobs) > 0:
+                        current_job = self._current_jobs.popleft()
+                        break
+                    file_name = self._next_file_name()
+                    if file_name is not None:
+                        break
+                    self._idle_worker_count += 1
+                    self._condition.wait()
+                    self._idle_worker_count -= 1
+                if self._is_stopping:
+                    return
+                if file_name is not None:
+                    self._decoding[file_name] = token = CancellationToken()
+            if current_job is not None:
+                self._decode_current(*current_job)
+                continue
+            image = None
+            try:
+                image = self._decode(file_name, token)
+            finally:
+                with self._condition:
+                    del self._decoding[file_name]
+                    if image is not None:
+                        if file_name in self._plan or file_name == self._awaited:
+                            self._decoded[file_name] = image
+                            self._enforce_memory_cap()
+                        else:
+                            logger.debug(f"Discarding prefetched {file_name}, no longer planned")
+                    self._condition.notify_all()
+
+    def _decode(self, file_name: str, token: CancellationToken) -> Optional[TiledImageLike]:
+        t0 = time.perf_counter()
+        image = TiledImage()
+        try:
+            if not self._load(image, file_name, token):
+                return None
+        except LoadCanceled:
+            logger.info(f"Canceled prefetch of {file_name}")
+            return None
+        except Exception as exc:
+            logger.warning(f"Prefetch of {file_name} failed: {exc}")
+            return None
+        # Qt objects can only be moved from their own thread, so hand over the signaller now
+        image.sq.moveToThread(self.target_thread)
+        logger.info(f"Prefetched {file_name} in {time.perf_counter() - t0:.2f} s")
+        return image
+
+    def _load(self, image: TiledImageLike, file_name: str, token: Optional[CancellationToken] = None) -> bool:
+        """Decode in this thread, or in a worker process when there is a process decoder"""
+        if self.process_decoder is None:
+            return image.load_from_file(file_name, token)
+        return self.process_decoder.load(image, file_name, token)
+
+    def _decode_current(self, image: TiledImageLike, file_name: str) -> None:
+        t0 = time.perf_counter()
+        is_loaded = False
+        try:
+            is_loaded = self._load(image, file_name)
+        except LoadCanceled:
+            logger.info(f"Canceled load of {file_name}")
+        except Exception as exc:
+            logger.error(exc)
+        if is_loaded:
+            logger.info(f"Decoded {file_name} in {time.perf_counter() - t0:.2f} s")
+        self.current_decoded.emit(image, file_name, is_loaded)  # noqa
+
+
+__all__ = [
+    "DEFAULT_DECODE_WORKER_COUNT",
+    "DEFAULT_PREFETCH_DEPTH",
+    "DEFAULT_PREFETCH_MEMORY_MB",
+    "TAKE_WAIT_TIMEOUT_SECONDS",
+    "ImagePrefetcher",
+    "neighbor_indices",
+]
@@ -13,6 +13,8 @@ from vmg.interfaces import TiledImageLike, InputFormat, PhotometricScale
 from vmg.offscreen_context import OffscreenContext
 from vmg.selection_box import (CursorHolder)
 from vmg.state import ViewState
+from vmg.tile_priority import FlatView, ViewHint, view_for_state
+from vmg.upload_contexts import DEFAULT_UPLOAD_CONTEXT_COUNT, UploadContextPool
 from vmg.shader import IImageShader, SphericalShader, RectangularTileShader, SphericalDngShader, RectangularDngShader
 
 logger = logging.getLogger(__name__)
@@ -44,6 +46,9 @@ class ImageWidgetGL(QtOpenGLWidgets.QOpenGLWidget):
         self.raw_rot_ont2 = numpy.eye(2, dtype=numpy.float32)  # For flatty images
         self.raw_rot_ont3 = numpy.eye(3, dtype=numpy.float32)  # For spherical panos
         self.offscreen_context_is_ready = False
+        self.upload_context_count = DEFAULT_UPLOAD_CONTEXT_COUNT  # beyond the loader's own
+        self.upload_contexts: Optional[UploadContextPool] = None
+        self.view_hint: Optional[ViewHint] = None  # tells the loader which tiles are on screen
         self._has_size = False
 
     @QtCore.Slot(CursorHolder)
@@ -54,6 +59,7 @@ class ImageWidgetGL(QtOpenGLWidgets.QOpenGLWidget):
             self.setCursor(cursor_holder.cursor)
 
     context_created = QtCore.Signal(OffscreenContext)
+    upload_contexts_created = QtCore.Signal(UploadContextPool)
 
     def event(self, event: QEvent):
         # if event.type() == QEvent.Type.Gesture:
@@ -126,6 +132,15 @@ class ImageWidgetGL(QtOpenGLWidgets.QOpenGLWidget):
         if main_window is not None and hasattr(main_window, "loading_thread"):
             offscreen_context.context.moveToThread(main_window.loading_thread)
         logger.debug("Created shared offscreen OpenGL context")
+        if self.upload_context_count > 0:
+            upload_contexts = []
+            for _index in range(self.upload_context_count):
+                upload_context = OffscreenContext(self, display_ctx, self.format())
+                upload_context.init_gl()
+                upload_contexts.append(upload_context)
+            self.upload_contexts = UploadContextPool(upload_contexts)
+            logger.debug(f"Created {self.upload_context_count} shared offscreen OpenGL contexts for tile upload")
+            self.upload_contexts_created.emit(self.upload_contexts)  # noqa
         self.context_created.emit(offscreen_context)  # noqa
 
     def paint_guide_lines(self):
@@ -180,15 +195,31 @@ class ImageWidgetGL(QtOpenGLWidgets.QOpenGLWidget):
             if self.image is None:
                 logger.debug("image_data is None")
                 return
+            if self.image.pyramid is not None:
+                self._update_pyramid(self.image)
             GL.glBindVertexArray(self.vao)
             self.program.paint_gl(self.view_state, self.image)
+            if self.view_hint is not None and len(self.image.tiles) < self.image.expected_tile_count:
+                # Still loading, so steer the remaining uploads toward the current view
+                self.view_hint.publish(self.image, view_for_state(self.view_state, self.image))
             if self.view_state.show_center_guides:
                 self.paint_guide_lines()
             logger.debug("Finished paintGL()")
         except BaseException:
             raise  # sufficient to get traceback to log, via except_hook
 
+    def _update_pyramid(self, image: TiledImageLike):
+        """Take in newly uploaded pyramid tiles, and ask for the ones the current view needs"""
+        image.pyramid.collect_delivered()
+        view = view_for_state(self.view_state, image)
+        if not isinstance(view, FlatView):
+            return  # spherical projections make do with the coarse levels
+        if image.pyramid.update_view(view, self.view_state.opx_scale_qwn()):
+            self.pyramid_tiles_requested.emit(image)  # noqa
+
     progress_changed = QtCore.Signal(int)
+    # Emitted when the view needs pyramid tiles that are not on the GPU yet
+    pyramid_tiles_requested = QtCore.Signal(TiledImageLike)
 
     request_message = QtCore.Signal(str, int)
 
@@ -196,6 +227,9 @@ class ImageWidgetGL(QtOpenGLWidgets.QOpenGLWidget):
         if not self._has_size:
             self._has_size = True
         self.view_state.set_window_size(w, h)
+        if self.view_hint is not None:
+            ratio = self.devicePixelRatioF()
+            self.view_hint.set_window_size(round(w * ratio), round(h * ratio))
 
     @staticmethod
     def _linear_from_srgb(image: NDArray):
@@ -225,10 +259,23 @@ class ImageWidgetGL(QtOpenGLWidgets.QOpenGLWidget):
 
     def set_image(self, image: TiledImageLike):
         logger.debug("Received image data")
+        previous_image = self.image
         self.image = image
-        self.view_state.reset()
+        # Replacing a reduced size preview keeps the view, which does not depend on image resolution
+        keep_view = (
+            previous_image is not None
+            and previous_image.is_preview
+            and previous_image.md.file_name == image.md.file_name
+        )
+        if previous_image is not None and previous_image is not image:
+            # Vertex arrays were created in, and only exist in, this widget's context
+            self.makeCurrent()
+            previous_image.release_render_gl()
+            self.doneCurrent()
+        if not keep_view:
+            self.view_state.reset()
         assert self.image is not None
-        self.view_state.set_image(self.image)
+        self.view_state.set_image(self.image, keep_view)
         self.set_input_format(self.image.md.input_format)
         w, h = self.image.md.size_opx
         self.image_size_changed.emit(int(w), int(h))  # noqa
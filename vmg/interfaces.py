@@ -4,7 +4,7 @@ from numbers import Number
 import enum
 
 from abc import ABC, abstractmethod
-from typing import Any, Protocol, Optional
+from typing import Any, Iterator, Protocol, Optional
 
 import numpy
 from numpy.typing import NDArray
@@ -19,6 +19,7 @@ from vmg.selection_box import SelectionBox
 
 Float = float  # Make inspection stfu about "| int"
 GLint = int
+GLenum = int
 
 
 class ImageMetadataLike(Protocol):
@@ -45,6 +46,9 @@ class ImageMetadataLike(Protocol):
     def load_exiftool(self, file_name: str) -> None:
         ...
 
+    def flip_raw_rows(self) -> None:
+        ...
+
     def load_pil_image(self, pil_image: Image.Image) -> None:
         ...
 
@@ -124,14 +128,53 @@ class TiledImageLike(Protocol):
     tiles: list[TileLike]
     load_progress: LoadProgress
     array: Optional[NDArray]
+    tex_format: Optional[GLenum]  # GL channel order of the array, when not the usual one, such as GL_BGR
     pil_image: Optional[Image.Image]
+    expected_tile_count: int
+    texture_arrays: list[Any]  # TileTextureArray; empty when each tile has its own texture
+    tile_instances: Optional[Any]  # TileInstanceBuffer, for instanced drawing from texture_arrays
+    pyramid: Optional[Any]  # TilePyramid, for images too large to upload at full resolution
+    gpu_byte_count: int  # video memory charged to vram_budget
+    is_preview: bool  # a reduced size decode, shown until the full image is uploaded
+    is_decoding: bool  # array still being filled, during upload
+    preview_level: Optional[Any]  # PyramidLevel with the reduced size pixels of a preview
 
     def initialize_gl(self) -> None:
         ...
 
+    def iter_initialize_gl(
+            self, view_hint=None, pixel_buffers=None, use_texture_arrays=True, upload_contexts=None,
+    ) -> Iterator["TileLike"]:
+        """Create tiles one at a time, so they can be displayed as they arrive."""
+        ...
+
+    def display_tiles(self) -> list["TileLike"]:
+        """Tiles to draw for the current view, in drawing order."""
+        ...
+
+    def full_resolution_tiles(self) -> list["TileLike"]:
+        """Displayed tiles with one texel per image pixel."""
+        ...
+
     def paint_gl(self, program: ShaderProgramLike, view_state: RenderStateLike) -> None:
         ...
 
+    def refresh_gl(self) -> None:
+        """Upload the pixels again into the existing tiles, in the loader context."""
+        ...
+
+    def release_gl(self) -> None:
+        """Delete textures and buffers, in the loader context."""
+        ...
+
+    def release_render_gl(self) -> None:
+        """Delete vertex arrays and instance buffers, in the UI context."""
+        ...
+
+    def release_mapped_pixels(self) -> None:
+        """Drop the array, if it is mapped from the image file, once the tiles are uploaded."""
+        ...
+
     def set_display_complete(self) -> None:
         ...
 
@@ -140,7 +183,9 @@ class TileLike(Protocol):
     """A rectangular region of an image backed by a GL texture."""
 
     texture_id: Optional[GLint]
+    layer: int  # index into a texture array, if the tile is stored in one
     uv_bounds: tuple[Float, Float, Float, Float]
+    rtc_bounds: tuple[Float, Float, Float, Float]
     vao: Optional[GLint]
 
     def is_ready(self) -> bool:
@@ -19,21 +19,34 @@ from PySide6.QtCore import Qt
 from PySide6.QtGui import QUndoStack, QKeySequence
 from PySide6.QtWidgets import QFileDialog, QMessageBox
 
+from vmg.cancellation import CancellationToken
 from vmg.circular_combo_box import CircularComboBox
 from vmg.command import CropToSelection
+from vmg.decoded_image_cache import DEFAULT_DECODED_CACHE_MB
+from vmg.folder_index import FolderIndex
+from vmg.gl_resources import DEFAULT_VRAM_BUDGET_MB, MEBIBYTE, vram_budget
 from vmg.image_loader import ImageLoader
+from vmg.image_prefetcher import (
+    DEFAULT_DECODE_WORKER_COUNT, DEFAULT_PREFETCH_DEPTH, DEFAULT_PREFETCH_MEMORY_MB, ImagePrefetcher,
+    neighbor_indices,
+)
 from vmg.interfaces import TiledImageLike, InputFormat
 from vmg.lens_dialog import LensDialog
 from vmg.log import LogDialog
-from vmg.natural_sort import natural_sort_key
+from vmg.natural_sort import NaturallySortedList
 from vmg.pixel_filter import PixelFilter, PixelNumerals
+from vmg.process_decode import ProcessDecoder
 from vmg.progress import ProgressStatus, ProgressState
+from vmg.upload_contexts import DEFAULT_UPLOAD_CONTEXT_COUNT
 from vmg.display_projection import DisplayProjection
 from vmg.recent_file import RecentFileList
 from vmg.ui.ui_vimage import Ui_MainWindow
 from vmg.version import __version__
 from vmg.git_hash import vimage_git_hash
 from vmg.resources import resource_filename
+from vmg.texture_residency import (
+    DEFAULT_RESIDENT_IMAGE_COUNT, DEFAULT_TEXTURE_POOL_MB, ResidentImageCache, texture_pool,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -66,9 +79,11 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         self.setupUi(self)
         self.setAcceptDrops(True)
         self.setAttribute(Qt.WA_AcceptTouchEvents, True)  # noqa
-        self.image_list = []
-        self.image_index = 0
+        self.folder_index = FolderIndex(self)  # behind image_list and image_index
+        self._followed_image = None  # (file name, time written) of a new image shown by Follow Newest Image
+        self._travel_direction = 0  # +1 after Next, -1 after Previous, 0 for a freshly opened folder
         self.image = None
+        self.resident_images = ResidentImageCache()  # recently displayed images, still uploaded
         self.imageWidgetGL.request_message.connect(self.statusbar.showMessage)
         self.imageWidgetGL.signal_360.connect(self.set_is_360)
         self.imageWidgetGL.image_size_changed.connect(self.set_image_size)
@@ -195,21 +210,39 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         self.menuEdit.insertAction(top_action, self.action_undo)
         self.menuEdit.insertAction(top_action, self.action_redo)
         self.menuEdit.insertSeparator(top_action)
+        self.action_follow_newest = QtGui.QAction("Follow Newest Image", self)
+        self.action_follow_newest.setCheckable(True)
+        self.action_follow_newest.setToolTip("Show each new image as it is saved in the folder, as when tethered")
+        view_actions = self.menuView.actions()
+        self.menuView.insertAction(view_actions[view_actions.index(self.actionNext) + 1], self.action_follow_newest)
         # File loading thread
         self._current_file_name = None
         self.loading_thread = QtCore.QThread()
         self.image_loader = ImageLoader()
         self.image_loader.moveToThread(self.loading_thread)
         self.loading_thread.start()
+        # Decode worker threads, for the current image and its neighbors; started once settings are read
+        self.image_prefetcher = ImagePrefetcher(
+            target_thread=self.loading_thread,
+            decoded_cache=self.image_loader.decoded_cache,
+        )
+        self.image_prefetcher.moveToThread(self.loading_thread)
+        self.image_prefetcher.current_decoded.connect(self.image_loader.on_current_decoded, QueuedConnection)
+        self.image_loader.prefetcher = self.image_prefetcher
         self.image_load_requested.connect(self.image_loader.load_from_file_name, QueuedConnection)
         self.pil_load_requested.connect(self.image_loader.load_from_pil_image, QueuedConnection)
         logger.debug(f"Connecting texture_created signal")
         self.image_loader.texture_created.connect(self.image_texture_created, QueuedConnection)
+        self.image_loader.tiles_uploaded.connect(self.image_tiles_uploaded, QueuedConnection)
         self.image_loader.load_failed.connect(self.image_load_failed, QueuedConnection)
         self.image_loader.image_displayed.connect(self.image_displayed, QueuedConnection)
         #
         self.imageWidgetGL.load_failed.connect(self.image_load_failed, QueuedConnection)
+        self.imageWidgetGL.upload_contexts_created.connect(
+            self.image_loader.on_upload_contexts_created, QueuedConnection)
         self.imageWidgetGL.context_created.connect(self.image_loader.on_context_created, QueuedConnection)
+        self.imageWidgetGL.view_hint = self.image_loader.view_hint
+        self.imageWidgetGL.pyramid_tiles_requested.connect(self.image_loader.upload_pyramid_tiles, QueuedConnection)
         # self.imageWidgetGL.image_displayed.connect(self.image_displayed, QueuedConnection)
         self.image_loader.image_displayed.connect(self.image_displayed, QueuedConnection)
         # progress tracking
@@ -220,22 +253,79 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         # Three stages of cancel signaling
         self.progress_status.cancel_load_requested.connect(self.cancel_image_load)  # noqa
         self.cancel_load_requested.connect(self.image_loader.cancel_load, QueuedConnection)  # noqa
+        # Video memory
+        self.image_release_requested.connect(self.image_loader.release_image, QueuedConnection)
+        self.image_reactivated.connect(self.image_loader.reactivate_image, QueuedConnection)
+        settings = QtCore.QSettings()
+        vram_budget.budget_bytes = int(settings.value("vram_budget_mb", DEFAULT_VRAM_BUDGET_MB)) * MEBIBYTE
+        self.image_loader.use_pixel_buffers = settings.value("upload_with_pixel_buffers", False, type=bool)
+        self.image_loader.use_texture_arrays = settings.value("draw_tiles_instanced", True, type=bool)
+        self.image_loader.use_progressive_jpeg = settings.value("progressive_jpeg_scans", True, type=bool)
+        self.image_loader.decode_during_upload = settings.value("decode_during_upload", True, type=bool)
+        self.imageWidgetGL.upload_context_count = int(
+            settings.value("upload_context_count", DEFAULT_UPLOAD_CONTEXT_COUNT))
+        self.resident_images.max_image_count = int(
+            settings.value("resident_image_count", DEFAULT_RESIDENT_IMAGE_COUNT))
+        texture_pool.max_bytes = int(settings.value("texture_pool_mb", DEFAULT_TEXTURE_POOL_MB)) * MEBIBYTE
+        self.image_loader.decoded_cache.budget_bytes = int(
+            settings.value("decoded_cache_mb", DEFAULT_DECODED_CACHE_MB)) * MEBIBYTE
+        self.image_prefetcher.depth = int(settings.value("prefetch_depth", DEFAULT_PREFETCH_DEPTH))
+        self.image_prefetcher.memory_cap_bytes = int(
+            settings.value("prefetch_memory_mb", DEFAULT_PREFETCH_MEMORY_MB)) * MEBIBYTE
+        decode_worker_count = int(settings.value("decode_worker_count", DEFAULT_DECODE_WORKER_COUNT))
+        if settings.value("decode_in_subprocesses", False, type=bool):
+            self.image_prefetcher.process_decoder = ProcessDecoder(decode_worker_count)
+        self.image_prefetcher.start(decode_worker_count)
+        self.action_follow_newest.setChecked(settings.value("follow_newest_image", False, type=bool))
+        self.action_follow_newest.toggled.connect(self.follow_newest_toggled)  # noqa
+        # Folder listing and watching
+        self.folder_index.changed.connect(self.folder_index_changed)
+        self.folder_index.newest_added.connect(self.newest_image_added)
         #
         # Logging
         self.log_window = LogDialog(self)
         self.lens_dialog = None  # Instantiate just in time
 
     def activate_indexed_image(self):
+        self._prefetch_neighbors()
         try:
             self.load_image_from_file(self.image_list[self.image_index])
         except PIL.UnidentifiedImageError as uie:
             self.statusbar.showMessage(str(uie), 5000)
         self.update_previous_next()
 
+    @property
+    def image_list(self) -> NaturallySortedList:
+        return self.folder_index.files
+
+    @property
+    def image_index(self) -> int:
+        return self.folder_index.position
+
+    @image_index.setter
+    def image_index(self, index: int) -> None:
+        self.folder_index.position = index
+
+    def _prefetch_neighbors(self, include_current: bool = True):
+        """
+        Plan background decoding around the current image, ahead in the direction of travel.
+        Call before requesting the current image, so a prefetch of it already under way is kept.
+        Once the current image is requested, replan without it, so it is not decoded twice.
+        """
+        count = len(self.image_list)
+        if count < 1:
+            return
+        indices = [self.image_index] if include_current else []
+        if count > 1:
+            indices += neighbor_indices(self.image_index, count, self.image_prefetcher.depth, self._travel_direction)
+        self.image_prefetcher.set_plan([str(self.image_list[i]) for i in indices], self._travel_direction)
+
     def cancel_image_load(self):
         if self._current_file_name is None:
             return
         logger.info(f"Canceling image load.")
+        # Set the token directly, because the loader thread is busy with the load
+        self.image_loader.cancel_load_in_progress()
         self.cancel_load_requested.emit(self._current_file_name)  # noqa
         self._current_file_name = None
         self.progress_status.set_state(ProgressState.LOAD_CANCELLED)
@@ -323,10 +413,14 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         return self
 
     def __exit__(self, _type, _value, _traceback):
+        self.folder_index.stop()
+        self.image_prefetcher.stop()
         self.loading_thread.quit()
         self.loading_thread.wait()
+        if self.imageWidgetGL.upload_contexts is not None:
+            self.imageWidgetGL.upload_contexts.stop()
 
-    image_load_requested = QtCore.Signal(str)
+    image_load_requested = QtCore.Signal(str, CancellationToken)
 
     def load_image_from_memory(self, image: PIL.Image.Image, name: str) -> None:
         if QtWidgets.QApplication.overrideCursor() is None:
@@ -334,9 +428,10 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         fn = str(name)
         self._current_file_name = fn
         self.progress_status.reset()
-        self.pil_load_requested.emit(image, fn)  # noqa
+        cancel_token = self.image_loader.cancel_load_in_progress()  # stop decoding the previous image
+        self.pil_load_requested.emit(image, fn, cancel_token)  # noqa
 
-    pil_load_requested = QtCore.Signal(Image.Image, str)
+    pil_load_requested = QtCore.Signal(Image.Image, str, CancellationToken)
 
     def load_image_from_file(self, file_name: str) -> None:
         stem = pathlib.Path(file_name).stem
@@ -348,16 +443,38 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         fn = str(file_name)
         self._current_file_name = fn
         self.undo_stack.clear()
-        self.image_load_requested.emit(fn)  # noqa
+        cancel_token = self.image_loader.cancel_load_in_progress()  # stop decoding the previous image
+        resident_image = self.resident_images.take(fn)
+        if resident_image is not None:
+            # Still uploaded, so just swap it in
+            self.image_reactivated.emit(resident_image, cancel_token)  # noqa
+            self._show_image(resident_image)
+            self.image_displayed(resident_image)
+            return
+        # Release textures before the load, so the loader can recycle them
+        for image in self.resident_images.make_room():
+            self.image_release_requested.emit(image)  # noqa
+        self.image_load_requested.emit(fn, cancel_token)  # noqa
+
+    image_reactivated = QtCore.Signal(TiledImageLike, CancellationToken)
 
     @QtCore.Slot(TiledImageLike)  # noqa
     def image_texture_created(self, image: TiledImageLike):
         logger.info(f"Received image texture {image.md.file_name}")
         if image.md.file_name != self._current_file_name:
             logger.info(f"ignoring stale texture loaded for {image.md.file_name}")
+            self.image_release_requested.emit(image)  # noqa
             return
+        self._show_image(image)
+
+    def _show_image(self, image: TiledImageLike):
+        previous_image = self.image
         self.image = image
         self.imageWidgetGL.set_image(image)
+        if previous_image is not None and previous_image is not image:
+            # Keep the textures of recent images, in case the user comes back
+            for released_image in self.resident_images.put(previous_image):
+                self.image_release_requested.emit(released_image)  # noqa
         fn = image.md.file_name
         self.set_current_image_path(fn)
         self.actionSave_As.setEnabled(True)
@@ -371,6 +488,13 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         self._check_lens_dialog()
         self.lens_dialog.set_image(image)
 
+    image_release_requested = QtCore.Signal(TiledImageLike)
+
+    @QtCore.Slot(TiledImageLike)  # noqa
+    def image_tiles_uploaded(self, image: TiledImageLike):
+        if image is self.image:
+            self.imageWidgetGL.update()  # Qt merges pending updates into one repaint
+
     @QtCore.Slot(str)  # noqa
     def image_load_failed(self, file_name: str):
         if file_name != self._current_file_name:
@@ -382,34 +506,30 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
             QtWidgets.QApplication.restoreOverrideCursor()
         self._current_file_name = None
 
+    @QtCore.Slot()  # noqa
+    def folder_index_changed(self) -> None:
+        self._prefetch_neighbors(include_current=False)
+        self.update_previous_next()
+
+    @QtCore.Slot(bool)  # noqa
+    def follow_newest_toggled(self, is_checked: bool) -> None:
+        QtCore.QSettings().setValue("follow_newest_image", is_checked)
+
+    @QtCore.Slot(str, float)  # noqa
+    def newest_image_added(self, file_name: str, written_time: float) -> None:
+        if not self.action_follow_newest.isChecked():
+            return
+        self._followed_image = (file_name, written_time)
+        self.image_index = self.image_list.index(file_name)
+        self._travel_direction = 0
+        self.activate_indexed_image()
+
     def load_main_image(self, file_name: str):
         logger.info(f"Loading image {file_name}")
-        path = Path(file_name)
-        name = path.name
-        paths_list = [path, ]
-        folder = path.parent.absolute()
-        for file in folder.glob("*.*"):
-            if file.name == name:
-                continue  # Skip the triggering file
-            # Accept all suffixes for supported image types
-            if file.suffix.lower() in (
-                    ".bmp",
-                    ".dng",
-                    ".heic",
-                    ".heif",
-                    ".gif",
-                    ".pbm",
-                    ".pgm",
-                    ".ppm",
-                    ".png",
-                    ".jpg",
-                    ".jpeg",
-                    ".tif",
-                    ".tiff",
-                    ".webp",
-            ):
-                paths_list.append(file)
-        self.set_image_list(paths_list, 0)
+        # Show this image at once; the rest of its folder joins the list as the scanner finds it
+        self.folder_index.open_folder(file_name)
+        self._travel_direction = 0
+        self.activate_indexed_image()
 
     @QtCore.Slot()  # noqa
     def process_clipboard_change(self):
@@ -448,15 +568,9 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
     def set_image_list(self, image_list: list, current_index: int):
         if len(image_list) < 1:
             return
-        current_item = image_list[current_index]
-        self.image_list = sorted(image_list, key=natural_sort_key)
-        self.image_index = None
-        for index, item in enumerate(self.image_list):
-            if item is current_item:
-                self.image_index = index
-        assert self.image_index is not None
-        self.load_image_from_file(self.image_list[self.image_index])
-        self.update_previous_next()
+        self.folder_index.set_files(image_list, current_index)
+        self._travel_direction = 0
+        self.activate_indexed_image()
 
     def set_input_format(self, input_format: InputFormat):
         if input_format == InputFormat.STANDARD_PHOTO:
@@ -510,7 +624,8 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         # Update progress label
         total = len(self.image_list)
         current = self.image_index + 1
-        self.list_label.setText(f"{current}/{total}")
+        more = "+" if self.folder_index.is_listing else ""  # still listing the folder
+        self.list_label.setText(f"{current}/{total}{more}")
         #
         if len(self.image_list) < 2:
             for action in (self.actionPrevious, self.actionNext):
@@ -730,6 +845,9 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         if len(self.image_list) < 2:
             self.actionNext.setEnabled(False)
             return
+        if self.image_index >= len(self.image_list) - 1 and self.folder_index.is_listing:
+            self.statusbar.showMessage("Still listing the images in this folder...", 2000)
+            return
         if self.image_index >= len(self.image_list) - 1:
             self.actionNext.setEnabled(False)  # prevent further next actions until dialog is done
             box = QMessageBox()
@@ -747,9 +865,8 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
             if reply != QMessageBox.Yes:
                 self.actionNext.setEnabled(True)
                 return
-        self.image_index += 1
-        if self.image_index >= len(self.image_list):
-            self.image_index -= len(self.image_list)
+        self.image_index = (self.image_index + 1) % len(self.image_list)
+        self._travel_direction = 1
         self.activate_indexed_image()
 
     @QtCore.Slot(bool)  # noqa
@@ -789,8 +906,7 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         if file_name is None:
             time_str = time.strftime("%Y%m%d_%H%M%S")
             file_name = f"Clipboard{time_str}"
-        self.image_list[:] = [file_name,]
-        self.image_index = 0
+        self.folder_index.set_files([file_name])
         self.undo_stack.clear()
         self.undo_stack.resetClean()  # clipboard image has not been saved
         self._current_file_name = file_name
@@ -814,6 +930,9 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         if len(self.image_list) < 2:
             self.actionPrevious.setEnabled(False)
             return
+        if self.image_index <= 0 and self.folder_index.is_listing:
+            self.statusbar.showMessage("Still listing the images in this folder...", 2000)
+            return
         if self.image_index <= 0:
             self.actionPrevious.setEnabled(False)
             box = QMessageBox()
@@ -831,9 +950,8 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
             if reply != QMessageBox.Yes:
                 self.actionPrevious.setEnabled(True)
                 return
-        self.image_index -= 1
-        if self.image_index < 0:
-            self.image_index += len(self.image_list)
+        self.image_index = (self.image_index - 1) % len(self.image_list)
+        self._travel_direction = -1
         self.activate_indexed_image()
 
     @QtCore.Slot(bool)  # noqa
@@ -933,6 +1051,10 @@ class VimageMainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
             self.progress_status.set_value(100)
             self.statusbar.showMessage(f"Loaded {stem}", 5000)
             QtWidgets.QApplication.restoreOverrideCursor()
+            if self._followed_image is not None and self._followed_image[0] == self._current_file_name:
+                latency = time.time() - self._followed_image[1]
+                logger.info(f"Showed new image {stem} {latency:.3f} s after it was written")
+                self._followed_image = None
 
     @QtCore.Slot(int)  # noqa
     def projection_combo_box_current_index_changed(self, index: int):
@@ -313,6 +313,11 @@ class ImageMetadata(ImageMetadataLike):
             except (KeyError, TypeError):
                 pass
 
+    def flip_raw_rows(self) -> None:
+        """Raw pixel rows are stored bottom to top, as in most BMP files, which have no EXIF orientation"""
+        self.orientation = ExifOrientation.FLIP_VERTICAL
+        self.rpx_R_opx = rotation_for_exif_orientation[self.orientation.value]
+
     def update_pcm_rot_geo(self):
         # Photographer's camera pose
         roll = radians(self.pose_roll_degrees)
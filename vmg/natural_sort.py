@@ -1,13 +1,167 @@
 # https://stackoverflow.com/a/4623518/146574
 
+import bisect
+from itertools import chain
+from operator import itemgetter
 import re
+from typing import Iterable
+
+_DIGITS = re.compile(r"(\d+)")
+# Up to this many new items, inserting each by bisection is quicker than merging all the items
+_INSERT_ONE_BY_ONE_MAX = 256
+# Entries per chunk of a NaturallySortedList; chunks split beyond twice this, and merge below half
+_CHUNK_SIZE = 512
 
 
 def natural_sort_key(s):
     return [int(text) if text.isdigit() else text.lower()
-            for text in re.split(r"(\d+)", str(s))]
+            for text in _DIGITS.split(str(s))]
+
+
+class NaturallySortedList(object):
+    """
+    Items in natural sort order, each stored with its sort key, so that
+    adding more items never computes the key of an item already present.
+
+    The entries are kept in sorted chunks of up to 2 * _CHUNK_SIZE, with the
+    last key of each chunk for bisection, and a Fenwick tree of the chunk
+    lengths for positions. So finding, adding, or removing one of n items
+    takes O(log n) comparisons, plus moving at most 2 * _CHUNK_SIZE entries
+    within one chunk. Splitting or merging chunks rebuilds the tree in
+    O(n / _CHUNK_SIZE), at most once per _CHUNK_SIZE / 2 changes. A batch of
+    k > _INSERT_ONE_BY_ONE_MAX items is instead merged in O(n + k log k).
+    """
+    def __init__(self, items: Iterable = ()):
+        entries = [(natural_sort_key(item), item) for item in items]
+        entries.sort(key=itemgetter(0))
+        self._set_entries(entries)
+
+    def _set_entries(self, entries: list) -> None:
+        self._chunks = [entries[start:start + _CHUNK_SIZE] for start in range(0, len(entries), _CHUNK_SIZE)]
+        self._rebuild_index()
+
+    def _rebuild_index(self) -> None:
+        self._maxes = [chunk[-1][0] for chunk in self._chunks]
+        tree = [0] + [len(chunk) for chunk in self._chunks]  # one-based
+        for node in range(1, len(tree)):
+            parent = node + (node & -node)
+            if parent < len(tree):
+                tree[parent] += tree[node]
+        self._tree = tree
+        self._length = sum(len(chunk) for chunk in self._chunks)
+
+    def _add_length(self, chunk_index: int, delta: int) -> None:
+        node = chunk_index + 1
+        while node < len(self._tree):
+            self._tree[node] += delta
+            node += node & -node
+        self._length += delta
+
+    def _offset(self, chunk_index: int) -> int:
+        """Number of entries in the chunks before this one"""
+        offset = 0
+        node = chunk_index
+        while node > 0:
+            offset += self._tree[node]
+            node -= node & -node
+        return offset
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        """Chunk holding the entry at a position, and its position within that chunk"""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("list index out of range")
+        chunk_index = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step > 0:
+            node = chunk_index + step
+            if node < len(self._tree) and self._tree[node] <= index:
+                chunk_index = node
+                index -= self._tree[node]
+            step >>= 1
+        return chunk_index, index
+
+    def _find(self, item) -> tuple[int, int]:
+        key = natural_sort_key(item)
+        chunk_index = bisect.bisect_left(self._maxes, key)
+        while chunk_index < len(self._chunks):
+            chunk = self._chunks[chunk_index]
+            index = bisect.bisect_left(chunk, key, key=itemgetter(0))
+            while index < len(chunk) and chunk[index][0] == key:
+                if chunk[index][1] == item:
+                    return chunk_index, index
+                index += 1
+            if index < len(chunk):
+                break  # past the items with this key
+            chunk_index += 1
+        raise ValueError(f"{item} is not in the list")
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index: int):
+        chunk_index, index = self._locate(index)
+        return self._chunks[chunk_index][index][1]
+
+    def __iter__(self):
+        return (item for _key, item in chain.from_iterable(self._chunks))
+
+    def add_keyed(self, entries: list[tuple[list, object]]) -> None:
+        """
+        Add (natural_sort_key(item), item) pairs, with keys computed elsewhere,
+        such as in a background thread. Items with equal keys keep their order.
+        """
+        if len(entries) > _INSERT_ONE_BY_ONE_MAX:
+            merged = list(chain.from_iterable(self._chunks)) + list(entries)
+            merged.sort(key=itemgetter(0))  # one merge of two sorted runs, once the new ones are sorted
+            self._set_entries(merged)
+            return
+        for entry in entries:
+            self._insert(entry)
+
+    def _insert(self, entry: tuple[list, object]) -> None:
+        if len(self._chunks) == 0:
+            self._set_entries([entry])
+            return
+        chunk_index = min(bisect.bisect_right(self._maxes, entry[0]), len(self._chunks) - 1)
+        chunk = self._chunks[chunk_index]
+        bisect.insort_right(chunk, entry, key=itemgetter(0))
+        self._maxes[chunk_index] = chunk[-1][0]
+        if len(chunk) > 2 * _CHUNK_SIZE:
+            self._chunks[chunk_index:chunk_index + 1] = [chunk[:_CHUNK_SIZE], chunk[_CHUNK_SIZE:]]
+            self._rebuild_index()
+        else:
+            self._add_length(chunk_index, 1)
+
+    def index(self, item) -> int:
+        """Position of an item, found by bisection; raises ValueError if absent"""
+        chunk_index, index = self._find(item)
+        return self._offset(chunk_index) + index
+
+    def remove(self, item) -> None:
+        """Remove an item, found by bisection; raises ValueError if absent"""
+        chunk_index, index = self._find(item)
+        chunk = self._chunks[chunk_index]
+        del chunk[index]
+        if len(chunk) >= _CHUNK_SIZE // 2 or len(self._chunks) == 1:
+            if len(chunk) > 0:
+                self._maxes[chunk_index] = chunk[-1][0]
+                self._add_length(chunk_index, -1)
+            else:
+                self._set_entries([])
+            return
+        first = max(chunk_index - 1, 0)  # merge with a neighbor
+        merged = self._chunks[first] + self._chunks[first + 1]
+        if len(merged) > 2 * _CHUNK_SIZE:
+            half = len(merged) // 2
+            self._chunks[first:first + 2] = [merged[:half], merged[half:]]
+        else:
+            self._chunks[first:first + 2] = [merged]
+        self._rebuild_index()
 
 
 __all__ = [
     "natural_sort_key",
+    "NaturallySortedList",
     ]
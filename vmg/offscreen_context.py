@@ -8,6 +8,7 @@ class OffscreenContext(QtCore.QObject):
         self.format = gl_format
         self.surface = None
         self.context = None
+        self._depth = 0  # nested with statements, of which only the outermost makes current and done
 
     # Delaying construction until just-in-time avoids a crash with makeCurrent()...
     def init_gl(self):
@@ -26,8 +27,12 @@ class OffscreenContext(QtCore.QObject):
     def __enter__(self):
         if self.context is None:
             self.init_gl()
-        self.context.makeCurrent(self.surface)
+        if self._depth == 0:
+            self.context.makeCurrent(self.surface)
+        self._depth += 1
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.context.doneCurrent()
+        self._depth -= 1
+        if self._depth == 0:
+            self.context.doneCurrent()
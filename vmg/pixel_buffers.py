@@ -0,0 +1,183 @@
+"""
+Asynchronous texture uploads through a ring of pixel buffer objects (PBOs).
+
+glTexImage2D from client memory blocks until the driver has copied the pixels.
+When the source is a bound GL_PIXEL_UNPACK_BUFFER instead, glTexImage2D returns
+right away and the transfer proceeds by DMA. With several buffers in rotation,
+the CPU copy of one tile into a mapped buffer overlaps the transfer of the
+previous tile out of another.
+
+Create, use, and release a PixelBufferRing in the loader thread, with the
+offscreen context current.
+"""
+
+import ctypes
+import logging
+
+import numpy
+from numpy.typing import NDArray
+from OpenGL import GL
+
+from vmg.gl_resources import vram_budget
+
+logger = logging.getLogger(__name__)
+
+# Long enough for any single tile transfer to finish
+_SLOT_WAIT_TIMEOUT_NS = 5_000_000_000
+
+
+class _PixelBuffer(object):
+    def __init__(self):
+        self.buffer_id = GL.glGenBuffers(1)  # noqa
+        self.capacity = 0  # bytes
+        self.sync = None  # signals when the last transfer out of this buffer is complete
+
+
+class PixelBufferRing(object):
+    """Round-robin pixel unpack buffers for streaming image tiles to textures"""
+    def __init__(self, buffer_count: int = 3):
+        assert buffer_count >= 2  # otherwise nothing overlaps
+        self.buffers = [_PixelBuffer() for _ in range(buffer_count)]
+        self._next_index = 0
+        self.uploaded_byte_count = 0
+
+    def _acquire(self, byte_count: int) -> _PixelBuffer:
+        pbo = self.buffers[self._next_index]
+        self._next_index = (self._next_index + 1) % len(self.buffers)
+        if pbo.sync is not None:
+            # Only blocks if the GPU is a whole ring behind
+            status = GL.glClientWaitSync(pbo.sync, GL.GL_SYNC_FLUSH_COMMANDS_BIT, _SLOT_WAIT_TIMEOUT_NS)
+            if status == GL.GL_TIMEOUT_EXPIRED:
+                logger.warning("Timed out waiting for a pixel buffer transfer")
+            GL.glDeleteSync(pbo.sync)
+            pbo.sync = None
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, pbo.buffer_id)
+        if pbo.capacity < byte_count:
+            GL.glBufferData(GL.GL_PIXEL_UNPACK_BUFFER, byte_count, None, GL.GL_STREAM_DRAW)
+            vram_budget.allocate(byte_count - pbo.capacity)
+            pbo.capacity = byte_count
+        return pbo
+
+    def _stage(self, region: NDArray) -> _PixelBuffer:
+        """Copy a (possibly strided) sub-array of the image into the next buffer, left bound"""
+        byte_count = region.nbytes
+        pbo = self._acquire(byte_count)
+        address = GL.glMapBufferRange(
+            GL.GL_PIXEL_UNPACK_BUFFER,
+            0,
+            byte_count,
+            GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_BUFFER_BIT | GL.GL_MAP_UNSYNCHRONIZED_BIT,
+        )
+        if not address:
+            GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+            raise RuntimeError("Failed to map pixel buffer")
+        mapped = (ctypes.c_ubyte * byte_count).from_address(address)
+        # Copy the tile, tightly packed, so no unpack row length or skip is needed
+        staged = numpy.ndarray(region.shape, dtype=region.dtype, buffer=mapped)
+        staged[...] = region
+        del staged, mapped
+        GL.glUnmapBuffer(GL.GL_PIXEL_UNPACK_BUFFER)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        self.uploaded_byte_count += byte_count
+        return pbo
+
+    def _finish(self, pbo: _PixelBuffer) -> None:
+        pbo.sync = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def tex_image_2d(
+            self,
+            region: NDArray,
+            internal_format: int,
+            tex_format: int,
+            data_type: int,
+    ) -> None:
+        """
+        Like glTexImage2D for the texture bound to GL_TEXTURE_2D,
+        with pixels from a (possibly strided) sub-array of the image.
+        """
+        height, width = region.shape[:2]
+        pbo = self._stage(region)
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            internal_format,
+            width,
+            height,
+            0,
+            tex_format,
+            data_type,
+            None,  # offset zero into the bound pixel buffer
+        )
+        self._finish(pbo)
+
+    def tex_sub_image_2d(
+            self,
+            region: NDArray,
+            tex_format: int,
+            data_type: int,
+    ) -> None:
+        """
+        Like glTexSubImage2D of the whole texture bound to GL_TEXTURE_2D,
+        with pixels from a (possibly strided) sub-array of the image.
+        """
+        height, width = region.shape[:2]
+        pbo = self._stage(region)
+        GL.glTexSubImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            0, 0,  # x, y offsets
+            width,
+            height,
+            tex_format,
+            data_type,
+            None,  # offset zero into the bound pixel buffer
+        )
+        self._finish(pbo)
+
+    def tex_sub_image_3d(
+            self,
+            region: NDArray,
+            layer: int,
+            tex_format: int,
+            data_type: int,
+    ) -> None:
+        """
+        Like glTexSubImage3D of one layer of the texture bound to GL_TEXTURE_2D_ARRAY,
+        with pixels from a (possibly strided) sub-array of the image.
+        """
+        height, width = region.shape[:2]
+        pbo = self._stage(region)
+        GL.glTexSubImage3D(
+            GL.GL_TEXTURE_2D_ARRAY,
+            0,
+            0, 0, layer,  # x, y, z offsets
+            width,
+            height,
+            1,  # depth
+            tex_format,
+            data_type,
+            None,  # offset zero into the bound pixel buffer
+        )
+        self._finish(pbo)
+
+    def release_gl(self) -> None:
+        for pbo in self.buffers:
+            if pbo.sync is not None:
+                GL.glDeleteSync(pbo.sync)
+                pbo.sync = None
+            GL.glDeleteBuffers(1, [pbo.buffer_id])
+            vram_budget.free(pbo.capacity)
+            pbo.capacity = 0
+        self.buffers = []
+
+
+def padded_region(array: NDArray, left: int, top: int, width: int, height: int) -> NDArray:
+    """View of the pixels of one padded tile"""
+    return array[top:top + height, left:left + width, ...]
+
+
+__all__ = [
+    "padded_region",
+    "PixelBufferRing",
+]
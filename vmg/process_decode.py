@@ -0,0 +1,226 @@
+"""
+Decoding image files in worker processes, instead of threads of the viewer.
+
+Much of a load is Python code holding the GIL, such as PIL mode conversion and
+EXIF and XMP parsing, which stalls the UI thread for as long as it runs. In a
+worker process it stalls nothing, and a codec that crashes takes down only the
+worker. Each worker decodes into a shared memory block, and the viewer wraps
+that block as the image array, without copying the pixels. Uncompressed files
+the worker would have memory mapped are mapped again by the viewer instead.
+
+The viewer owns each block once it is handed over, and unlinks it on attaching.
+On Windows a block lives only while some process has a handle to it, so there
+the worker holds its handle until the viewer sets the block's attached event,
+having opened a handle of its own, or having given up on the pixels.
+
+The image metadata arrives only once the whole image is decoded, so the display
+waits longer for its first tiles than when decoding in a thread.
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import sys
+import threading
+from typing import Optional
+
+import numpy
+from numpy.typing import NDArray
+from PIL import Image
+
+from vmg.cancellation import CancellationToken
+from vmg.interfaces import GLenum, TiledImageLike
+from vmg.load_progress import LoadProgress
+from vmg.metadata import ImageMetadata
+from vmg.tiled_image import TiledImage
+
+logger = logging.getLogger(__name__)
+
+# How often a thread waiting for a worker process checks for cancellation
+CANCEL_POLL_SECONDS = 0.050
+# Whether a worker must keep a block open until the viewer has attached to it
+_IS_BLOCK_HELD_BY_HANDLE = sys.platform == "win32"
+
+
+def _hold_block(block: shared_memory.SharedMemory, attached) -> None:
+    """Keep a block alive until the viewer has its own handle, or no longer wants it; worker thread"""
+    attached.wait()
+    block.close()
+
+
+class SharedMemoryArray(numpy.ndarray):
+    """Pixels in a shared memory block, which stays open for as long as this array, or any view of it"""
+    block: Optional[shared_memory.SharedMemory] = None
+
+
+class _DecodedPixels(object):
+    """What a worker process sends back: the metadata, and where to find the pixels"""
+    def __init__(
+            self,
+            md: ImageMetadata,
+            array: NDArray,
+            tex_format: Optional[GLenum],
+            pil_format: Optional[str],
+            attached=None,
+    ):
+        self.md = md
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.tex_format = tex_format
+        self.pil_format = pil_format  # to reopen the file with PIL, for cropping and copying
+        self.block_name: Optional[str] = None
+        self.mapped_file: Optional[str] = None
+        self.mapped_offset = 0
+        self.attached = attached  # Event proxy, set by the viewer once the worker may close its handle
+        if isinstance(array, numpy.memmap):
+            self.mapped_file = array.filename
+            self.mapped_offset = array.offset
+        else:
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            numpy.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+            self.block_name = block.name
+            if attached is not None:
+                threading.Thread(target=_hold_block, args=(block, attached), daemon=True).start()
+            else:
+                block.close()  # the block itself remains until the viewer unlinks it
+
+    def attach(self) -> NDArray:
+        """The pixels, as an array in this process; call once"""
+        if self.mapped_file is not None:
+            return numpy.memmap(
+                self.mapped_file, dtype=self.dtype, mode="r", offset=self.mapped_offset, shape=self.shape)
+        try:
+            block = shared_memory.SharedMemory(self.block_name)
+        finally:
+            self._release_worker_handle()
+        block.unlink()  # the mapping remains until the array is gone; unlinking now means no block outlives us
+        array = numpy.ndarray(self.shape, self.dtype, buffer=block.buf).view(SharedMemoryArray)
+        array.block = block
+        return array
+
+    def discard(self) -> None:
+        """Free the pixels of an abandoned decode"""
+        if self.block_name is not None:
+            try:
+                block = shared_memory.SharedMemory(self.block_name)
+            finally:
+                self._release_worker_handle()
+            block.unlink()
+            block.close()
+
+    def _release_worker_handle(self) -> None:
+        """Let the worker close its handle, now that this process has one"""
+        if self.attached is not None:
+            self.attached.set()
+
+
+def _decode_in_worker(file_name: str, attached=None) -> Optional[_DecodedPixels]:
+    """Decode a whole image file; run in a worker process"""
+    image = TiledImage()
+    if not image.load_from_file(file_name):
+        return None
+    pil_format = None if image.pil_image is None else image.pil_image.format
+    return _DecodedPixels(image.md, image.array, image.tex_format, pil_format, attached)
+
+
+def _discard_result(future: Future) -> None:
+    if future.cancelled() or future.exception() is not None:
+        return
+    pixels = future.result()
+    if pixels is not None:
+        pixels.discard()
+
+
+class ProcessDecoder(object):
+    """
+    Decodes image files in a pool of worker processes, started on first use.
+    Call load() from any number of threads at once.
+    """
+    def __init__(self, worker_count: int):
+        self.worker_count = worker_count
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None  # serves the attached events, where workers hold blocks open
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Forking a process that runs Qt and OpenGL threads is unsafe, so start each worker afresh
+                context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(self.worker_count, mp_context=context)
+                if _IS_BLOCK_HELD_BY_HANDLE and self._manager is None:
+                    self._manager = context.Manager()
+            return self._pool
+
+    def _attached_event(self):
+        """A new event for a worker to wait on before closing its block, or None where blocks need no holding"""
+        with self._lock:
+            return None if self._manager is None else self._manager.Event()
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Replace a pool whose worker died, so later loads start new workers"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def load(
+            self,
+            image: TiledImageLike,
+            file_name: str,
+            cancel_token: Optional[CancellationToken] = None,
+    ) -> bool:
+        """
+        Like image.load_from_file(), but decoding in a worker process.
+        Raises LoadCanceled if the token is canceled meanwhile; the worker finishes, and its pixels are freed.
+        """
+        if cancel_token is not None:
+            image.cancel_token = cancel_token
+        pool = self._executor()
+        attached = self._attached_event()
+        try:
+            future = pool.submit(_decode_in_worker, file_name, attached)
+            while True:
+                try:
+                    pixels = future.result(timeout=CANCEL_POLL_SECONDS)
+                    break
+                except FutureTimeoutError:  # not the builtin TimeoutError before Python 3.11
+                    if image.cancel_token.is_canceled:
+                        if not future.cancel():
+                            future.add_done_callback(_discard_result)
+                        image.cancel_token.raise_if_canceled()
+        except BrokenProcessPool:
+            logger.error(f"A decode worker process died, decoding {file_name}")
+            self._discard_pool(pool)
+            image.set_progress(LoadProgress.ERROR)
+            return False
+        if pixels is None:
+            image.set_progress(LoadProgress.ERROR)
+            return False
+        pil_image = None
+        if pixels.pil_format is not None:
+            try:
+                pil_image = Image.open(file_name, formats=[pixels.pil_format])  # parses only the header
+            except OSError as exc:
+                logger.warning(f"Could not reopen {file_name} with PIL: {exc}")
+        image.load_from_decoded(pixels.md, pixels.attach(), pil_image, pixels.tex_format)
+        return True
+
+    def shutdown(self) -> None:
+        """Stop the worker processes, once any decodes in progress are done"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            manager, self._manager = self._manager, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if manager is not None:
+            manager.shutdown()
+
+
+__all__ = [
+    "ProcessDecoder",
+    "SharedMemoryArray",
+]
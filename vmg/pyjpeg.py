@@ -3,21 +3,80 @@ Experimental code to make pythonic interface to low level libjpeg
 
 Following example in
 https://github.com/libjpeg-turbo/libjpeg-turbo/blob/main/example.c
+
+Loads the system libjpeg-turbo, with the version 6b (jpeg62) ABI these structures
+mirror, or the library named by the VMG_LIBJPEG environment variable.
+Importing this module raises OSError if neither can be found.
 """
 
 import ctypes
 from ctypes import byref, c_int, c_size_t, cdll, CFUNCTYPE, POINTER, sizeof, Structure
+import ctypes.util
 import logging
 import os
+import sys
+import time
+from typing import BinaryIO, Iterator
+
+import numpy
+from numpy.typing import NDArray
 
 logger = logging.getLogger(__name__)
 
 JPEG_LIB_VERSION = 62
-turbo_jpeg_lib = cdll.LoadLibrary("C:/Users/cmbruns/Documents/git/libjpeg-turbo/build_cmake/Debug/jpeg62.dll")
+
+
+def _library_candidates() -> list[str]:
+    """File names of libjpeg builds with the jpeg62 ABI, most specific first"""
+    candidates = []
+    if "VMG_LIBJPEG" in os.environ:
+        candidates.append(os.environ["VMG_LIBJPEG"])
+    if sys.platform == "win32":
+        candidates.extend(["jpeg62.dll", "libjpeg-62.dll"])
+    elif sys.platform == "darwin":
+        candidates.extend([
+            "libjpeg.62.dylib",
+            "/opt/homebrew/opt/jpeg-turbo/lib/libjpeg.62.dylib",
+            "/usr/local/opt/jpeg-turbo/lib/libjpeg.62.dylib",
+        ])
+    else:
+        candidates.append("libjpeg.so.62")
+    for name in ("jpeg62", "jpeg"):
+        found = ctypes.util.find_library(name)
+        if found is not None:
+            candidates.append(found)
+    return candidates
+
+
+def _load_library() -> ctypes.CDLL:
+    errors = []
+    for candidate in _library_candidates():
+        try:
+            lib = cdll.LoadLibrary(candidate)
+        except OSError as exc:
+            errors.append(str(exc))
+            continue
+        logger.debug(f"Loaded libjpeg from {candidate}")
+        return lib
+    raise OSError(f"No libjpeg with the jpeg62 ABI found: {'; '.join(errors) or 'no candidates'}")
+
+
+turbo_jpeg_lib = _load_library()
 
 JERR_INPUT_EMPTY = 42
 JWRN_JPEG_EOF = 120
 
+# J_COLOR_SPACE values
+JCS_GRAYSCALE = 1
+JCS_RGB = 2
+
+# Return values of jpeg_consume_input()
+JPEG_SUSPENDED = 0
+JPEG_REACHED_SOS = 1
+JPEG_REACHED_EOI = 2
+JPEG_ROW_COMPLETED = 3
+JPEG_SCAN_COMPLETED = 4
+
 DCTSIZE2 = 64  # DCTSIZE squared; num of elements in a block
 JMSG_LENGTH_MAX = 200  # recommended size of format_message buffer
 NUM_QUANT_TBLS = 4  # Quantization tables are numbered 0..3
@@ -29,7 +88,9 @@ D_MAX_BLOCKS_IN_MCU = 10  # decompressor's limit on blocks per MCU
 JDIMENSION = ctypes.c_uint
 JOCTET = ctypes.c_ubyte
 
-boolean = ctypes.c_ubyte
+# jmorecfg.h makes boolean an int, except on Windows, where rpcndr.h already defined it as unsigned char.
+# The offsets noted in the structures below are for Windows.
+boolean = ctypes.c_ubyte if sys.platform == "win32" else ctypes.c_int
 
 # Representation of a single sample (pixel element value). defined in `jmorecfg.h`
 JSAMPLE = ctypes.c_ubyte
@@ -363,17 +424,50 @@ jpeg_std_error = turbo_jpeg_lib.jpeg_std_error
 jpeg_std_error.restype = ctypes.POINTER(jpeg_error_mgr)
 jpeg_std_error.argtypes = [jpeg_error_mgr]
 
+# Buffered-image mode, for displaying progressive JPEG scans as they arrive
+jpeg_has_multiple_scans = turbo_jpeg_lib.jpeg_has_multiple_scans
+jpeg_has_multiple_scans.restype = boolean
+jpeg_has_multiple_scans.argtypes = [j_decompress_ptr]
+
+jpeg_consume_input = turbo_jpeg_lib.jpeg_consume_input
+jpeg_consume_input.restype = ctypes.c_int
+jpeg_consume_input.argtypes = [j_decompress_ptr]
+
+jpeg_input_complete = turbo_jpeg_lib.jpeg_input_complete
+jpeg_input_complete.restype = boolean
+jpeg_input_complete.argtypes = [j_decompress_ptr]
+
+jpeg_start_output = turbo_jpeg_lib.jpeg_start_output
+jpeg_start_output.restype = boolean
+jpeg_start_output.argtypes = [j_decompress_ptr, ctypes.c_int]
+
+jpeg_finish_output = turbo_jpeg_lib.jpeg_finish_output
+jpeg_finish_output.restype = boolean
+jpeg_finish_output.argtypes = [j_decompress_ptr]
+
+# Partial decompression, in libjpeg-turbo 1.5 and later
+has_partial_decode = hasattr(turbo_jpeg_lib, "jpeg_crop_scanline")
+if has_partial_decode:
+    jpeg_crop_scanline = turbo_jpeg_lib.jpeg_crop_scanline
+    jpeg_crop_scanline.restype = None
+    jpeg_crop_scanline.argtypes = [j_decompress_ptr, POINTER(JDIMENSION), POINTER(JDIMENSION)]
+
+    jpeg_skip_scanlines = turbo_jpeg_lib.jpeg_skip_scanlines
+    jpeg_skip_scanlines.restype = JDIMENSION
+    jpeg_skip_scanlines.argtypes = [j_decompress_ptr, JDIMENSION]
+
 
 class PyFileJpegSource(object):
     def __init__(self, file):
         self.file = file
         self.c_info = jpeg_decompress_struct()
-        jpeg_create_decompress(byref(self.c_info), JPEG_LIB_VERSION, sizeof(jpeg_decompress_struct))
+        # The error manager must be in place first, to report a mismatched library
         self.err = MyErrorManager(self.c_info)
+        jpeg_create_decompress(byref(self.c_info), JPEG_LIB_VERSION, sizeof(jpeg_decompress_struct))
         self.c_info.err = ctypes.pointer(self.err.pub)
         self.pub = jpeg_source_mgr()
         self.c_info.src = ctypes.pointer(self.pub)
-        self.buf_size = 4096
+        self.buf_size = 65536  # fewer Python callbacks per file
         self.buffer = (JOCTET * self.buf_size)()
         #
         self.pub.init_source = pfn_init_source(self.init_source)
@@ -570,6 +664,142 @@ class MyErrorManager(object):
         self.pub.msg_code = 0  # may be useful as a flag for "no error"
 
 
+def _output_array(c_info, height: int) -> NDArray:
+    """Uninitialized pixels for height rows of decoder output, shaped like numpy.array() of a PIL image"""
+    if c_info.output_components == 1:
+        return numpy.empty((height, c_info.output_width), dtype=numpy.uint8)
+    return numpy.empty((height, c_info.output_width, c_info.output_components), dtype=numpy.uint8)
+
+
+def _read_rows(c_info, pixels: NDArray) -> None:
+    """Decode the next scanlines straight into every row of pixels"""
+    row_count = pixels.shape[0]
+    row_stride = pixels.strides[0]
+    rows = (JSAMPROW * row_count)(*[
+        ctypes.cast(pixels.ctypes.data + y * row_stride, JSAMPROW) for y in range(row_count)])
+    read_count = 0
+    while read_count < row_count:
+        next_rows = ctypes.cast(ctypes.byref(rows, read_count * sizeof(JSAMPROW)), JSAMPARRAY)
+        read = jpeg_read_scanlines(c_info, next_rows, row_count - read_count)
+        if read == 0:
+            raise RuntimeError("jpeg data ended early")
+        read_count += read
+
+
+def decode_region(file: BinaryIO, left: int, top: int, width: int, height: int) -> NDArray:
+    """
+    Decode just one rectangle of a JPEG, as 8-bit gray or RGB pixels.
+    libjpeg-turbo skips the rows above the rectangle without decoding them, where it can,
+    and decodes only the columns of MCUs that overlap it, so a small region of
+    a huge image costs a small fraction of decoding the whole file.
+    """
+    if not has_partial_decode:
+        raise OSError("this libjpeg lacks jpeg_crop_scanline; libjpeg-turbo 1.5 or later is needed")
+    with PyFileJpegSource(file) as jss:
+        c_info = jss.c_info
+        jpeg_read_header(c_info, True)
+        if not (0 <= left and 0 <= top and 0 < width and 0 < height
+                and left + width <= c_info.image_width and top + height <= c_info.image_height):
+            raise ValueError(
+                f"region {width}x{height}+{left}+{top} is outside"
+                f" the {c_info.image_width}x{c_info.image_height} image")
+        c_info.out_color_space = JCS_GRAYSCALE if c_info.num_components == 1 else JCS_RGB
+        jpeg_start_decompress(c_info)
+        assert c_info.data_precision != 12  # we aren't handling 12-bit jpeg at the moment...
+        # Widened by one iMCU column on each side, as subsampled chroma at the edges of a crop is
+        # upsampled without its neighbors, then widened to whole iMCU columns by libjpeg-turbo
+        imcu_width = c_info.max_h_samp_factor * c_info.min_DCT_scaled_size
+        crop_left = JDIMENSION(max(0, left - imcu_width))
+        crop_width = JDIMENSION(min(c_info.output_width, left + width + imcu_width) - crop_left.value)
+        jpeg_crop_scanline(c_info, byref(crop_left), byref(crop_width))
+        if top > 0:
+            jpeg_skip_scanlines(c_info, top)
+        pixels = _output_array(c_info, height)
+        _read_rows(c_info, pixels)
+        # Skipping the rest, instead of aborting, lets the source manager finish cleanly
+        jpeg_skip_scanlines(c_info, c_info.output_height - c_info.output_scanline)
+        jpeg_finish_decompress(c_info)
+    x0 = left - crop_left.value
+    return numpy.ascontiguousarray(pixels[:, x0:x0 + width])
+
+
+def iter_row_bands(file: BinaryIO, band_height: int, overlap: int = 0) -> Iterator[tuple[int, NDArray]]:
+    """
+    Decode a JPEG from the top down, yielding (image row of the first pixel row, pixels)
+    for each band of band_height rows, widened by up to overlap rows into the bands above and below.
+    Only one band is ever held in memory: the same buffer is refilled for every band,
+    so use each one before resuming the iterator.
+    """
+    with PyFileJpegSource(file) as jss:
+        c_info = jss.c_info
+        jpeg_read_header(c_info, True)
+        c_info.out_color_space = JCS_GRAYSCALE if c_info.num_components == 1 else JCS_RGB
+        jpeg_start_decompress(c_info)
+        assert c_info.data_precision != 12  # we aren't handling 12-bit jpeg at the moment...
+        image_height = c_info.output_height
+        buffer = _output_array(c_info, min(image_height, band_height + 2 * overlap))
+        band_top = 0
+        kept_count = 0  # rows at the top of the buffer, carried over from the previous band
+        while True:
+            first_row = max(0, band_top - overlap)
+            end_row = min(image_height, band_top + band_height + overlap)
+            _read_rows(c_info, buffer[kept_count:end_row - first_row])
+            yield first_row, buffer[:end_row - first_row]
+            band_top += band_height
+            if band_top >= image_height:
+                break
+            # Rows shared with the next band move to the top of the buffer
+            next_first_row = band_top - overlap
+            kept_count = end_row - next_first_row
+            buffer[:kept_count] = buffer[next_first_row - first_row:end_row - first_row].copy()
+        jpeg_finish_decompress(c_info)
+
+
+def iter_progressive_scans(file: BinaryIO, min_interval_seconds: float = 0.0) -> Iterator[tuple[int, NDArray]]:
+    """
+    Decode a progressive JPEG in buffered-image mode, yielding (scan number, full size pixels)
+    after each scan, successively sharper, ending with the complete image.
+    The same array is refilled for every scan, so use it before resuming the iterator.
+    Scans that complete within min_interval_seconds of the previous output are folded into a later one.
+    """
+    with PyFileJpegSource(file) as jss:
+        c_info = jss.c_info
+        jpeg_read_header(c_info, True)
+        c_info.out_color_space = JCS_GRAYSCALE if c_info.num_components == 1 else JCS_RGB
+        c_info.buffered_image = True
+        jpeg_start_decompress(c_info)
+        assert c_info.data_precision != 12  # we aren't handling 12-bit jpeg at the moment...
+        pixels = _output_array(c_info, c_info.output_height)
+        previous_output_time = None
+        previous_scan_number = None
+        while True:
+            # Read through the end of the next scan
+            status = jpeg_consume_input(c_info)
+            while status not in (JPEG_SCAN_COMPLETED, JPEG_REACHED_EOI):
+                if status == JPEG_SUSPENDED:
+                    raise RuntimeError("jpeg input suspended")  # our file source never suspends
+                status = jpeg_consume_input(c_info)
+            is_final = bool(jpeg_input_complete(c_info))
+            scan_number = c_info.input_scan_number
+            if is_final and scan_number == previous_scan_number:
+                break  # the last scan was already shown, before its end of image marker was read
+            if (
+                not is_final
+                and previous_output_time is not None
+                and time.perf_counter() - previous_output_time < min_interval_seconds
+            ):
+                continue
+            jpeg_start_output(c_info, scan_number)
+            _read_rows(c_info, pixels)
+            jpeg_finish_output(c_info)
+            previous_output_time = time.perf_counter()
+            previous_scan_number = scan_number
+            yield scan_number, pixels
+            if is_final:
+                break
+        jpeg_finish_decompress(c_info)
+
+
 def main():
     with open("../test/images/Grace_Hopper.jpg", "rb") as fh:
         with PyFileJpegSource(fh) as jss:
@@ -3,7 +3,7 @@ import traceback
 import abc
 import logging
 from PIL import Image
-from typing import Callable, OrderedDict
+from typing import Callable, Optional, OrderedDict
 
 import numpy
 from OpenGL import GL
@@ -11,6 +11,8 @@ from OpenGL.GL.shaders import compileProgram, compileShader
 from OpenGL.GL.EXT.texture_filter_anisotropic import GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT, GL_TEXTURE_MAX_ANISOTROPY_EXT
 
 from vmg.load_progress import LoadProgress
+from vmg.tile_array import bind_tile_instances, TileInstanceBuffer
+from vmg.tile_coverage import FULL_SCREEN_NDC, NdcRect, SphereTileCoverage
 from vmg.tiled_image import DngTile, Tile
 from vmg.interfaces import RenderStateLike, TiledImageLike, InputFormat, PhotometricScale, TileLike, ShaderProgramLike
 from vmg.resources import resource_stream, resource_string
@@ -67,16 +69,38 @@ class UniformGroup:
             u.get_location(program)
 
 
+def link_program(*shaders) -> int:
+    """Like compileProgram, but without validation, which fails while samplers of different types share a unit"""
+    program = GL.glCreateProgram()
+    for shader in shaders:
+        GL.glAttachShader(program, shader)
+    GL.glLinkProgram(program)
+    if GL.glGetProgramiv(program, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+        raise RuntimeError(GL.glGetProgramInfoLog(program).decode(errors="replace"))
+    return program
+
+
+def paint_tile_instances(image: TiledImageLike, ndc_bounds: Optional[list[Optional[NdcRect]]] = None) -> None:
+    """Draw every displayable tile of an image stored in texture arrays, with the tile array program in use"""
+    if image.tile_instances is None:
+        image.tile_instances = TileInstanceBuffer()
+    if image.tile_instances.prepare(image, ndc_bounds):
+        image.set_display_complete()
+    image.tile_instances.draw()
+
+
 class TileUniforms(UniformGroup):
     def __init__(self):
         super().__init__()
         self.add(Uniform("tile_X_img", GL.glUniformMatrix3fv))
         self.add(Uniform("uv_bounds", GL.glUniform4f))
+        self.add(Uniform("ndc_bounds", GL.glUniform4f))
         self.add(Sampler2DUniform("tile"))
 
-    def set(self, tile: TileLike, unit: int = 0):
+    def set(self, tile: TileLike, unit: int = 0, ndc_bounds: NdcRect = FULL_SCREEN_NDC):
         self["tile_X_img"].set(1, True, tile.tile_X_img)
         self["uv_bounds"].set(*tile.uv_bounds)
+        self["ndc_bounds"].set(*ndc_bounds)
         self["tile"].set(unit, tile.texture_id)
 
 
@@ -160,7 +184,8 @@ class DemosaicShader(IImageShader):
 
 class NumeralShader(IImageShader):
     """Paints numeric intensity values onto very zoomed in pixels"""
-    def __init__(self):
+    def __init__(self, use_texture_arrays: bool = False):
+        self.use_texture_arrays = use_texture_arrays  # draw the instances staged by RectangularTileShader
         self.program = None
         self.numeral_texture_id = None
         self.uTile = Sampler2DUniform("tile")
@@ -195,15 +220,28 @@ class NumeralShader(IImageShader):
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_BORDER)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_BORDER)
 
-        self.program = compileProgram(
-            compile_shader("vmg.glsl",
-                           ["tile_rect.vert"], GL.GL_VERTEX_SHADER),
-            compile_shader("vmg.glsl",
-                           [
-                               "shared.frag",
-                               "numeral.frag",
-                           ], GL.GL_FRAGMENT_SHADER),
-        )
+        if self.use_texture_arrays:
+            self.program = link_program(
+                compile_shader("vmg.glsl",
+                               ["tile_array.vert"], GL.GL_VERTEX_SHADER),
+                compile_shader("vmg.glsl",
+                               [
+                                   "shared.frag",
+                                   "shared_array.frag",
+                                   "numeral_array.frag",
+                               ], GL.GL_FRAGMENT_SHADER),
+            )
+            bind_tile_instances(self.program)
+        else:
+            self.program = compileProgram(
+                compile_shader("vmg.glsl",
+                               ["tile_rect.vert"], GL.GL_VERTEX_SHADER),
+                compile_shader("vmg.glsl",
+                               [
+                                   "shared.frag",
+                                   "numeral.frag",
+                               ], GL.GL_FRAGMENT_SHADER),
+            )
         for u in (
             self.uTile,
             self.uNumerals,
@@ -219,10 +257,14 @@ class NumeralShader(IImageShader):
         self.uNdc_X_opx.set(1, True, state.ndc_xform_opx())
         self.uNumerals.set(1, self.numeral_texture_id)
         self.uNumeralData.set(state, image)
-        for tile in image.tiles:
+        if self.use_texture_arrays:
+            image.tile_instances.draw()
+            return
+        for tile in image.full_resolution_tiles():
+            if tile.vao is None:
+                continue  # not displayed yet
             assert tile.texture_id is not None
             self.uTile.set(0, tile.texture_id)
-            assert tile.vao is not None
             # TODO: this is for standard photos only
             GL.glBindVertexArray(tile.vao)
             GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
@@ -230,7 +272,8 @@ class NumeralShader(IImageShader):
 
 class NumeralSphereShader(IImageShader):
     """Paints numeric intensity values onto very zoomed in pixels"""
-    def __init__(self):
+    def __init__(self, use_texture_arrays: bool = False):
+        self.use_texture_arrays = use_texture_arrays  # draw the instances staged by SphericalShader
         self.program = None
         self.numeral_texture_id = None
         self.uTileData = TileUniforms()
@@ -266,15 +309,28 @@ class NumeralSphereShader(IImageShader):
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_BORDER)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_BORDER)
 
-        self.program = compileProgram(
-            compile_shader("vmg.glsl",
-                           ["sphere.vert"], GL.GL_VERTEX_SHADER),
-            compile_shader("vmg.glsl",
-                           [
-                               "shared.frag",
-                               "numeral_sphere.frag",
-                           ], GL.GL_FRAGMENT_SHADER),
-        )
+        if self.use_texture_arrays:
+            self.program = link_program(
+                compile_shader("vmg.glsl",
+                               ["sphere_array.vert"], GL.GL_VERTEX_SHADER),
+                compile_shader("vmg.glsl",
+                               [
+                                   "shared.frag",
+                                   "shared_array.frag",
+                                   "numeral_sphere_array.frag",
+                               ], GL.GL_FRAGMENT_SHADER),
+            )
+            bind_tile_instances(self.program)
+        else:
+            self.program = compileProgram(
+                compile_shader("vmg.glsl",
+                               ["sphere.vert"], GL.GL_VERTEX_SHADER),
+                compile_shader("vmg.glsl",
+                               [
+                                   "shared.frag",
+                                   "numeral_sphere.frag",
+                               ], GL.GL_FRAGMENT_SHADER),
+            )
         for u in (
             self.uTileData,
             self.uNumerals,
@@ -284,7 +340,13 @@ class NumeralSphereShader(IImageShader):
         ):
             u.get_location(self.program)
 
-    def paint_gl(self, state: RenderStateLike, image: TiledImageLike, render_pass=1) -> None:
+    def paint_gl(
+            self,
+            state: RenderStateLike,
+            image: TiledImageLike,
+            render_pass=1,
+            ndc_bounds: Optional[list[Optional[NdcRect]]] = None,
+    ) -> None:
         if self.program is None:
             self.initialize_gl()
         GL.glUseProgram(self.program)
@@ -292,9 +354,17 @@ class NumeralSphereShader(IImageShader):
         self.uNumeralData.set(state, image)
         self.uPano.set(state, image)
         self.uRenderPass.set(render_pass)
-        for tile in image.tiles:
+        if self.use_texture_arrays:
+            image.tile_instances.draw()  # staged with the same ndc_bounds
+            return
+        for index, tile in enumerate(image.tiles):
+            bounds = FULL_SCREEN_NDC if ndc_bounds is None else ndc_bounds[index]
+            if bounds is None:
+                continue  # tile is not on screen
+            if not tile.is_ready_for_display():
+                continue  # still uploading
             assert tile.texture_id is not None
-            self.uTileData.set(tile)
+            self.uTileData.set(tile, ndc_bounds=bounds)
             tile.initialize_arrays()
             assert tile.vao is not None
             GL.glBindVertexArray(tile.vao)
@@ -302,7 +372,10 @@ class NumeralSphereShader(IImageShader):
 
 
 class RectangularTileShader(IImageShader, ShaderProgramLike):
-    def __init__(self):
+    def __init__(self, use_texture_arrays: bool = False):
+        # Images stored in texture arrays are drawn by a second instance, with instanced draw calls
+        self.use_texture_arrays = use_texture_arrays
+        self.array_shader = None if use_texture_arrays else RectangularTileShader(use_texture_arrays=True)
         self.shader = None
         self.ndc_x_opx_location = None
         self.pixelFilter_location = None
@@ -316,18 +389,26 @@ class RectangularTileShader(IImageShader, ShaderProgramLike):
         self.background_color = [0.5, 0.5, 0.5, 0.5]
         self.box_shader = SelectionBoxShader()
         self.tile_boundary_shader = TileBoundaryShader()
-        self.numeral_shader = NumeralShader()
+        self.numeral_shader = NumeralShader(use_texture_arrays)
 
     def initialize_gl(self) -> None:
         try:
-            vertex_shader = compileShader(resource_string(
-                "vmg.glsl", "tile_rect.vert", ), GL.GL_VERTEX_SHADER)
-            fragment_shader = compile_shader("vmg.glsl", [
-                "shared.frag", "tile_rect.frag"], GL.GL_FRAGMENT_SHADER)
+            if self.use_texture_arrays:
+                vertex_shader = compile_shader("vmg.glsl", [
+                    "tile_array.vert"], GL.GL_VERTEX_SHADER)
+                fragment_shader = compile_shader("vmg.glsl", [
+                    "shared.frag", "shared_array.frag", "tile_rect_array.frag"], GL.GL_FRAGMENT_SHADER)
+            else:
+                vertex_shader = compileShader(resource_string(
+                    "vmg.glsl", "tile_rect.vert", ), GL.GL_VERTEX_SHADER)
+                fragment_shader = compile_shader("vmg.glsl", [
+                    "shared.frag", "tile_rect.frag"], GL.GL_FRAGMENT_SHADER)
             self.shader = GL.glCreateProgram()
             GL.glAttachShader(self.shader, vertex_shader)
             GL.glAttachShader(self.shader, fragment_shader)
             GL.glLinkProgram(self.shader)
+            if self.use_texture_arrays:
+                bind_tile_instances(self.shader)
             self.ndc_x_opx_location = GL.glGetUniformLocation(self.shader, "ndc_X_opx")
             self.sel_rect_opx_location = GL.glGetUniformLocation(self.shader, "sel_rect_opx")
             self.background_color_location = GL.glGetUniformLocation(self.shader, "background_color")
@@ -338,11 +419,16 @@ class RectangularTileShader(IImageShader, ShaderProgramLike):
             self.box_shader.initialize_gl()
             self.tile_boundary_shader.initialize_gl()
             self.numeral_shader.initialize_gl()
+            if self.array_shader is not None:
+                self.array_shader.initialize_gl()
         except BaseException as exc:
             traceback.print_exception(exc)
             raise
 
     def paint_gl(self, state: RenderStateLike, image: TiledImageLike) -> None:
+        if self.array_shader is not None and len(image.texture_arrays) > 0:
+            self.array_shader.paint_gl(state, image)
+            return
         GL.glUseProgram(self.shader)
         GL.glUniform1i(self.pixelFilter_location, state.pixel_filter.value)
         GL.glUniform4i(self.sel_rect_opx_location, *state.sel_rect.left_top_right_bottom)
@@ -351,7 +437,10 @@ class RectangularTileShader(IImageShader, ShaderProgramLike):
         GL.glUniform1f(self.opx_scale_qwn_location, state.opx_scale_qwn())
         self.brightness.set(state.brightness + image.md.baseline_exposure)
         self.input_is_linear.set(image.md.photometric_scale == PhotometricScale.LINEAR)
-        image.paint_gl(self, state)
+        if self.use_texture_arrays:
+            paint_tile_instances(image)
+        else:
+            image.paint_gl(self, state)
         do_numerals = state.opx_scale_qwn() < 0.2
         if do_numerals:
             self.numeral_shader.paint_gl(state, image)
@@ -498,7 +587,10 @@ class SelectionBoxShader(IImageShader):
 
 
 class SphericalShader(IImageShader, ShaderProgramLike):
-    def __init__(self):
+    def __init__(self, use_texture_arrays: bool = False):
+        # Images stored in texture arrays are drawn by a second instance, with instanced draw calls
+        self.use_texture_arrays = use_texture_arrays
+        self.array_shader = None if use_texture_arrays else SphericalShader(use_texture_arrays=True)
         self.shader = None
         self.uTile = TileUniforms()
         self.uPano = PanoUniforms()
@@ -508,16 +600,25 @@ class SphericalShader(IImageShader, ShaderProgramLike):
         self.brightness = Uniform("brightness", GL.glUniform1f)
         self.input_is_linear = Uniform("input_is_linear", GL.glUniform1i)
         self.uRenderPass = Uniform("render_pass", GL.glUniform1i)
-        self.numeral_shader = NumeralSphereShader()
+        self.numeral_shader = NumeralSphereShader(use_texture_arrays)
+        # Draw each tile over just its projected screen rectangle, instead of the whole screen
+        self.use_tile_coverage = True
+        self.coverage = SphereTileCoverage()
 
     def initialize_gl(self) -> None:
         try:
-            vertex_shader = compileShader(resource_string(
-                "vmg.glsl", "sphere.vert", ), GL.GL_VERTEX_SHADER)
-            fragment_shader = compileShader(
-                resource_string("vmg.glsl", "shared.frag") +
-                resource_string("vmg.glsl", "sphere.frag"),
-                GL.GL_FRAGMENT_SHADER)
+            if self.use_texture_arrays:
+                vertex_shader = compile_shader("vmg.glsl", [
+                    "sphere_array.vert"], GL.GL_VERTEX_SHADER)
+                fragment_shader = compile_shader("vmg.glsl", [
+                    "shared.frag", "shared_array.frag", "sphere_array.frag"], GL.GL_FRAGMENT_SHADER)
+            else:
+                vertex_shader = compileShader(resource_string(
+                    "vmg.glsl", "sphere.vert", ), GL.GL_VERTEX_SHADER)
+                fragment_shader = compileShader(
+                    resource_string("vmg.glsl", "shared.frag") +
+                    resource_string("vmg.glsl", "sphere.frag"),
+                    GL.GL_FRAGMENT_SHADER)
         except BaseException as exc:
             logger.error(exc)
             raise
@@ -525,6 +626,8 @@ class SphericalShader(IImageShader, ShaderProgramLike):
         GL.glAttachShader(self.shader, vertex_shader)
         GL.glAttachShader(self.shader, fragment_shader)
         GL.glLinkProgram(self.shader)
+        if self.use_texture_arrays:
+            bind_tile_instances(self.shader)
         self.pixelFilter_location = GL.glGetUniformLocation(self.shader, "pixelFilter")
         self.tile_X_img_location = GL.glGetUniformLocation(self.shader, "tile_X_img")
         self.uv_bounds_location = GL.glGetUniformLocation(self.shader, "uv_bounds")
@@ -537,8 +640,13 @@ class SphericalShader(IImageShader, ShaderProgramLike):
         ):
             u.get_location(self.shader)
         self.numeral_shader.initialize_gl()
+        if self.array_shader is not None:
+            self.array_shader.initialize_gl()
 
     def paint_gl(self, state: RenderStateLike, image: TiledImageLike) -> None:
+        if self.array_shader is not None and len(image.texture_arrays) > 0:
+            self.array_shader.paint_gl(state, image)
+            return
         # both nearest and catmull-rom use nearest at the moment.
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_NEAREST)
@@ -553,34 +661,46 @@ class SphericalShader(IImageShader, ShaderProgramLike):
         self.brightness.set(state.brightness + image.md.baseline_exposure)
         self.input_is_linear.set(image.md.photometric_scale == PhotometricScale.LINEAR)
         self.uRenderPass.set(1)
-        self.paint_image(image)
+        bounds = self.ndc_bounds(state, image, render_pass=1)
+        self.paint_image(image, bounds)
         do_numerals = state.opx_scale_qwn() < 0.2
         if do_numerals:
-            self.numeral_shader.paint_gl(state, image, render_pass=1)
+            self.numeral_shader.paint_gl(state, image, render_pass=1, ndc_bounds=bounds)
         if image.md.input_format == InputFormat.DUAL_FISHEYE:
             # second render pass for rear lens
             GL.glUseProgram(self.shader)
             self.uRenderPass.set(2)
-            self.paint_image(image)
+            bounds = self.ndc_bounds(state, image, render_pass=2)
+            self.paint_image(image, bounds)
             if do_numerals:
-                self.numeral_shader.paint_gl(state, image, render_pass=2)
+                self.numeral_shader.paint_gl(state, image, render_pass=2, ndc_bounds=bounds)
+
+    def ndc_bounds(self, state: RenderStateLike, image: TiledImageLike, render_pass: int) -> list[Optional[NdcRect]]:
+        if not self.use_tile_coverage:
+            return [FULL_SCREEN_NDC for _ in image.tiles]
+        return self.coverage.ndc_bounds(state, image, render_pass)
 
-    def paint_tile(self, tile: TileLike):
+    def paint_tile(self, tile: TileLike, ndc_bounds: Optional[NdcRect] = FULL_SCREEN_NDC):
         if not tile.is_ready_for_display():
             return False
+        if ndc_bounds is None:
+            return True  # off screen, so nothing to draw
         tile.initialize_arrays()
-        self.uTile.set(tile)
+        self.uTile.set(tile, ndc_bounds=ndc_bounds)
         GL.glBindVertexArray(tile.vao)
         GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
         return True
 
-    def paint_image(self, image: TiledImageLike):
+    def paint_image(self, image: TiledImageLike, ndc_bounds: list[Optional[NdcRect]]):
+        if self.use_texture_arrays:
+            paint_tile_instances(image, ndc_bounds)
+            return
         is_complete = True  # start optimistic
-        for tile in image.tiles:
-            if not self.paint_tile(tile):
+        for tile, bounds in zip(image.tiles, ndc_bounds):
+            if not self.paint_tile(tile, bounds):
                 is_complete = False
-            if is_complete:
-                image.set_display_complete()
+        if is_complete:
+            image.set_display_complete()
 
 
 class SphericalDngShader(IImageShader):
@@ -599,6 +719,8 @@ class SphericalDngShader(IImageShader):
     def __init__(self):
         self.shader = None
         self.numeral_shader = NumeralSphereShader()
+        self.use_tile_coverage = True
+        self.coverage = SphereTileCoverage()
 
     def initialize_gl(self) -> None:
         try:
@@ -643,34 +765,43 @@ class SphericalDngShader(IImageShader):
         # Be selective about numeral painting to avoid tile bounary artifacts at lower zoom
         do_numerals = state.opx_scale_qwn() < 0.2
         self.uRenderPass.set(1)
-        self._paint_one_pass(image)
+        bounds = self.ndc_bounds(state, image, render_pass=1)
+        self._paint_one_pass(image, bounds)
         if do_numerals:
-            self.numeral_shader.paint_gl(state, image, render_pass=1)
+            self.numeral_shader.paint_gl(state, image, render_pass=1, ndc_bounds=bounds)
         if image.md.input_format == InputFormat.DUAL_FISHEYE:
             # second render pass for rear lens
             GL.glUseProgram(self.shader)
             self.uRenderPass.set(2)
-            self._paint_one_pass(image)
+            bounds = self.ndc_bounds(state, image, render_pass=2)
+            self._paint_one_pass(image, bounds)
             if do_numerals:
-                self.numeral_shader.paint_gl(state, image, render_pass=2)
+                self.numeral_shader.paint_gl(state, image, render_pass=2, ndc_bounds=bounds)
 
-    def paint_tile(self, tile: DngTile) -> bool:
+    def ndc_bounds(self, state: RenderStateLike, image: TiledImageLike, render_pass: int) -> list[Optional[NdcRect]]:
+        if not self.use_tile_coverage:
+            return [FULL_SCREEN_NDC for _ in image.tiles]
+        return self.coverage.ndc_bounds(state, image, render_pass)
+
+    def paint_tile(self, tile: DngTile, ndc_bounds: Optional[NdcRect] = FULL_SCREEN_NDC) -> bool:
         assert isinstance(tile, DngTile)
-        self.uDemosaicTile.set(1, tile.demosaic_texture_id)
-        self.uBayerTile.set(0, tile.bayer_texture_id)
         if not tile.is_ready_for_display():
             return False
+        if ndc_bounds is None:
+            return True  # off screen, so nothing to draw
+        self.uDemosaicTile.set(1, tile.demosaic_texture_id)
+        self.uBayerTile.set(0, tile.bayer_texture_id)
         tile.initialize_arrays()
-        self.uTile.set(tile)
+        self.uTile.set(tile, ndc_bounds=ndc_bounds)
         GL.glBindVertexArray(tile.render_vao)
         GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
         return True
 
-    def _paint_one_pass(self, image: TiledImageLike):
+    def _paint_one_pass(self, image: TiledImageLike, ndc_bounds: list[Optional[NdcRect]]):
         is_complete = True
-        for tile in image.tiles:
+        for tile, bounds in zip(image.tiles, ndc_bounds):
             assert isinstance(tile, DngTile)
-            if not self.paint_tile(tile):
+            if not self.paint_tile(tile, bounds):
                 is_complete = False
         if is_complete:
             image.set_display_complete()
@@ -698,6 +829,10 @@ class TileBoundaryShader(IImageShader):
         GL.glUseProgram(self.program)
         self.uViewport.set(*state.window_size)
         self.ndc_X_opx.set(1, True, state.ndc_xform_opx())
-        for tile in image.tiles:
+        for tile in image.display_tiles():
             assert isinstance(tile, Tile)
+            if tile.vao is None:
+                if tile.texture_array is None or not tile.is_ready_for_display():
+                    continue  # not displayed yet
+                tile.initialize_arrays()  # instanced drawing needs no per-tile vertex array otherwise
             tile.paint_boundary()
@@ -410,13 +410,14 @@ class ViewState(
     def update_input_format(self) -> None:
         self._update_aspect_scale()
 
-    def set_image(self, image: TiledImageLike):
+    def set_image(self, image: TiledImageLike, keep_view: bool = False):
         if self.image is image:
             return
         # TODO: store image and delegate
         self.image = image
         self._update_aspect_scale()
-        self.reset()
+        if not keep_view:
+            self.reset()
 
     def set_window_size(self, width, height):
         self._size_qwn = DimensionsQwn(width, height)
@@ -0,0 +1,160 @@
+"""
+Keeping image textures in video memory across image changes.
+
+  * ResidentImageCache - UI thread. Recently displayed images, with all their
+    tiles still uploaded, so showing one again is just a pointer swap.
+  * TexturePool - loader thread. Texture objects of images evicted from the
+    cache, recycled by the next image with tiles of the same size and format,
+    which refills them with glTexSubImage instead of allocating new storage.
+"""
+
+import logging
+import threading
+from typing import Optional
+
+from OpenGL import GL
+
+from vmg.decoded_image_cache import cache_key, CacheKey
+from vmg.gl_resources import MEBIBYTE, vram_budget
+from vmg.interfaces import TiledImageLike
+from vmg.load_progress import LoadProgress
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESIDENT_IMAGE_COUNT = 2  # besides the current image
+DEFAULT_TEXTURE_POOL_MB = 512
+
+TextureKey = tuple[int, int, int, int, int]  # (target, width, height, layer count, internal format)
+
+
+class TexturePool(object):
+    """
+    Released texture objects, kept for reuse, up to a byte limit.
+    Pooled textures stay charged to vram_budget, since they still hold video memory.
+    Loader and upload threads, with an offscreen context current.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_TEXTURE_POOL_MB * MEBIBYTE):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: list[tuple[TextureKey, int, int]] = []  # (key, texture_id, byte count), oldest first
+        self.byte_count = 0
+        self.reuse_count = 0
+
+    def put(self, key: TextureKey, texture_id: int, byte_count: int) -> bool:
+        """Keep a texture the caller no longer needs; False means the caller should delete it"""
+        if byte_count > self.max_bytes:
+            return False
+        with self._lock:
+            self._entries.append((key, texture_id, byte_count))
+            self.byte_count += byte_count
+            vram_budget.allocate(byte_count)
+            while self.byte_count > self.max_bytes:
+                self._delete(self._entries.pop(0))
+        return True
+
+    def take(self, key: TextureKey) -> Optional[int]:
+        """A pooled texture with matching size and format, or None"""
+        with self._lock:
+            for index in range(len(self._entries) - 1, -1, -1):
+                if self._entries[index][0] == key:
+                    _key, texture_id, byte_count = self._entries.pop(index)
+                    self.byte_count -= byte_count
+                    vram_budget.free(byte_count)
+                    self.reuse_count += 1
+                    return texture_id
+        return None
+
+    def _delete(self, entry: tuple[TextureKey, int, int]) -> None:
+        _key, texture_id, byte_count = entry
+        GL.glDeleteTextures([texture_id])
+        self.byte_count -= byte_count
+        vram_budget.free(byte_count)
+
+    def clear(self) -> None:
+        """Delete every pooled texture"""
+        with self._lock:
+            while len(self._entries) > 0:
+                self._delete(self._entries.pop())
+
+    def __str__(self):
+        return (
+            f"texture pool {self.byte_count / MEBIBYTE:.0f} MB in {len(self._entries)} textures,"
+            f" {self.reuse_count} reused"
+        )
+
+
+# One pool for the loader's offscreen context
+texture_pool = TexturePool()
+
+
+class ResidentImageCache(object):
+    """
+    Fully uploaded images that are not on screen, most recently displayed last.
+    UI thread only; evicted images are handed back for release in the loader thread.
+    """
+    def __init__(self, max_image_count: int = DEFAULT_RESIDENT_IMAGE_COUNT):
+        self.max_image_count = max_image_count
+        self._images: list[tuple[CacheKey, TiledImageLike]] = []
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def put(self, image: TiledImageLike) -> list[TiledImageLike]:
+        """
+        Keep an image that is leaving the screen.
+        Returns the images to release instead: partial uploads, and any beyond the limits.
+        """
+        key = cache_key(image.md.file_name)
+        if (
+            key is None
+            or self.max_image_count < 1
+            or image.is_preview
+            or image.load_progress != LoadProgress.DISPLAYED
+            or len(image.tiles) < image.expected_tile_count
+        ):
+            return [image]
+        self._images.append((key, image))
+        return self._evict(self.max_image_count)
+
+    def take(self, file_name: str) -> Optional[TiledImageLike]:
+        """Remove and return the cached image of a file, if its contents have not changed"""
+        key = cache_key(file_name)
+        for index, (cached_key, image) in enumerate(self._images):
+            if cached_key == key:
+                del self._images[index]
+                self.hit_count += 1
+                logger.info(f"Resident texture hit for {file_name}; {self}")
+                return image
+        self.miss_count += 1
+        return None
+
+    def make_room(self) -> list[TiledImageLike]:
+        """
+        Before loading a new image, evict one more image than strictly needed,
+        so the loader can recycle its textures for the new one.
+        """
+        return self._evict(self.max_image_count - 1)
+
+    def _evict(self, max_image_count: int) -> list[TiledImageLike]:
+        evicted = []
+        while len(self._images) > max(0, max_image_count):
+            evicted.append(self._images.pop(0)[1])
+        # Stay within the video memory budget, keeping at least the newest image.
+        # Evicted images are released later, in the loader thread, so count their bytes as freed already.
+        freed_bytes = sum(image.gpu_byte_count for image in evicted)
+        while len(self._images) > 1 and vram_budget.used_bytes - freed_bytes > vram_budget.budget_bytes:
+            image = self._images.pop(0)[1]
+            freed_bytes += image.gpu_byte_count
+            evicted.append(image)
+        return evicted
+
+    def __str__(self):
+        return f"{len(self._images)} resident images; {self.hit_count} hits, {self.miss_count} misses"
+
+
+__all__ = [
+    "DEFAULT_RESIDENT_IMAGE_COUNT",
+    "DEFAULT_TEXTURE_POOL_MB",
+    "ResidentImageCache",
+    "texture_pool",
+    "TexturePool",
+]
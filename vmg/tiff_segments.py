@@ -0,0 +1,109 @@
+"""
+Decoding the strips or tiles of a TIFF or DNG page in parallel.
+
+imagecodecs releases the GIL while it decodes, so compressed segments, such as
+the lossless JPEG tiles of a DNG, decode on every core at once. The calling
+thread reads the segments, in order, and a shared pool decodes them, a bounded
+number ahead. Each decoded segment is copied into the output array in order,
+so the caller learns as soon as each band of rows is complete, and can upload
+those rows while the pool decodes the rest.
+"""
+
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+import logging
+import os
+import threading
+from typing import Iterator, Optional
+
+from numpy.typing import NDArray
+import tifffile
+
+from vmg.cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+DECODE_WORKER_COUNT = os.cpu_count() or 4
+# Segments submitted ahead of the one being stored, per worker; bounds the memory held by decoded segments
+SEGMENTS_AHEAD_PER_WORKER = 4
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def decode_pool() -> ThreadPoolExecutor:
+    """Threads shared by every segment decode, in the loader and prefetcher threads alike"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(DECODE_WORKER_COUNT, thread_name_prefix="tiff_decode")
+        return _pool
+
+
+def iter_decode_segments(
+        page: tifffile.TiffPage,
+        out: NDArray,
+        cancel_token: Optional[CancellationToken] = None,
+        pool: Optional[Executor] = None,
+) -> Iterator[int]:
+    """
+    Decode every strip or tile of a page into out, shaped like page.asarray(),
+    yielding the number of complete rows at the top of the image whenever it grows.
+    Raises LoadCanceled between segments once the token is canceled.
+    """
+    if pool is None:
+        pool = decode_pool()
+    keyframe = getattr(page, "keyframe", page)
+    shaped = keyframe.shaped  # (separate samples, depth, length, width, contiguous samples)
+    target = out.reshape(shaped)
+    decode_args = {}
+    if keyframe.compression in (6, 7, 34892, 33007):  # JPEG
+        decode_args = {"jpegtables": page.jpegtables, "jpegheader": keyframe.jpegheader}
+    segment_count = len(page.dataoffsets)
+    max_ahead = DECODE_WORKER_COUNT * SEGMENTS_AHEAD_PER_WORKER
+    pending = deque()
+    complete_row_count = 0
+    # In index order, which is row-major for tiles, so rows complete from the top down
+    segments = page.parent.filehandle.read_segments(
+        page.dataoffsets, page.databytecounts, length=segment_count, sort=False, flat=True)
+    try:
+        for data, index in segments:
+            if cancel_token is not None:
+                cancel_token.raise_if_canceled()
+            pending.append(pool.submit(keyframe.decode, data, index, **decode_args))
+            while len(pending) >= max_ahead or (len(pending) > 0 and pending[0].done()):
+                row_count = _store_segment(target, shaped, *pending.popleft().result())
+                if row_count > complete_row_count:
+                    complete_row_count = row_count
+                    yield complete_row_count
+        while len(pending) > 0:
+            if cancel_token is not None:
+                cancel_token.raise_if_canceled()
+            row_count = _store_segment(target, shaped, *pending.popleft().result())
+            if row_count > complete_row_count:
+                complete_row_count = row_count
+                yield complete_row_count
+    finally:
+        for future in pending:
+            future.cancel()  # canceled, or abandoned by the caller
+
+
+def _store_segment(target: NDArray, shaped: tuple, segment, indices, shape) -> int:
+    """Copy one decoded segment into place, returning the number of rows complete through its row of segments"""
+    s, d, h, w, _ = indices
+    if segment is not None:  # a missing segment stays zero
+        # Tiles along the right and bottom edges may extend past the image
+        depth = min(segment.shape[0], shaped[1] - d)
+        height = min(segment.shape[1], shaped[2] - h)
+        width = min(segment.shape[2], shaped[3] - w)
+        target[s, d:d + depth, h:h + height, w:w + width] = segment[:depth, :height, :width]
+    if s < shaped[0] - 1 or w + shape[2] < shaped[3]:
+        return 0  # rows are complete only after the last segment across, in the last sample plane
+    return min(shaped[2], h + shape[1])
+
+
+__all__ = [
+    "decode_pool",
+    "DECODE_WORKER_COUNT",
+    "iter_decode_segments",
+]
@@ -0,0 +1,325 @@
+"""
+Same-size image tiles stored as the layers of one GL_TEXTURE_2D_ARRAY, and drawn
+with one instanced draw call per array, instead of one draw call per tile.
+
+Interior tiles of an image all have the same padded size, so most images need
+only a few arrays: one for the interior, plus a few for the narrower tiles along
+the right and bottom edges.
+
+  * TileTextureArray - created and filled in the loader thread,
+    with the offscreen context current
+  * TileInstanceBuffer - per-tile draw parameters in a uniform buffer,
+    created, used, and released in the UI thread
+"""
+
+import logging
+from typing import Optional, Protocol
+
+import numpy
+from OpenGL import GL
+from OpenGL.GL.EXT.texture_filter_anisotropic import (
+    GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT,
+    GL_TEXTURE_MAX_ANISOTROPY_EXT,
+)
+
+from vmg.gl_resources import texture_byte_count, vram_budget
+from vmg.texture_residency import texture_pool
+
+logger = logging.getLogger(__name__)
+
+# Keep these in sync with the TileInstances uniform block in tile_array.vert and sphere_array.vert
+MAX_TILE_INSTANCES = 64  # per draw call; 64 instances fit the 16 KB minimum uniform block size
+FLOATS_PER_INSTANCE = 40
+INSTANCE_BYTE_COUNT = 4 * FLOATS_PER_INSTANCE
+TILE_INSTANCE_BINDING = 0  # uniform buffer binding point
+TILE_ARRAY_UNIT = 0  # texture unit for the tile array sampler
+
+# Offsets into one instance, in floats, following std140 layout rules
+_CORNERS = slice(0, 16)
+_TILE_X_IMG = slice(16, 28)  # mat3 is stored as three vec4 columns
+_UV_BOUNDS = slice(28, 32)
+_NDC_BOUNDS = slice(32, 36)
+_LAYER = 36
+
+
+class TileShape(Protocol):
+    """The parts of TileCreateInfo that determine which array a tile goes in"""
+    width: int
+    height: int
+    left_pad: int
+    top_pad: int
+    right_pad: int
+    bottom_pad: int
+    internal_format: int
+    tex_format: int
+    data_type: int
+
+
+class TileTextureArray(object):
+    """Storage for a group of same-size tiles, one texture array layer per tile"""
+    def __init__(
+            self,
+            padded_width: int,
+            padded_height: int,
+            layer_count: int,
+            internal_format: int,
+            tex_format: int,
+            data_type: int,
+    ):
+        self.padded_width = padded_width
+        self.padded_height = padded_height
+        self.layer_count = layer_count
+        self.internal_format = internal_format
+        self.tex_format = tex_format
+        self.data_type = data_type
+        self.texture_id = None
+        self.uploaded_layer_count = 0
+        self.is_mipmap_deferred = False  # set when layers upload in several contexts; generate_tiles() makes mipmaps
+        self.gpu_byte_count = 0  # video memory charged to vram_budget
+
+    def _texture_key(self) -> tuple[int, int, int, int, int]:
+        """Size and format of this array, for recycling it through texture_pool"""
+        return (
+            GL.GL_TEXTURE_2D_ARRAY, self.padded_width, self.padded_height, self.layer_count, self.internal_format)
+
+    def _byte_count(self) -> int:
+        return self.layer_count * texture_byte_count(self.padded_width, self.padded_height, self.internal_format)
+
+    def initialize_gl(self):
+        """Allocate storage for every layer, or recycle a released array; run in the loader thread"""
+        self.texture_id = texture_pool.take(self._texture_key())
+        if self.texture_id is not None:
+            # Same size and format, so keep the storage; the layers are overwritten one tile at a time
+            GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.texture_id)
+        else:
+            self.texture_id = GL.glGenTextures(1)  # noqa
+            GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.texture_id)
+            GL.glTexImage3D(
+                GL.GL_TEXTURE_2D_ARRAY,
+                0,
+                self.internal_format,
+                self.padded_width,
+                self.padded_height,
+                self.layer_count,
+                0,
+                self.tex_format,
+                self.data_type,
+                None,  # layers are filled in later, one tile at a time
+            )
+        # Show monochrome images as gray, not red
+        if self.internal_format in (GL.GL_RED, GL.GL_R16):
+            GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_SWIZZLE_G, GL.GL_RED)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_SWIZZLE_B, GL.GL_RED)
+        # Mipmaps can only be generated for the whole array at once, so until every
+        # layer has arrived, sample just the full resolution level
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAX_LEVEL, 0)
+        f_largest = GL.glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT)  # noqa
+        GL.glTexParameterf(GL.GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAX_ANISOTROPY_EXT, f_largest)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        byte_count = self._byte_count()
+        self.gpu_byte_count += byte_count
+        vram_budget.allocate(byte_count)
+
+    def bind(self):
+        """Bind to GL_TEXTURE_2D_ARRAY, allocating on first use; run in the loader thread"""
+        if self.texture_id is None:
+            self.initialize_gl()
+        else:
+            GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.texture_id)
+
+    def layer_uploaded(self):
+        """Call after each layer upload; generates mipmaps once the last layer is in, unless deferred"""
+        if self.is_mipmap_deferred:
+            return
+        self.uploaded_layer_count += 1
+        if self.uploaded_layer_count < self.layer_count:
+            return
+        self.generate_mipmaps()
+
+    def generate_mipmaps(self):
+        """Rebuild the mipmaps of every layer, after uploading all of them"""
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.texture_id)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAX_LEVEL, 1000)
+        GL.glGenerateMipmap(GL.GL_TEXTURE_2D_ARRAY)
+
+    def release_gl(self):
+        """Delete the texture; run in the loader thread, with the offscreen context current"""
+        if self.texture_id is not None:
+            if not texture_pool.put(self._texture_key(), self.texture_id, self._byte_count()):
+                GL.glDeleteTextures([self.texture_id])
+            self.texture_id = None
+        vram_budget.free(self.gpu_byte_count)
+        self.gpu_byte_count = 0
+
+
+def plan_texture_arrays(layout: list[TileShape], max_layer_count: int) -> list[TileTextureArray]:
+    """
+    Group tiles by padded size, assigning each its array and layer,
+    as tile.texture_array and tile.layer
+    """
+    groups: dict[tuple, list[TileShape]] = {}
+    for tci in layout:
+        key = (
+            tci.width + tci.left_pad + tci.right_pad,
+            tci.height + tci.top_pad + tci.bottom_pad,
+            tci.internal_format,
+            tci.tex_format,
+            tci.data_type,
+        )
+        groups.setdefault(key, []).append(tci)
+    result = []
+    for (padded_width, padded_height, internal_format, tex_format, data_type), group in groups.items():
+        for start in range(0, len(group), max_layer_count):
+            members = group[start:start + max_layer_count]
+            texture_array = TileTextureArray(
+                padded_width, padded_height, len(members), internal_format, tex_format, data_type)
+            for layer, tci in enumerate(members):
+                tci.texture_array = texture_array
+                tci.layer = layer
+            result.append(texture_array)
+    return result
+
+
+def instance_for_tile(tile) -> numpy.ndarray:
+    """Draw parameters of one tile, laid out like TileInstance in tile_array.vert"""
+    result = numpy.zeros(FLOATS_PER_INSTANCE, dtype=numpy.float32)
+    result[_CORNERS] = tile.vertexes
+    columns = numpy.zeros((3, 4), dtype=numpy.float32)
+    columns[:, :3] = numpy.asarray(tile.tile_X_img).T
+    result[_TILE_X_IMG] = columns.flatten()
+    result[_UV_BOUNDS] = tile.uv_bounds
+    result[_NDC_BOUNDS] = (-1, -1, 1, 1)
+    result[_LAYER] = tile.layer
+    return result
+
+
+class TileInstanceBuffer(object):
+    """
+    Per-tile draw parameters of one image, in a uniform buffer,
+    so each texture array draws in one glDrawArraysInstanced call.
+    Create, use, and release in the UI thread, with the widget context current.
+    """
+    def __init__(self):
+        self.buffer_id = None
+        self.capacity = 0  # bytes
+        self._stride = None  # bytes between the instance blocks of successive draw calls
+        self._instances = numpy.zeros((0, FLOATS_PER_INSTANCE), dtype=numpy.float32)
+        self._array_index = numpy.zeros(0, dtype=numpy.int32)
+        self._is_ready = numpy.zeros(0, dtype=bool)
+        self._is_complete = False
+        self._ndc_bounds = None
+        self._ndc_instances = None
+        self._draws: list[tuple[int, int, int]] = []  # texture id, buffer offset, instance count
+
+    def _update_tiles(self, image) -> bool:
+        """Catch up with tiles the loader has added or finished; True once all are displayable"""
+        if self._is_complete:
+            return True
+        tiles = image.tiles[:]  # the loader thread may be appending
+        old_count = len(self._instances)
+        if len(tiles) > old_count:
+            array_index = {id(a): index for index, a in enumerate(image.texture_arrays)}
+            new_tiles = tiles[old_count:]
+            self._instances = numpy.concatenate([
+                self._instances, numpy.array([instance_for_tile(t) for t in new_tiles])])
+            self._array_index = numpy.concatenate([
+                self._array_index, numpy.array([array_index[id(t.texture_array)] for t in new_tiles])])
+            self._is_ready = numpy.concatenate([self._is_ready, numpy.zeros(len(new_tiles), dtype=bool)])
+            self._ndc_bounds = None
+        for index in numpy.flatnonzero(~self._is_ready):
+            self._is_ready[index] = tiles[index].is_ready_for_display()
+        self._is_complete = len(tiles) >= image.expected_tile_count and bool(numpy.all(self._is_ready))
+        return self._is_complete
+
+    def _with_ndc_bounds(self, ndc_bounds: list) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """Instances with screen bounds filled in, and which of them are on screen"""
+        if ndc_bounds is not self._ndc_bounds:
+            # Screen bounds are cached by the caller, so this only runs when the view changes
+            count = len(self._instances)
+            # Tiles that arrived after the bounds were computed count as off screen, until the next frame
+            bounds = list(ndc_bounds[:count]) + [None] * (count - len(ndc_bounds))
+            is_on_screen = numpy.array([b is not None for b in bounds], dtype=bool)
+            instances = self._instances.copy()
+            if numpy.any(is_on_screen):
+                instances[is_on_screen, _NDC_BOUNDS] = [b for b in bounds if b is not None]
+            self._ndc_bounds = ndc_bounds
+            self._ndc_instances = (instances, is_on_screen)
+        return self._ndc_instances
+
+    def prepare(self, image, ndc_bounds: Optional[list] = None) -> bool:
+        """
+        Upload the parameters of every displayable tile, grouped by texture array.
+        ndc_bounds, as from SphereTileCoverage, limits each tile to a screen rectangle
+        and leaves out tiles that are off screen.
+        Returns True once every tile of the image has been uploaded.
+        """
+        is_complete = self._update_tiles(image)
+        if ndc_bounds is None:
+            instances, is_visible = self._instances, self._is_ready
+        else:
+            instances, is_on_screen = self._with_ndc_bounds(ndc_bounds)
+            is_visible = self._is_ready & is_on_screen
+        if self.buffer_id is None:
+            self.buffer_id = GL.glGenBuffers(1)  # noqa
+            alignment = int(GL.glGetIntegerv(GL.GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+            block_byte_count = MAX_TILE_INSTANCES * INSTANCE_BYTE_COUNT
+            self._stride = -(-block_byte_count // alignment) * alignment
+        # One block of up to MAX_TILE_INSTANCES instances per draw call
+        self._draws = []
+        blocks = []
+        for index, texture_array in enumerate(image.texture_arrays):
+            selected = instances[is_visible & (self._array_index == index)]
+            for start in range(0, len(selected), MAX_TILE_INSTANCES):
+                block = selected[start:start + MAX_TILE_INSTANCES]
+                self._draws.append((texture_array.texture_id, len(blocks) * self._stride, len(block)))
+                blocks.append(block)
+        if len(blocks) == 0:
+            return is_complete  # nothing to draw yet
+        data = numpy.zeros((len(blocks), self._stride // 4), dtype=numpy.float32)
+        for row, block in zip(data, blocks):
+            row[:block.size] = block.flatten()
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.buffer_id)
+        # Re-specifying the whole buffer lets the driver hand us fresh memory, instead of waiting on the last frame
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, data.nbytes, data, GL.GL_STREAM_DRAW)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, 0)
+        if data.nbytes != self.capacity:
+            vram_budget.allocate(data.nbytes - self.capacity)
+            self.capacity = data.nbytes
+        return is_complete
+
+    def draw(self):
+        """Draw the tiles staged by the last prepare(), with the tile array program in use"""
+        GL.glActiveTexture(GL.GL_TEXTURE0 + TILE_ARRAY_UNIT)
+        for texture_id, offset, instance_count in self._draws:
+            GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, texture_id)
+            GL.glBindBufferRange(GL.GL_UNIFORM_BUFFER, TILE_INSTANCE_BINDING, self.buffer_id, offset, self._stride)
+            GL.glDrawArraysInstanced(GL.GL_TRIANGLE_STRIP, 0, 4, instance_count)
+
+    def release_gl(self):
+        """Delete the uniform buffer; run in the UI thread, with the widget context current"""
+        if self.buffer_id is not None:
+            GL.glDeleteBuffers(1, [self.buffer_id])
+            self.buffer_id = None
+        vram_budget.free(self.capacity)
+        self.capacity = 0
+        self._draws = []
+
+
+def bind_tile_instances(program: int) -> None:
+    """Connect a tile array program to the instance buffer binding point and texture unit"""
+    block_index = GL.glGetUniformBlockIndex(program, "TileInstances")
+    GL.glUniformBlockBinding(program, block_index, TILE_INSTANCE_BINDING)
+    GL.glUseProgram(program)
+    GL.glUniform1i(GL.glGetUniformLocation(program, "tiles"), TILE_ARRAY_UNIT)
+
+
+__all__ = [
+    "bind_tile_instances",
+    "MAX_TILE_INSTANCES",
+    "plan_texture_arrays",
+    "TileInstanceBuffer",
+    "TileTextureArray",
+]
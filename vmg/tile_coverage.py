@@ -0,0 +1,297 @@
+"""
+Conservative screen-space coverage of spherical panorama tiles.
+
+sphere.vert used to draw every tile as a full-screen quad, leaving sphere.frag to
+discard everything outside that tile's uv_bounds. Here we project the boundary of
+each tile through the current display projection, so each tile can be drawn over
+just the screen rectangle it might cover.
+"""
+
+from math import pi
+from typing import Optional
+import weakref
+
+import numpy
+from numpy.typing import NDArray
+
+from vmg.display_projection import DisplayProjection
+from vmg.interfaces import InputFormat, RenderStateLike, TiledImageLike, TileLike
+
+NdcRect = tuple[float, float, float, float]  # (x_min, y_min, x_max, y_max)
+
+FULL_SCREEN_NDC: NdcRect = (-1.0, -1.0, 1.0, 1.0)
+
+# Boundary samples per tile edge
+EDGE_SAMPLE_COUNT = 16
+
+
+class SphereTileCoverage(object):
+    """
+    Computes, and caches, the normalized device coordinate rectangle covered by each tile.
+
+    Result entries are None for tiles that cannot appear on screen,
+    FULL_SCREEN_NDC where the projection cannot be bounded, and a tighter
+    rectangle otherwise.
+    """
+    def __init__(self):
+        self._key = [None, None, None]  # indexed by render pass
+        self._bounds: list[list[Optional[NdcRect]]] = [[], [], []]
+
+    def ndc_bounds(
+            self,
+            state: RenderStateLike,
+            image: TiledImageLike,
+            render_pass: int = 1,
+    ) -> list[Optional[NdcRect]]:
+        md = image.md
+        key = (
+            weakref.ref(image),  # unlike id(), never equal for a later image at the same address
+            tuple(tuple(tile.rtc_bounds) for tile in image.tiles),
+            state.display_projection,
+            tuple(state.window_size),
+            state.zoom,
+            state.geo_rot_usr.tobytes(),
+            md.pcm_R_geo.tobytes(),
+            md.input_format,
+            md.inscribed_fov_radians,
+            md.df_lens_rot_radians,
+        )
+        if key != self._key[render_pass]:
+            self._bounds[render_pass] = ndc_bounds_for_tiles(image.tiles, state, image, render_pass)
+            self._key[render_pass] = key
+        return self._bounds[render_pass]
+
+
+def ndc_bounds_for_tiles(
+        tiles: list[TileLike],
+        state: RenderStateLike,
+        image: TiledImageLike,
+        render_pass: int = 1,
+) -> list[Optional[NdcRect]]:
+    """Screen rectangle that conservatively contains each tile, in normalized device coordinates"""
+    md = image.md
+    if len(tiles) == 0:
+        return []
+    w_qwn, h_qwn = (float(x) for x in state.window_size)
+    if w_qwn <= 0 or h_qwn <= 0:
+        return [FULL_SCREEN_NDC for _ in tiles]
+    # Same scale as in sphere.vert
+    if w_qwn / h_qwn < 1.0:
+        scale = pi / 2.0 / w_qwn / state.zoom
+    else:
+        scale = pi / 2.0 / h_qwn / state.zoom
+    nic_per_ndc = numpy.array([scale * w_qwn, scale * h_qwn], dtype=numpy.float64)
+    # Tile rectangles in full image texture coordinates, restricted to one fisheye for dual fisheye
+    rects = numpy.array([t.rtc_bounds for t in tiles], dtype=numpy.float64)  # (u0, v0, u1, v1)
+    if md.input_format == InputFormat.DUAL_FISHEYE:
+        if render_pass == 1:  # front lens is on the right
+            rects[:, 0] = numpy.maximum(rects[:, 0], 0.5)
+        else:  # rear lens is on the left
+            rects[:, 2] = numpy.minimum(rects[:, 2], 0.5)
+    has_area = (rects[:, 0] < rects[:, 2]) & (rects[:, 1] < rects[:, 3])
+    # Walk around each tile boundary
+    rtc = _boundary_samples(rects)  # (T, S, 2)
+    pcm = _pcm_for_rtc(rtc, md, render_pass)
+    usr_R_pcm = (md.pcm_R_geo @ state.geo_rot_usr).astype(numpy.float64).T
+    usr = pcm @ usr_R_pcm.T  # (T, S, 3)
+    nic, valid = _nic_for_usr(usr, state.display_projection)
+    ndc = nic / nic_per_ndc
+    # Tiles surrounding a singularity of the display projection cover an unbounded region
+    surrounds_singularity = numpy.zeros(len(tiles), dtype=bool)
+    for p_usr in _singular_usr_directions(state.display_projection):
+        p_pcm = usr_R_pcm.T @ p_usr
+        p_rtc = _rtc_for_pcm(p_pcm.reshape(1, 3), md, render_pass)[0]
+        surrounds_singularity |= (
+            (rects[:, 0] <= p_rtc[0]) & (p_rtc[0] <= rects[:, 2])
+            & (rects[:, 1] <= p_rtc[1]) & (p_rtc[1] <= rects[:, 3]))
+    unbounded = surrounds_singularity | ~numpy.all(valid, axis=1) | ~numpy.all(numpy.isfinite(ndc), axis=(1, 2))
+    off_screen = numpy.zeros(len(tiles), dtype=bool)
+    if state.display_projection == DisplayProjection.GNOMONIC:
+        # Reaching behind the viewer leaves a tile unbounded, but it may still be wholly out of view
+        off_screen = _outside_view_frustum(usr, rects, usr_R_pcm, md, render_pass, nic_per_ndc)
+    if state.display_projection == DisplayProjection.EQUIRECTANGULAR:
+        # Boundary crossing the longitude seam wraps to the other side of the screen
+        d_lon = numpy.abs(nic[:, :, 0] - numpy.roll(nic[:, :, 0], 1, axis=1))
+        unbounded |= numpy.any(d_lon > pi / 2, axis=1)
+    with numpy.errstate(invalid="ignore"):
+        lo = numpy.nanmin(ndc, axis=1)  # (T, 2)
+        hi = numpy.nanmax(ndc, axis=1)
+        # Pad by half the largest gap between adjacent samples, plus a couple of pixels
+        gap = numpy.nanmax(numpy.linalg.norm(ndc - numpy.roll(ndc, 1, axis=1), axis=2), axis=1)
+    pad = 0.5 * gap[:, None] + 2.0 / numpy.array([w_qwn, h_qwn])
+    lo -= pad
+    hi += pad
+    if state.display_projection == DisplayProjection.EQUIRECTANGULAR and nic_per_ndc[0] > pi:
+        # Zoomed out far enough to see more than one copy of the longitude range
+        lo[:, 0] = -1.0
+        hi[:, 0] = 1.0
+    result: list[Optional[NdcRect]] = []
+    for ix in range(len(tiles)):
+        if not has_area[ix]:
+            result.append(None)  # e.g. this tile belongs to the other fisheye
+        elif off_screen[ix]:
+            result.append(None)
+        elif unbounded[ix]:
+            result.append(FULL_SCREEN_NDC)
+        elif hi[ix, 0] < -1 or hi[ix, 1] < -1 or lo[ix, 0] > 1 or lo[ix, 1] > 1:
+            result.append(None)  # tile is entirely off-screen
+        else:
+            result.append((
+                max(-1.0, float(lo[ix, 0])),
+                max(-1.0, float(lo[ix, 1])),
+                min(1.0, float(hi[ix, 0])),
+                min(1.0, float(hi[ix, 1])),
+            ))
+    return result
+
+
+def pcm_for_rtc(rtc: NDArray, md) -> NDArray:
+    """Camera direction for full image texture coordinates, shape (..., 2) -> (..., 3)"""
+    if md.input_format != InputFormat.DUAL_FISHEYE:
+        return _pcm_for_rtc(rtc, md, render_pass=1)
+    # Front lens on the right, rear lens on the left
+    front = _pcm_for_rtc(rtc, md, render_pass=1)
+    rear = _pcm_for_rtc(rtc, md, render_pass=2)
+    return numpy.where((rtc[..., 0] >= 0.5)[..., None], front, rear)
+
+
+def _boundary_samples(rects: NDArray) -> NDArray:
+    """Points clockwise around each rectangle (u0, v0, u1, v1), shape (T, 4 * EDGE_SAMPLE_COUNT, 2)"""
+    t = numpy.linspace(0.0, 1.0, EDGE_SAMPLE_COUNT, endpoint=False)[None, :]
+    u0, v0, u1, v1 = (rects[:, i:i+1] for i in range(4))
+    ones = numpy.ones_like(t)
+    top = numpy.stack([u0 + t * (u1 - u0), v0 * ones], axis=-1)
+    right = numpy.stack([u1 * ones, v0 + t * (v1 - v0)], axis=-1)
+    bottom = numpy.stack([u1 + t * (u0 - u1), v1 * ones], axis=-1)
+    left = numpy.stack([u0 * ones, v1 + t * (v0 - v1)], axis=-1)
+    return numpy.concatenate([top, right, bottom, left], axis=1)
+
+
+def _fisheye_center_and_rotation(md, render_pass: int) -> tuple[NDArray, NDArray]:
+    """Keep in sync with dual_fisheye_tex_coord() in shared.frag"""
+    if render_pass == 1:
+        center = numpy.array([0.75, 0.5])
+    else:
+        center = numpy.array([0.25, 0.5])
+    c = numpy.cos(md.df_lens_rot_radians / 2.0)
+    s = numpy.sin(md.df_lens_rot_radians / 2.0)
+    # GLSL "vec * mat2(c, s, -s, c)"
+    rot = numpy.array([[c, s], [-s, c]])
+    return center, rot
+
+
+def _pcm_for_rtc(rtc: NDArray, md, render_pass: int) -> NDArray:
+    """Camera direction for full image texture coordinates; inverse of rtc_for_pcm() in shared.frag"""
+    tx = rtc[..., 0]
+    ty = rtc[..., 1]
+    if md.input_format == InputFormat.DUAL_FISHEYE:
+        center, rot = _fisheye_center_and_rotation(md, render_pass)
+        p_nfish = (rtc - center) / numpy.array([0.5, -1.0])
+        u = p_nfish @ rot  # undo the lens rotation
+        radius = numpy.linalg.norm(u, axis=-1)
+        theta = numpy.minimum(radius * md.inscribed_fov_radians, pi)  # clamp to the fisheye rim
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            direction = numpy.where(radius[..., None] > 0, u / radius[..., None], 0.0)
+        sin_theta = numpy.sin(theta)[..., None]
+        p_sph = numpy.concatenate([sin_theta * direction, -numpy.cos(theta)[..., None]], axis=-1)
+        if render_pass != 1:
+            p_sph = p_sph * numpy.array([-1.0, 1.0, -1.0])  # rotate rear lens 180 about Y/up
+        return p_sph
+    lat = (ty - 0.5) * pi
+    if md.input_format == InputFormat.SINUSOIDAL:
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            lon = (tx - 0.5) * 2.0 * pi / numpy.cos(lat)
+        lon = numpy.clip(numpy.nan_to_num(lon, nan=0.0), -pi, pi)  # clamp to the sinusoid edge
+    else:  # equirectangular
+        lon = (tx - 0.5) * 2.0 * pi
+    clat = numpy.cos(lat)
+    return numpy.stack([clat * numpy.sin(lon), -numpy.sin(lat), -clat * numpy.cos(lon)], axis=-1)
+
+
+def _rtc_for_pcm(pcm: NDArray, md, render_pass: int) -> NDArray:
+    """Full image texture coordinates for camera direction; keep in sync with rtc_for_pcm() in shared.frag"""
+    x, y, z = pcm[..., 0], pcm[..., 1], pcm[..., 2]
+    if md.input_format == InputFormat.DUAL_FISHEYE:
+        center, rot = _fisheye_center_and_rotation(md, render_pass)
+        if render_pass != 1:
+            x, z = -x, -z
+        theta = numpy.arccos(numpy.clip(-z, -1.0, 1.0))
+        r_xy = numpy.hypot(x, y)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            direction = numpy.where(
+                r_xy[..., None] > 0, numpy.stack([x, y], axis=-1) / r_xy[..., None], numpy.array([1.0, 0.0]))
+        u = direction * (theta / md.inscribed_fov_radians)[..., None]
+        p_nfish = u @ rot.T
+        return center + p_nfish * numpy.array([0.5, -1.0])
+    r = numpy.hypot(x, z)
+    lat = -numpy.arctan2(y, r)
+    lon = numpy.arctan2(x, -z)
+    tx = 0.5 * lon / pi + 0.5
+    if md.input_format == InputFormat.SINUSOIDAL:
+        tx = numpy.cos(lat) * 0.5 * lon / pi + 0.5
+    ty = lat / pi + 0.5
+    return numpy.stack([tx, ty], axis=-1)
+
+
+def _nic_for_usr(usr: NDArray, projection: DisplayProjection) -> tuple[NDArray, NDArray]:
+    """Screen coordinates for view directions; inverse of usr_for_nic() in shared.frag"""
+    ux, uy, uz = usr[..., 0], usr[..., 1], usr[..., 2]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        if projection == DisplayProjection.GNOMONIC:
+            valid = uz < -1e-3  # front hemisphere only
+            nic = numpy.stack([ux, uy], axis=-1) / -uz[..., None]
+        elif projection == DisplayProjection.EQUIDISTANT:
+            d = numpy.arccos(numpy.clip(-uz, -1.0, 1.0))
+            valid = d < pi - 1e-3
+            sin_d = numpy.sin(d)
+            factor = numpy.where(sin_d > 1e-6, d / sin_d, 1.0)
+            nic = numpy.stack([ux, uy], axis=-1) * factor[..., None]
+        elif projection == DisplayProjection.EQUIRECTANGULAR:
+            valid = numpy.ones(ux.shape, dtype=bool)
+            nic = numpy.stack([numpy.arctan2(ux, -uz), numpy.arcsin(numpy.clip(uy, -1.0, 1.0))], axis=-1)
+        else:  # stereographic
+            valid = (1.0 - uz) > 1e-6
+            nic = 2.0 * numpy.stack([ux, uy], axis=-1) / (1.0 - uz)[..., None]
+    return nic, valid
+
+
+def _outside_view_frustum(
+        usr: NDArray,
+        rects: NDArray,
+        usr_R_pcm: NDArray,
+        md,
+        render_pass: int,
+        nic_per_ndc: NDArray,
+) -> NDArray:
+    """
+    Tiles wholly beyond one side of the gnomonic view, which shows directions with -z > 0
+    and |x|, |y| within nic_per_ndc * -z. A tile is beyond a side when its boundary is, by
+    more than the gap between boundary samples, unless it surrounds that side's normal.
+    """
+    a, b = nic_per_ndc
+    normals = numpy.array([[1.0, 0.0, -a], [-1.0, 0.0, -a], [0.0, 1.0, -b], [0.0, -1.0, -b]])  # pointing inward
+    normals /= numpy.linalg.norm(normals, axis=1, keepdims=True)
+    gap = numpy.max(numpy.linalg.norm(usr - numpy.roll(usr, 1, axis=1), axis=2), axis=1)  # (T,)
+    beyond = numpy.max(usr @ normals.T, axis=1) < -gap[:, None]  # (T, 4)
+    for side, n_usr in enumerate(normals):
+        n_rtc = _rtc_for_pcm((usr_R_pcm.T @ n_usr).reshape(1, 3), md, render_pass)[0]
+        beyond[:, side] &= ~(
+            (rects[:, 0] <= n_rtc[0]) & (n_rtc[0] <= rects[:, 2])
+            & (rects[:, 1] <= n_rtc[1]) & (n_rtc[1] <= rects[:, 3]))
+    return numpy.any(beyond, axis=1)
+
+
+def _singular_usr_directions(projection: DisplayProjection) -> list[NDArray]:
+    """View directions that the display projection sends to infinity, or tears apart"""
+    if projection == DisplayProjection.EQUIRECTANGULAR:
+        return [numpy.array([0.0, 1.0, 0.0]), numpy.array([0.0, -1.0, 0.0])]  # poles
+    return [numpy.array([0.0, 0.0, 1.0])]  # directly behind the viewer
+
+
+__all__ = [
+    "FULL_SCREEN_NDC",
+    "NdcRect",
+    "SphereTileCoverage",
+    "ndc_bounds_for_tiles",
+    "pcm_for_rtc",
+]
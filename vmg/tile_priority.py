@@ -0,0 +1,168 @@
+"""
+Upload order for image tiles, so the part of the image on screen arrives first.
+
+The UI thread publishes where the user is looking into a ViewHint; the loader
+thread consults that hint between tiles, so panning or zooming mid-load
+re-prioritizes the tiles that have not been uploaded yet.
+"""
+
+from math import pi
+import threading
+from typing import Optional, Protocol, Union
+
+import numpy
+
+from vmg.frame import LocationQwn
+from vmg.interfaces import InputFormat, RenderStateLike, TiledImageLike
+from vmg.tile_coverage import pcm_for_rtc
+from vmg.tiled_image import opx_for_rmp
+
+# Tiles on screen sort before every tile off screen
+TileKey = tuple[int, float]
+
+
+class TileRegion(Protocol):
+    """The parts of TileCreateInfo that determine priority"""
+    left: int
+    top: int
+    width: int
+    height: int
+
+
+class FlatView(object):
+    """Visible rectangle of a standard photo, in oriented image pixels"""
+    def __init__(self, center_opx: tuple[float, float], half_size_opx: tuple[float, float]):
+        self.center_opx = center_opx
+        self.half_size_opx = half_size_opx
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FlatView)
+            and self.center_opx == other.center_opx
+            and self.half_size_opx == other.half_size_opx
+        )
+
+    def key(self, tci: TileRegion, image: TiledImageLike) -> TileKey:
+        """Smaller keys upload sooner"""
+        md = image.md
+        corners = [
+            opx_for_rmp((tci.left, tci.top), md.size_rpx, md.orientation),
+            opx_for_rmp((tci.left + tci.width, tci.top + tci.height), md.size_rpx, md.orientation),
+        ]
+        # Distance from view center to nearest point of the tile, in units of the view half size
+        distance = []
+        for axis in range(2):
+            lo = min(c[axis] for c in corners)
+            hi = max(c[axis] for c in corners)
+            center = self.center_opx[axis]
+            gap = max(lo - center, 0.0, center - hi)
+            distance.append(gap / max(self.half_size_opx[axis], 1.0))
+        is_visible = max(distance) <= 1.0
+        return 0 if is_visible else 1, float(numpy.hypot(*distance))
+
+
+class SphereView(object):
+    """Visible cone of a spherical panorama, in camera directions"""
+    def __init__(self, direction_pcm: tuple[float, float, float], radius: float):
+        self.direction_pcm = direction_pcm
+        self.radius = radius  # radians from view center to the corner of the screen
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, SphereView)
+            and self.direction_pcm == other.direction_pcm
+            and self.radius == other.radius
+        )
+
+    def key(self, tci: TileRegion, image: TiledImageLike) -> TileKey:
+        """Smaller keys upload sooner"""
+        iw, ih = image.md.size_rpx
+        u0, v0 = tci.left / iw, tci.top / ih
+        u1, v1 = (tci.left + tci.width) / iw, (tci.top + tci.height) / ih
+        # Tile center, corners and edge midpoints
+        us = numpy.array([u0, 0.5 * (u0 + u1), u1])
+        vs = numpy.array([v0, 0.5 * (v0 + v1), v1])
+        rtc = numpy.stack(numpy.meshgrid(us, vs), axis=-1).reshape(-1, 2)
+        pcm = pcm_for_rtc(rtc, image.md)
+        view = numpy.array(self.direction_pcm)
+        # Angle from the view center to the nearest sample, less a margin for the space between samples
+        angles = numpy.arccos(numpy.clip(pcm @ view, -1.0, 1.0))
+        center = pcm[4]
+        tile_radius = numpy.max(numpy.arccos(numpy.clip(pcm @ center, -1.0, 1.0)))
+        distance = max(0.0, float(numpy.min(angles)) - 0.5 * float(tile_radius))
+        is_visible = distance <= self.radius
+        return 0 if is_visible else 1, distance
+
+
+View = Union[FlatView, SphereView]
+
+
+def view_for_state(state: RenderStateLike, image: TiledImageLike) -> Optional[View]:
+    """Summarize what part of the image is on screen; run in the UI thread"""
+    md = image.md
+    w_qwn, h_qwn = state.window_size
+    if w_qwn <= 0 or h_qwn <= 0:
+        return None
+    if md.input_format == InputFormat.STANDARD_PHOTO:
+        opx_xform_ndc = state.opx_xform_ndc()
+        center = opx_xform_ndc @ [0, 0, 1]
+        corner = opx_xform_ndc @ [1, 1, 1]
+        return FlatView(
+            center_opx=(float(center[0]), float(center[1])),
+            half_size_opx=(abs(float(corner[0] - center[0])), abs(float(corner[1] - center[1]))),
+        )
+    pcm_R_usr = md.pcm_R_geo @ state.geo_rot_usr
+    direction = pcm_R_usr @ [0.0, 0.0, -1.0]
+    corner_usr = numpy.array(state.usr_for_prj(state.prj_for_qwn(LocationQwn(0, 0, 1))), dtype=numpy.float64)
+    corner_usr /= max(numpy.linalg.norm(corner_usr), 1e-12)
+    radius = float(numpy.arccos(numpy.clip(-corner_usr[2], -1.0, 1.0)))
+    return SphereView(
+        direction_pcm=tuple(float(x) for x in direction),
+        radius=min(pi, radius),
+    )
+
+
+class ViewHint(object):
+    """
+    Where the user is looking in the image being loaded.
+    Written by the UI thread, read by the loader thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._image = None
+        self._view: Optional[View] = None
+        self._revision = 0
+        self._window_size = (0, 0)  # device pixels
+
+    @property
+    def window_size(self) -> tuple[int, int]:
+        """Size of the image widget in device pixels, or zeros before it is shown"""
+        with self._lock:
+            return self._window_size
+
+    def set_window_size(self, width: int, height: int) -> None:
+        with self._lock:
+            self._window_size = int(width), int(height)
+
+    def publish(self, image: TiledImageLike, view: Optional[View]) -> None:
+        with self._lock:
+            if image is self._image and view == self._view:
+                return
+            self._image = image
+            self._view = view
+            self._revision += 1
+
+    def view_for(self, image: TiledImageLike) -> tuple[int, Optional[View]]:
+        """Revision number, which changes whenever the view does, and the view if it is of this image"""
+        with self._lock:
+            if image is not self._image:
+                return self._revision, None
+            return self._revision, self._view
+
+
+__all__ = [
+    "FlatView",
+    "SphereView",
+    "view_for_state",
+    "ViewHint",
+]
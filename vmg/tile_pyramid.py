@@ -0,0 +1,468 @@
+"""
+Multi-resolution tile pyramid, for images too large to keep on the GPU at full resolution.
+
+Level 0 is the full resolution image, and each level above it is half the size
+of the one below. The coarse levels, of just a few tiles each, are uploaded with
+the image and stay resident. Tiles of the finer levels are uploaded only when the
+current view needs them, and evicted, least recently used first, when they
+exceed their share of the video memory budget.
+
+Only the resident levels stay in client memory. Once the levels are built, the
+pixels of the fine tiles move to a TilePixelStore, a temporary file mapped into
+memory, and the full resolution array is dropped. The OS pages the store in
+and out, and tiles evicted from video memory have their pages dropped at once.
+
+Tile seams are handled across levels, rather than by generating mipmaps within
+each tile. A fine level is only displayed between its own resolution and half
+of it, so its tiles need FINE_MIP_LEVEL_COUNT mipmap levels, and those are cut
+from the coarser pyramid levels, each with its own pad of neighboring pixels.
+The pad of each level is sized so that even its last mipmap level keeps one.
+
+Threads:
+  * The UI thread decides which tiles are wanted, owns the resident tiles, and
+    decides evictions, so a tile is never released while it might be drawn.
+  * The loader thread uploads wanted tiles, and releases evicted ones.
+"""
+
+import logging
+from math import floor, log2
+import mmap
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import numpy
+from numpy.typing import NDArray
+
+from vmg.cancellation import CancellationToken
+from vmg.exif_orientation import ExifOrientation
+from vmg.gl_resources import MEBIBYTE, texture_byte_count, vram_budget
+from vmg.interfaces import InputFormat, ImageMetadataLike
+
+logger = logging.getLogger(__name__)
+
+# Levels of at most this many tiles are uploaded with the image, and never evicted
+RESIDENT_LEVEL_MAX_TILES = 4
+# Use a pyramid when full resolution textures would take more than this share of the video memory budget
+PYRAMID_THRESHOLD_FRACTION = 0.5
+# Share of the video memory budget for resident tiles of the finer levels
+FINE_TILE_BUDGET_FRACTION = 0.5
+# Mipmap levels of each fine tile, below its own, cut from the coarser pyramid levels
+FINE_MIP_LEVEL_COUNT = 1
+# Also upload tiles this far beyond the edge of the view, in units of the view size
+VIEW_MARGIN = 0.25
+# Rows per band when downsampling, to bound temporary memory
+_DOWNSAMPLE_BAND_ROWS = 1024
+
+_SWAPS_AXES = (
+    ExifOrientation.FLIP_HORIZONTAL_ROTATE_90_CCW,
+    ExifOrientation.ROTATE_90_CW,
+    ExifOrientation.FLIP_HORIZONTAL_ROTATE_90_CW,
+    ExifOrientation.ROTATE_90_CCW,
+)
+
+TileKey = tuple[int, int]  # (level, index into the level layout)
+
+
+def downsample_2x(array: NDArray, cancel_token: Optional[CancellationToken] = None) -> NDArray:
+    """Half size image, by averaging each 2x2 block of pixels"""
+    # Keep a single row or column, as level_sizes() does, by averaging it with itself
+    if array.shape[0] == 1:
+        array = numpy.repeat(array, 2, axis=0)
+    if array.shape[1] == 1:
+        array = numpy.repeat(array, 2, axis=1)
+    h, w = array.shape[0] // 2, array.shape[1] // 2
+    result = numpy.empty((h, w) + array.shape[2:], dtype=array.dtype)
+    is_float = numpy.issubdtype(array.dtype, numpy.floating)
+    if is_float:
+        accumulator = numpy.float32
+    else:
+        accumulator = numpy.uint32 if array.dtype.itemsize > 1 else numpy.uint16
+    for top in range(0, h, _DOWNSAMPLE_BAND_ROWS):
+        if cancel_token is not None:
+            cancel_token.raise_if_canceled()
+        bottom = min(h, top + _DOWNSAMPLE_BAND_ROWS)
+        band = array[2 * top:2 * bottom, :2 * w]
+        total = band[0::2, 0::2].astype(accumulator)
+        total += band[1::2, 0::2]
+        total += band[0::2, 1::2]
+        total += band[1::2, 1::2]
+        if is_float:
+            result[top:bottom] = total * 0.25
+        else:
+            total += 2  # round to nearest
+            total //= 4
+            result[top:bottom] = total
+    return result
+
+
+def level_sizes(size_rpx: tuple[int, int], tile_size: int) -> list[tuple[int, int]]:
+    """Raw pixel size of each pyramid level, down to the first that fits in one tile"""
+    w, h = (int(x) for x in size_rpx)
+    result = [(w, h)]
+    while w > tile_size or h > tile_size:
+        w, h = max(1, w // 2), max(1, h // 2)
+        result.append((w, h))
+    return result
+
+
+def is_pyramid_suitable(md: ImageMetadataLike, tile_size: int) -> bool:
+    """Whether an image is big enough to need a pyramid, and simple enough to use one"""
+    if md.is_cfa:
+        return False  # raw images are demosaiced per tile, at full resolution
+    if md.input_format != InputFormat.STANDARD_PHOTO:
+        return False  # residency follows a flat view
+    if md.channel_count not in (1, 3):
+        return False  # fine tiles are drawn over coarse ones, which would show through transparency
+    w, h = (int(x) for x in md.size_rpx)
+    if w <= tile_size and h <= tile_size:
+        return False
+    full_resolution_bytes = texture_byte_count(w, h, 0)  # assume 4 bytes per texel
+    return full_resolution_bytes > PYRAMID_THRESHOLD_FRACTION * vram_budget.budget_bytes
+
+
+class _LevelMetadata(object):
+    """The parts of ImageMetadata that tile layout and tile geometry use"""
+    def __init__(self, size_rpx: tuple[int, int], md: ImageMetadataLike):
+        self.size_rpx = size_rpx
+        self.orientation = md.orientation
+        self.channel_count = md.channel_count
+        self.file_name = md.file_name
+
+
+class PyramidLevel(object):
+    """One resolution of the image, standing in for the image when laying out and creating its tiles"""
+    def __init__(self, level: int, size_rpx: tuple[int, int], image):
+        self.level = level
+        self.md = _LevelMetadata(size_rpx, image.md)
+        self.array: Optional[NDArray] = None  # filled in by TilePyramid.build_levels()
+        self.array_top = 0  # image row of the first array row
+        self.tex_format = image.tex_format  # channel order of the array, if not the usual one
+        self.is_coarsest = False
+        self.pyramid: Optional[TilePyramid] = None  # None for a preview, which stands alone
+        self.pad = 2  # pixels of the neighboring tiles around each tile
+        self.mip_level_count: Optional[int] = None  # cut from coarser levels; None means generate a full chain
+        # Multiply level opx by this to get full resolution opx
+        full_w, full_h = image.md.size_rpx
+        scale_rpx = (full_w / size_rpx[0], full_h / size_rpx[1])
+        if image.md.orientation in _SWAPS_AXES:
+            scale_rpx = scale_rpx[::-1]
+        self.opx_scale = numpy.array(scale_rpx, dtype=numpy.float32)
+        self.layout = []  # TileCreateInfo for each tile of this level
+        self.opx_rects = numpy.zeros((0, 4))  # (x_min, y_min, x_max, y_max) of each tile, full resolution opx
+
+
+class TilePixelStore(object):
+    """
+    Padded pixels of tiles, one block per tile and mipmap level, in a temporary file mapped into memory,
+    so the OS can page them out. Each block starts on a page boundary, so a tile can be paged out alone.
+    Reserve every block, then allocate, then fill and read them; loader thread.
+    """
+    def __init__(self):
+        self.byte_count = 0
+        self._blocks: dict[TileKey, list[tuple[int, tuple[int, ...], numpy.dtype]]] = {}  # offset, shape, dtype
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+
+    def __contains__(self, key: TileKey) -> bool:
+        return key in self._blocks
+
+    def reserve(self, key: TileKey, shape: tuple[int, ...], dtype: numpy.dtype) -> None:
+        """Make room for the next mipmap level of a tile, starting with level 0"""
+        self._blocks.setdefault(key, []).append((self.byte_count, shape, dtype))
+        block_bytes = int(numpy.prod(shape)) * dtype.itemsize
+        self.byte_count += -(-block_bytes // mmap.PAGESIZE) * mmap.PAGESIZE
+
+    def allocate(self) -> None:
+        if self.byte_count == 0:
+            return
+        self._file = tempfile.TemporaryFile(prefix="vmg-pyramid-")  # deleted once closed
+        self._file.truncate(self.byte_count)
+        self._map = mmap.mmap(self._file.fileno(), self.byte_count)
+
+    def pixels(self, key: TileKey, mip_level: int) -> NDArray:
+        """Writable view of one block"""
+        offset, shape, dtype = self._blocks[key][mip_level]
+        return numpy.ndarray(shape, dtype=dtype, buffer=self._map, offset=offset)
+
+    def page_out(self, key: TileKey) -> None:
+        """Drop the pages of a tile from client memory, to be read back from the file if it is wanted again"""
+        # Where the OS offers no such advice, as on Windows, it still pages out under memory pressure
+        advice = getattr(mmap, "MADV_PAGEOUT", getattr(mmap, "MADV_DONTNEED", None))
+        if advice is None or self._map is None or key not in self._blocks:
+            return
+        for offset, shape, dtype in self._blocks[key]:
+            block_bytes = int(numpy.prod(shape)) * dtype.itemsize
+            self._map.madvise(advice, offset, -(-block_bytes // mmap.PAGESIZE) * mmap.PAGESIZE)
+
+
+class TilePyramid(object):
+    def __init__(self, image, tile_size: int):
+        self.image = image
+        self.tile_size = tile_size
+        self.levels = [
+            PyramidLevel(level, size, image)
+            for level, size in enumerate(level_sizes(image.md.size_rpx, tile_size))
+        ]
+        self.levels[-1].is_coarsest = True
+        for level in self.levels:
+            level.pyramid = self
+            if not level.is_coarsest:
+                # Each mipmap level keeps at least one pixel of pad, for linear filtering
+                level.mip_level_count = min(FINE_MIP_LEVEL_COUNT, len(self.levels) - 1 - level.level)
+                level.pad = 2 ** level.mip_level_count
+        # Coarse levels are uploaded with the image; finer levels on demand
+        self.first_resident_level = len(self.levels) - 1
+        while self.first_resident_level > 0:
+            w, h = self.levels[self.first_resident_level - 1].md.size_rpx
+            if -(-w // tile_size) * -(-h // tile_size) > RESIDENT_LEVEL_MAX_TILES:
+                break
+            self.first_resident_level -= 1
+        self._lock = threading.Lock()
+        # Shared between threads, under the lock
+        self._wanted: list[TileKey] = []  # in upload priority order
+        self._in_flight: set[TileKey] = set()  # requested or uploaded, but not yet collected by the UI
+        self._delivered: list = []  # uploaded tiles, for the UI to collect
+        self._evicted: list = []  # tiles dropped by the UI, for the loader to release
+        self._resident_keys: set[TileKey] = set()
+        self.store = TilePixelStore()  # pixels of the fine tiles; loader thread
+        # UI thread only
+        self.resident: dict[TileKey, object] = {}
+        self._last_used: dict[TileKey, int] = {}
+        self._frame = 0
+        self.display_level = len(self.levels) - 1  # finest level drawn in the current view
+
+    @property
+    def resident_levels(self) -> list[PyramidLevel]:
+        """The levels uploaded with the image, coarsest first"""
+        return self.levels[self.first_resident_level:][::-1]
+
+    def resident_tile_count(self) -> int:
+        return sum(
+            -(-level.md.size_rpx[0] // self.tile_size) * -(-level.md.size_rpx[1] // self.tile_size)
+            for level in self.resident_levels
+        )
+
+    def build_levels(self, layout_fn, cancel_token: Optional[CancellationToken] = None) -> None:
+        """
+        Downsample the full resolution array into every level, and move the pixels of the fine tiles
+        into the store, keeping only the resident levels in client memory; run in the loader thread.
+        Afterward the pyramid holds no reference to the full resolution array.
+        """
+        t0 = time.perf_counter()
+        self.levels[0].array = self.image.array
+        for below, level in zip(self.levels, self.levels[1:]):
+            level.array = downsample_2x(below.array, cancel_token)
+            h, w = level.array.shape[:2]
+            level.md.size_rpx = (w, h)
+        for level in self.levels:
+            level.layout = layout_fn(level, self.tile_size, level.pad)
+            rects = []
+            for tci in level.layout:
+                corners = numpy.array([
+                    [tci.left, tci.top],
+                    [tci.left + tci.width, tci.top + tci.height],
+                ], dtype=numpy.float64)
+                rects.append(corners)
+            level.opx_rects = self._opx_rects(level, rects)
+        self._store_fine_tiles(cancel_token)
+        resident_bytes = sum(level.array.nbytes for level in self.resident_levels)
+        logger.info(
+            f"Built {len(self.levels)} level pyramid for {self.image.md.file_name}"
+            f" in {time.perf_counter() - t0:.2f} s, keeping {resident_bytes / MEBIBYTE:.0f} MB in memory"
+            f" and paging {self.store.byte_count / MEBIBYTE:.0f} MB of finer tiles")
+
+    def _store_fine_tiles(self, cancel_token: Optional[CancellationToken]) -> None:
+        fine_levels = self.levels[:self.first_resident_level]
+        for level in fine_levels:
+            for index, tci in enumerate(level.layout):
+                for mip_level in range(level.mip_level_count + 1):
+                    region = self._level_region(level, tci, mip_level)
+                    self.store.reserve((level.level, index), region.shape, region.dtype)
+        self.store.allocate()
+        for level in fine_levels:
+            for index, tci in enumerate(level.layout):
+                if cancel_token is not None:
+                    cancel_token.raise_if_canceled()
+                for mip_level in range(level.mip_level_count + 1):
+                    self.store.pixels((level.level, index), mip_level)[...] = (
+                        self._level_region(level, tci, mip_level))
+        for level in fine_levels:
+            level.array = None
+
+    def _level_region(self, level: PyramidLevel, tci, mip_level: int) -> NDArray:
+        """
+        The padded pixels of a tile at one of its mipmap levels, from the pyramid level that many above,
+        sized as OpenGL sizes mipmap levels. Pads are multiples of 2 ** mip_level, so the region is aligned.
+        """
+        source = self.levels[level.level + mip_level].array
+        left = (tci.left - tci.left_pad) >> mip_level
+        top = (tci.top - tci.top_pad) >> mip_level
+        width = max(1, (tci.width + tci.left_pad + tci.right_pad) >> mip_level)
+        height = max(1, (tci.height + tci.top_pad + tci.bottom_pad) >> mip_level)
+        return source[top:top + height, left:left + width, ...]
+
+    def tile_pixels(self, key: TileKey, mip_level: int) -> NDArray:
+        """Padded pixels of a tile at one of its mipmap levels, to upload; loader thread"""
+        if key in self.store:
+            return self.store.pixels(key, mip_level)
+        level = self.levels[key[0]]
+        return self._level_region(level, level.layout[key[1]], mip_level)
+
+    def _opx_rects(self, level: PyramidLevel, rects: list) -> NDArray:
+        """Tile rectangles in full resolution oriented pixels"""
+        from vmg.tiled_image import opx_for_rmp  # tiled_image imports this module
+        result = numpy.zeros((len(rects), 4), dtype=numpy.float64)
+        for index, (p0, p1) in enumerate(rects):
+            c0 = numpy.array(opx_for_rmp(tuple(int(x) for x in p0), level.md.size_rpx, level.md.orientation))
+            c1 = numpy.array(opx_for_rmp(tuple(int(x) for x in p1), level.md.size_rpx, level.md.orientation))
+            c0 = c0 * level.opx_scale
+            c1 = c1 * level.opx_scale
+            result[index] = (*numpy.minimum(c0, c1), *numpy.maximum(c0, c1))
+        return result
+
+    def level_for_scale(self, opx_per_qwn: float) -> int:
+        """Finest level needed when one window pixel spans this many full resolution pixels"""
+        if opx_per_qwn <= 1.0:
+            return 0
+        return min(int(floor(log2(opx_per_qwn))), len(self.levels) - 1)
+
+    # UI thread
+
+    def update_view(self, view, opx_per_qwn: float) -> bool:
+        """
+        Decide which fine tiles a FlatView needs, and evict tiles beyond the budget.
+        Returns True when the loader thread has work to do.
+        Run in the UI thread, with the widget context current.
+        """
+        self._frame += 1
+        level_index = self.level_for_scale(opx_per_qwn)
+        self.display_level = level_index
+        wanted = []
+        if level_index < self.first_resident_level:
+            level = self.levels[level_index]
+            if len(level.opx_rects) > 0:
+                cx, cy = view.center_opx
+                hx = view.half_size_opx[0] * (1.0 + VIEW_MARGIN)
+                hy = view.half_size_opx[1] * (1.0 + VIEW_MARGIN)
+                rects = level.opx_rects
+                is_visible = (
+                    (rects[:, 0] < cx + hx) & (rects[:, 2] > cx - hx)
+                    & (rects[:, 1] < cy + hy) & (rects[:, 3] > cy - hy)
+                )
+                # Nearest tiles to the view center first
+                tile_cx = 0.5 * (rects[:, 0] + rects[:, 2])
+                tile_cy = 0.5 * (rects[:, 1] + rects[:, 3])
+                distance = numpy.hypot(tile_cx - cx, tile_cy - cy)
+                indices = numpy.flatnonzero(is_visible)
+                indices = indices[numpy.argsort(distance[indices], kind="stable")]
+                wanted = [(level_index, int(i)) for i in indices]
+        for key in wanted:
+            self._last_used[key] = self._frame
+        has_work = self._evict(set(wanted))
+        with self._lock:
+            self._wanted = wanted
+            if any(key not in self._resident_keys and key not in self._in_flight for key in wanted):
+                has_work = True
+        return has_work
+
+    def _evict(self, wanted: set[TileKey]) -> bool:
+        """Drop least recently used tiles, beyond the fine tile budget; True if any were dropped"""
+        budget = FINE_TILE_BUDGET_FRACTION * vram_budget.budget_bytes
+        used = sum(tile.gpu_byte_count for tile in self.resident.values())
+        if used <= budget:
+            return False
+        candidates = sorted(
+            (key for key in self.resident if key not in wanted),
+            key=lambda k: self._last_used.get(k, 0),
+        )
+        evicted = []
+        for key in candidates:
+            if used <= budget:
+                break
+            tile = self.resident.pop(key)
+            tile.release_render_gl()
+            used -= tile.gpu_byte_count
+            evicted.append(tile)
+        if len(evicted) == 0:
+            return False
+        logger.debug(f"Evicting {len(evicted)} pyramid tiles")
+        with self._lock:
+            self._evicted.extend(evicted)
+            for tile in evicted:
+                self._resident_keys.discard(tile.pyramid_key)
+        return True
+
+    def collect_delivered(self) -> None:
+        """Take ownership of tiles the loader has uploaded; run in the UI thread"""
+        with self._lock:
+            delivered = self._delivered
+            self._delivered = []
+            for tile in delivered:
+                self._in_flight.discard(tile.pyramid_key)
+                self._resident_keys.add(tile.pyramid_key)
+        for tile in delivered:
+            self.resident[tile.pyramid_key] = tile
+
+    def display_tiles(self) -> list:
+        """Resident fine tiles, coarsest level first, so finer tiles draw on top"""
+        return sorted(self.resident.values(), key=lambda t: -t.pyramid_key[0])
+
+    def release_render_gl(self) -> None:
+        """Delete vertex arrays of resident tiles; run in the UI thread"""
+        for tile in self.resident.values():
+            tile.release_render_gl()
+
+    # Loader thread
+
+    def next_request(self):
+        """The most urgent wanted tile that is not yet uploaded, as a TileCreateInfo, or None"""
+        with self._lock:
+            for key in self._wanted:
+                if key in self._resident_keys or key in self._in_flight:
+                    continue
+                self._in_flight.add(key)
+                level, index = key
+                return key, self.levels[level].layout[index]
+        return None
+
+    def deliver(self, tile) -> None:
+        with self._lock:
+            self._delivered.append(tile)
+
+    def abandon(self, keys) -> None:
+        """Forget requests that will not be delivered, so the view can request them again"""
+        with self._lock:
+            for key in keys:
+                self._in_flight.discard(key)
+
+    def take_evicted(self) -> list:
+        """Tiles the UI dropped, for the loader to release; their pixels are paged out of client memory, too"""
+        with self._lock:
+            evicted = self._evicted
+            self._evicted = []
+        for tile in evicted:
+            self.store.page_out(tile.pyramid_key)
+        return evicted
+
+    def release_gl(self) -> None:
+        """Delete textures of every fine tile; run in the loader thread, after the UI is done with the image"""
+        with self._lock:
+            tiles = self._evicted + self._delivered + list(self.resident.values())
+            self._evicted = []
+            self._delivered = []
+            self._in_flight.clear()
+            self._resident_keys.clear()
+        self.resident = {}
+        for tile in tiles:
+            tile.release_gl()
+
+
+__all__ = [
+    "downsample_2x",
+    "is_pyramid_suitable",
+    "PyramidLevel",
+    "TilePixelStore",
+    "TilePyramid",
+]
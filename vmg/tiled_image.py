@@ -5,9 +5,10 @@ Intended as partial Replacement for ImageData, Texture
 from ctypes import c_float, c_void_p, cast, sizeof
 
 import imagecodecs
+import io
 import logging
 from tifffile import TiffFileError
-from typing import Iterator
+from typing import BinaryIO, Callable, Iterator, Optional
 
 import numpy
 from numpy.typing import NDArray
@@ -22,12 +23,34 @@ from PIL import Image
 from PySide6 import QtCore
 import tifffile
 
+from vmg.cancellation import CancellationToken
+from vmg.gl_resources import texture_byte_count, vram_budget
+from vmg.image_formats import (
+    can_decode_jpeg,
+    decode_jpeg,
+    exif_thumbnail,
+    ImageFileFormat,
+    map_pil_pixels,
+    map_tiff_page,
+    open_image_file,
+    pil_formats,
+    preview_scaling_factor,
+    pyjpeg_module,
+    read_header,
+    sniff_format,
+)
 from vmg.load_progress import LoadProgress
 from vmg.metadata import ImageMetadata
 from vmg.exif_orientation import ExifOrientation
-from vmg.interfaces import TiledImageLike, TileLike, PhotometricScale
+from vmg.interfaces import InputFormat, TiledImageLike, TileLike, PhotometricScale
+from vmg.pixel_buffers import padded_region, PixelBufferRing
 from vmg.resources import resource_string
 from vmg.shader_exception import compile_shader
+from vmg.tile_array import plan_texture_arrays, TileInstanceBuffer, TileTextureArray
+from vmg.texture_residency import texture_pool
+from vmg.tiff_segments import iter_decode_segments
+from vmg.tile_pyramid import is_pyramid_suitable, PyramidLevel, TilePyramid
+from vmg.upload_contexts import UploadContextPool
 
 logger = logging.getLogger(__name__)
 GLenum = int
@@ -89,97 +112,504 @@ class TiledImage(TiledImageLike):
         self.tiles: list[TileLike] = []
         self.load_progress = LoadProgress.NONE
         self.array = None
+        self.array_top = 0  # image row of the first array row; nonzero while streaming bands of a JPEG
+        self.tex_format: Optional[GLenum] = None  # GL channel order of the array, when not the usual one
         self.pil_image = None
+        self.expected_tile_count = 0  # known once metadata is loaded, before any tiles exist
+        self.texture_arrays: list[TileTextureArray] = []  # loader thread; empty when each tile has its own texture
+        self.tile_instances: Optional[TileInstanceBuffer] = None  # UI thread
+        self.pyramid: Optional[TilePyramid] = None  # for images too large to upload at full resolution
+        self.cancel_token = CancellationToken()  # checked between chunks of decoding and uploading
+        self.is_preview = False  # a reduced size decode, shown until the full image is uploaded
+        self.preview_level: Optional[PyramidLevel] = None  # reduced size pixels of a preview
+        # Whether to decode large JPEGs band by band, and TIFF pages segment by segment, during upload
+        self.decode_during_upload = False
+        self._jpeg_data: Optional[bytes] = None  # compressed pixels of a streamed JPEG
+        # Fills self.array during upload, yielding the number of complete rows at the top
+        self._decoding_rows: Optional[Iterator[int]] = None
+        self._decoded_row_count = 0
 
     def initialize_gl(self):
-        if self.md.is_cfa:
+        for _tile in self.iter_initialize_gl():
+            pass
+
+    def iter_initialize_gl(
+            self,
+            view_hint=None,
+            pixel_buffers: Optional[PixelBufferRing] = None,
+            use_texture_arrays: bool = True,
+            upload_contexts: Optional[UploadContextPool] = None,
+    ) -> Iterator[TileLike]:
+        """
+        Create and upload tiles one at a time, yielding each one after it joins self.tiles.
+        An optional ViewHint puts the tiles the user is looking at first.
+        An optional PixelBufferRing streams the pixels asynchronously.
+        With use_texture_arrays, same-size tiles share a texture array, for instanced drawing.
+        Raw CFA images always use one texture per tile, for the per-tile demosaic.
+        Optional upload contexts upload full resolution tiles in parallel, except those of raw CFA images.
+        """
+        if self._decoding_rows is not None:
+            view_hint = None  # upload in decoding order, from the top down
+        if self.preview_level is not None:
+            tiles = self._iter_level_tiles(self.preview_level, pixel_buffers)
+        elif self.pyramid is not None:
+            tiles = self._iter_resident_pyramid_tiles(pixel_buffers)
+        elif self._jpeg_data is not None:
+            tiles = self._iter_jpeg_band_tiles(pixel_buffers, use_texture_arrays)
+        elif self.md.is_cfa:
             assert self.array is not None
             assert self.array.dtype == numpy.uint16
-            for tile in generate_tiles(
-                    image=self,
-                    pad=6,
-                    tex_format=GL.GL_R16,
-                    tile_class=DngTile,
-            ):
-                self.tiles.append(tile)
+            tiles = generate_tiles(
+                image=self,
+                pad=6,
+                tex_format=GL.GL_R16,
+                tile_class=DngTile,
+                view_hint=view_hint,
+                pixel_buffers=pixel_buffers,
+                cancel_token=self.cancel_token,
+                wait_for_rows=self._wait_for_rows,
+            )
         else:
-            for tile in generate_tiles(self):
-                self.tiles.append(tile)
+            tiles = generate_tiles(
+                self,
+                view_hint=view_hint,
+                pixel_buffers=pixel_buffers,
+                use_texture_arrays=use_texture_arrays,
+                cancel_token=self.cancel_token,
+                wait_for_rows=self._wait_for_rows,
+                upload_contexts=upload_contexts,
+            )
+        for tile in tiles:
+            self.tiles.append(tile)
+            yield tile
+
+    def _iter_resident_pyramid_tiles(self, pixel_buffers: Optional[PixelBufferRing]) -> Iterator[TileLike]:
+        """Build the pyramid levels, then upload the coarse levels, coarsest first"""
+        self._wait_for_rows(self.array.shape[0])  # downsampling needs every row
+        self.pyramid.build_levels(tile_layout, self.cancel_token)
+        self.array = None  # the pyramid's store pages the full resolution pixels
+        for level in self.pyramid.resident_levels:
+            yield from self._iter_level_tiles(level, pixel_buffers)
 
-    def load_from_file(self, file_name: str) -> bool:
-        # Try tifffile first, so we can get the DNG, not the thumbnail
+    def _iter_level_tiles(self, level: PyramidLevel, pixel_buffers: Optional[PixelBufferRing]) -> Iterator[TileLike]:
+        for index, tci in enumerate(level.layout):
+            self.cancel_token.raise_if_canceled()
+            tci.pixel_buffers = pixel_buffers
+            tile = PyramidTile(tci, index)
+            tile.initialize_gl()
+            yield tile
+
+    def _iter_jpeg_band_tiles(self, pixel_buffers: Optional[PixelBufferRing], use_texture_arrays: bool):
+        """
+        Decode the JPEG one row of tiles at a time, uploading each row before decoding the next,
+        so client memory holds one band of pixels instead of the whole image.
+        """
+        pad = 2  # as generate_tiles()
+        bands = pyjpeg_module().iter_row_bands(io.BytesIO(self._jpeg_data), TILE_SIZE, pad)
+        layout = None
         try:
-            with tifffile.TiffFile(file_name) as dng:
+            for band_index, (first_row, pixels) in enumerate(bands):
+                self.cancel_token.raise_if_canceled()
+                self.array = pixels
+                self.array_top = first_row
+                if layout is None:
+                    layout = tile_layout(self, TILE_SIZE, pad)
+                    if use_texture_arrays:
+                        max_layer_count = int(GL.glGetIntegerv(GL.GL_MAX_ARRAY_TEXTURE_LAYERS))
+                        self.texture_arrays = plan_texture_arrays(layout, max_layer_count)
+                for tci in layout:
+                    if tci.top // TILE_SIZE != band_index:
+                        continue
+                    self.cancel_token.raise_if_canceled()
+                    tci.pixel_buffers = pixel_buffers
+                    tile = Tile(tci)
+                    tile.initialize_gl()
+                    yield tile
+        finally:
+            bands.close()
+            self.array = None  # the compressed data remains, to stream again after a release
+            self.array_top = 0
+
+    @property
+    def is_decoding(self) -> bool:
+        """Whether self.array is still being filled, during upload"""
+        return self._decoding_rows is not None
+
+    def _wait_for_rows(self, end_row: int) -> None:
+        """Decode until the first end_row rows of self.array are complete"""
+        row_count = self.array.shape[0]
+        while self._decoding_rows is not None and self._decoded_row_count < end_row:
+            self._decoded_row_count = next(self._decoding_rows, row_count)
+            if self._decoded_row_count >= row_count:
+                self._decoding_rows.close()  # closes the file
+                self._decoding_rows = None
+
+    def _iter_decode_tiff(self, file_name: str) -> Iterator[int]:
+        """Decode the main page of a TIFF into self.array, through a file handle of our own"""
+        with open_image_file(file_name, self.cancel_token) as fh:
+            with tifffile.TiffFile(fh) as tif:
+                page, _root_page = main_tiff_page(tif)
+                yield from iter_decode_segments(page, self.array, self.cancel_token)
+
+    def _can_stream_jpeg(self, mode: str) -> bool:
+        """Whether the JPEG just described by self.md can be decoded band by band, during upload"""
+        if not self.decode_during_upload or mode not in ("RGB", "L") or pyjpeg_module() is None:
+            return False
+        if self.md.size_rpx[1] <= TILE_SIZE:
+            return False  # just one band anyway
+        return not is_pyramid_suitable(self.md, TILE_SIZE)  # the pyramid downsamples the whole image
+
+    def _plan_tiles(self):
+        w, h = (int(x) for x in self.md.size_rpx)
+        if is_pyramid_suitable(self.md, TILE_SIZE):
+            self.pyramid = TilePyramid(self, TILE_SIZE)
+            self.expected_tile_count = self.pyramid.resident_tile_count()
+            logger.info(
+                f"Using a {len(self.pyramid.levels)} level tile pyramid for {w}x{h} image {self.md.file_name}")
+        else:
+            self.expected_tile_count = tile_count(w, h)
+
+    def load_from_file(self, file_name: str, cancel_token: Optional[CancellationToken] = None) -> bool:
+        """
+        Decode an image file with the decoder best suited to its format, falling back to PIL.
+        Raises LoadCanceled if the token is canceled meanwhile.
+        """
+        if cancel_token is not None:
+            self.cancel_token = cancel_token
+        # One handle for every attempt, read through the token, so decoding stops soon after a cancel
+        with open_image_file(file_name, self.cancel_token) as fh:
+            file_format = sniff_format(read_header(fh))
+            load_format = self._format_loaders.get(file_format)
+            if load_format is not None and load_format(self, fh, file_name):
+                return True
+            fh.seek(0)
+            try:
+                pil_image = Image.open(fh, formats=pil_formats(file_format))
+                self.load_from_pil_image(pil_image, file_name)  # loads the pixels before the file closes
+                return True
+            except PIL.UnidentifiedImageError:
+                pass
+        self.set_progress(LoadProgress.ERROR)
+        return False
+
+    def _load_tiff(self, fh: BinaryIO, file_name: str) -> bool:
+        """Decode with tifffile, so we get the DNG, not the thumbnail"""
+        try:
+            with tifffile.TiffFile(fh) as dng:  # leaves the shared handle open
                 self.load_from_tifffile(dng, file_name)
                 return True
         except TiffFileError:
-            pass
+            return False
+
+    def _load_jpeg(self, fh: BinaryIO, file_name: str) -> bool:
+        """Decode the pixels with TurboJPEG, and the metadata with PIL"""
+        data = fh.read()
         try:
-            # Load as a PIL Image
-            pil_image = Image.open(file_name)
-            self.load_from_pil_image(pil_image, file_name)
+            # Only parses the header; PIL keeps the bytes, to decode again if the image is copied or cropped
+            pil_image = Image.open(io.BytesIO(data), formats=["JPEG"])
+        except PIL.UnidentifiedImageError:
+            return False
+        if not can_decode_jpeg(pil_image.mode):
+            return False  # such as CMYK
+        self._load_pil_metadata(pil_image, file_name)
+        if self._can_stream_jpeg(pil_image.mode):
+            self._jpeg_data = data
+            self.set_progress(LoadProgress.ARRAY_CREATED)  # the pixels arrive band by band, during upload
             return True
+        self.cancel_token.raise_if_canceled()
+        self.array = decode_jpeg(data, pil_image.mode)
+        self.set_progress(LoadProgress.ARRAY_CREATED)
+        return True
+
+    def iter_progressive_scans(self, file_name: str, min_interval_seconds: float = 0.0) -> Optional[Iterator[int]]:
+        """
+        For a progressive JPEG, load the metadata now, and return an iterator that decodes
+        one scan into self.array per step, successively sharper, ending with the full image.
+        Returns None, having loaded nothing, for other files, and for images needing a tile pyramid.
+        """
+        pyjpeg = pyjpeg_module()
+        if pyjpeg is None:
+            return None
+        with open_image_file(file_name, self.cancel_token) as fh:
+            if sniff_format(read_header(fh)) != ImageFileFormat.JPEG:
+                return None
+            data = fh.read()
+        try:
+            pil_image = Image.open(io.BytesIO(data), formats=["JPEG"])
         except PIL.UnidentifiedImageError:
-            pass
-        self.set_progress(LoadProgress.ERROR)
-        return False
+            return None
+        if not pil_image.info.get("progressive") or pil_image.mode not in ("RGB", "L"):
+            return None
+        md = ImageMetadata()
+        md.load_pil_image(pil_image)
+        if is_pyramid_suitable(md, TILE_SIZE):
+            return None  # every scan would mean rebuilding the pyramid
+        self._load_pil_metadata(pil_image, file_name)
+        return self._iter_scans(pyjpeg.iter_progressive_scans(io.BytesIO(data), min_interval_seconds))
+
+    def _iter_scans(self, scans: Iterator[tuple[int, NDArray]]) -> Iterator[int]:
+        try:
+            for scan_number, pixels in scans:
+                self.cancel_token.raise_if_canceled()
+                is_first = self.array is None
+                self.array = pixels  # the same array each scan, refilled in place
+                if is_first:
+                    self.set_progress(LoadProgress.ARRAY_CREATED)
+                yield scan_number
+        finally:
+            scans.close()  # releases the decompressor if we stop early
+
+    def refresh_gl(self):
+        """Upload self.array again into the existing tiles, after decoding a sharper scan; loader thread"""
+        for tile in self.tiles:
+            self.cancel_token.raise_if_canceled()
+            tile.refresh_texture()
+        for texture_array in self.texture_arrays:
+            texture_array.generate_mipmaps()
 
-    def load_from_pil_image(self, pil_image: Image.Image, file_name: str):
+    def load_preview_from_file(self, file_name: str, window_size: tuple[int, int]) -> bool:
+        """
+        Load a quick, reduced size stand-in for a large image, drawn at the full size of the image:
+        a DCT-scaled decode or EXIF thumbnail of a JPEG, or the largest preview embedded in a TIFF or DNG.
+        Returns False, having loaded nothing, when there is no preview, or the full image is quick anyway.
+        """
+        with open_image_file(file_name, self.cancel_token) as fh:
+            file_format = sniff_format(read_header(fh))
+            if file_format == ImageFileFormat.TIFF:
+                try:
+                    with tifffile.TiffFile(fh) as tif:
+                        return self._load_tiff_preview(tif, file_name, window_size)
+                except TiffFileError:
+                    return False
+            if file_format != ImageFileFormat.JPEG:
+                return False
+            data = fh.read()
+        try:
+            pil_image = Image.open(io.BytesIO(data), formats=["JPEG"])
+        except PIL.UnidentifiedImageError:
+            return False
         self.md.file_name = file_name
+        self.md.load_pil_image(pil_image)
+        if self.md.input_format != InputFormat.STANDARD_PHOTO:
+            return False  # panoramas are never shown whole
+        scaling_factor = preview_scaling_factor(self.md.size_opx, window_size)
+        if scaling_factor is None:
+            return False
+        if can_decode_jpeg(pil_image.mode):
+            array = decode_jpeg(data, pil_image.mode, scaling_factor)
+        else:
+            array = exif_thumbnail(pil_image)
+            if array is None:
+                return False
+        self._load_preview_array(array)
+        return True
+
+    def _load_tiff_preview(self, tif: tifffile.TiffFile, file_name: str, window_size: tuple[int, int]) -> bool:
+        preview_page = embedded_preview_page(tif)
+        if preview_page is None:
+            return False
+        page, root_page = main_tiff_page(tif)
+        self.md.file_name = file_name
+        self.md.load_tifffile_page(page, root_page)
+        if self.md.input_format != InputFormat.STANDARD_PHOTO:
+            return False  # panoramas are never shown whole
+        # Raw images are slow to decode at any size
+        if not self.md.is_cfa and preview_scaling_factor(self.md.size_opx, window_size) is None:
+            return False
+        # The preview is already rendered for display
+        self.md.is_cfa = False
+        self.md.photometric_scale = PhotometricScale.SRGB
+        self.md.upper_bound = 255
+        self.md.baseline_exposure = 0.0
+        self.cancel_token.raise_if_canceled()
+        self._load_preview_array(preview_page.asarray())
+        return True
+
+    def _load_preview_array(self, array: NDArray) -> None:
+        """Stand in reduced size pixels for the image; self.md keeps the full size, where they are drawn"""
+        self.is_preview = True
+        self.set_progress(LoadProgress.FILE_OPENED)
+        self.md.channel_count = array.shape[2] if array.ndim == 3 else 1
+        h, w = array.shape[:2]
+        level = PyramidLevel(0, (w, h), self)
+        level.is_coarsest = True  # shown zoomed out, so give it a full mipmap chain
+        level.array = array
+        level.layout = tile_layout(level)
+        self.preview_level = level
+        self.expected_tile_count = len(level.layout)
+        self.set_progress(LoadProgress.METADATA_LOADED)
+        self.set_progress(LoadProgress.ARRAY_CREATED)
+
+    # Decoders tried ahead of PIL, by sniffed format
+    _format_loaders = {
+        ImageFileFormat.JPEG: _load_jpeg,
+        ImageFileFormat.TIFF: _load_tiff,
+    }
+
+    def load_from_pil_image(
+            self,
+            pil_image: Image.Image,
+            file_name: str,
+            cancel_token: Optional[CancellationToken] = None,
+    ):
+        if cancel_token is not None:
+            self.cancel_token = cancel_token
+        # Uncompressed pixels upload straight from the page cache, without a private copy
+        mapped = map_pil_pixels(pil_image, file_name)
+        if mapped is not None:
+            # The handle PIL parsed the header through closes once loading returns, so reopen by path,
+            # for copying, cropping and saving; this parses only the header again
+            pil_image = Image.open(file_name, formats=[pil_image.format])
+            self._load_pil_metadata(pil_image, file_name, mapped.is_bottom_up)
+            self.array = mapped.array
+            self.tex_format = GL.GL_BGR if mapped.is_bgr else None
+            self.set_progress(LoadProgress.ARRAY_CREATED)
+            return
         # TODO: create a palette shader to avoid munging pixels here
         if pil_image.mode in ["P", ]:  # Palette image
             pil_image = pil_image.convert("RGBA")
+        self._load_pil_metadata(pil_image, file_name)
+        self.cancel_token.raise_if_canceled()
+        pil_image.load()  # decode here, where LoadCanceled propagates cleanly, rather than inside numpy
+        self.array = numpy.array(pil_image)
+        self.set_progress(LoadProgress.ARRAY_CREATED)
+
+    def _load_pil_metadata(self, pil_image: Image.Image, file_name: str, is_bottom_up: bool = False):
+        self.md.file_name = file_name
         self.pil_image = pil_image
         self.set_progress(LoadProgress.FILE_OPENED)
         self.md.load_pil_image(pil_image)
+        if is_bottom_up:
+            self.md.flip_raw_rows()
+        self._plan_tiles()
         self.set_progress(LoadProgress.METADATA_LOADED)
         self.sq.progress_changed.emit(2, self)  # noqa
-        self.array = numpy.array(pil_image)
+
+    def load_from_decoded(
+            self,
+            md: ImageMetadata,
+            array: NDArray,
+            pil_image: Optional[Image.Image] = None,
+            tex_format: Optional[GLenum] = None,
+    ):
+        """Reuse the metadata and pixels of an image decoded earlier"""
+        self.md = md
+        self.pil_image = pil_image
+        self.tex_format = tex_format
+        self.set_progress(LoadProgress.FILE_OPENED)
+        self._plan_tiles()
+        self.set_progress(LoadProgress.METADATA_LOADED)
+        self.array = array
         self.set_progress(LoadProgress.ARRAY_CREATED)
 
-    def load_from_tifffile(self, dng: tifffile.TiffFile, file_name: str):
+    def load_from_tifffile(
+            self,
+            dng: tifffile.TiffFile,
+            file_name: str,
+            cancel_token: Optional[CancellationToken] = None,
+    ):
+        if cancel_token is not None:
+            self.cancel_token = cancel_token
         self.md.file_name = file_name
         self.set_progress(LoadProgress.FILE_OPENED)
-        root_page = dng.pages[0]
-        # Find raw image in ricoh theta Z1
-        page = None
-        for ix, series in enumerate(dng.series):
-            # print(f"Series {ix}: Shape {series.shape}, Dtype {series.dtype}")  # noqa
-            if series.dtype == numpy.uint16:
-                raw_page = series
-                page = raw_page.pages[0]
-        if page is None:
-            page = root_page
+        page, root_page = main_tiff_page(dng)
         # print(root_page.tags.get("AsShotNeutral").value)
         # Populate metadata
         self.md.photometric_scale = PhotometricScale.LINEAR
         self.md.upper_bound = numpy.iinfo(page.dtype).max  # noqa
         # self.md.load_exiftool(file_name)  # takes longer but life is short
         self.md.load_tifffile_page(page, root_page)
+        self._plan_tiles()
         self.set_progress(LoadProgress.METADATA_LOADED)
-        # Slurp the raw bytes
+        # Map uncompressed pixels from the page cache, or else slurp the raw bytes
+        self.array = map_tiff_page(page, file_name)
+        if self.array is not None:
+            self.set_progress(LoadProgress.ARRAY_CREATED)
+            return
+        if self.decode_during_upload and len(page.dataoffsets) > 1:
+            # Tiles upload as soon as the segments covering them are decoded
+            self.array = numpy.zeros(getattr(page, "keyframe", page).shape, dtype=page.dtype)
+            self._decoding_rows = self._iter_decode_tiff(file_name)
+            self._decoded_row_count = 0
+            self.set_progress(LoadProgress.ARRAY_CREATED)
+            return
         try:
-            self.array = page.asarray()
+            self.array = decode_tiff_page(page, self.cancel_token)
         except imagecodecs.DelayedImportError as exc:
             logger.error(exc)
             raise
         self.set_progress(LoadProgress.ARRAY_CREATED)
 
+    def release_mapped_pixels(self):
+        """Drop pixels mapped from the file, once the tiles no longer need them, so the file is free again"""
+        if isinstance(self.array, numpy.memmap):
+            self.array = None
+
+    @property
+    def gpu_byte_count(self) -> int:
+        result = (
+            sum(tile.gpu_byte_count for tile in self.tiles)
+            + sum(texture_array.gpu_byte_count for texture_array in self.texture_arrays)
+        )
+        if self.pyramid is not None:
+            result += sum(tile.gpu_byte_count for tile in self.pyramid.resident.values())
+        return result
+
+    def release_gl(self):
+        """Delete textures and buffers; run in the loader thread, with the offscreen context current"""
+        byte_count = self.gpu_byte_count
+        for tile in self.tiles:
+            tile.release_gl()
+        for texture_array in self.texture_arrays:
+            texture_array.release_gl()
+        if self.pyramid is not None:
+            self.pyramid.release_gl()
+        logger.info(
+            f"Released {byte_count / 2**20:.1f} MB of video memory for {self.md.file_name}; {vram_budget}")
+
+    def release_render_gl(self):
+        """Delete vertex arrays and the instance buffer; run in the UI thread, with the widget context current"""
+        for tile in self.tiles:
+            tile.release_render_gl()
+        if self.pyramid is not None:
+            self.pyramid.release_render_gl()
+        if self.tile_instances is not None:
+            self.tile_instances.release_gl()
+            self.tile_instances = None
+
+    def display_tiles(self) -> list[TileLike]:
+        """Tiles to draw, in drawing order; with a pyramid, coarse levels first so finer tiles cover them"""
+        if self.pyramid is None:
+            return self.tiles
+        level = self.pyramid.display_level
+        coarse = [tile for tile in self.tiles if tile.pyramid_key[0] >= level]
+        fine = [tile for tile in self.pyramid.display_tiles() if tile.pyramid_key[0] >= level]
+        return coarse + fine
+
+    def full_resolution_tiles(self) -> list[TileLike]:
+        """Displayed tiles at full resolution, for per-pixel overlays"""
+        if self.is_preview:
+            return []
+        if self.pyramid is None:
+            return self.tiles
+        return [tile for tile in self.display_tiles() if tile.pyramid_key[0] == 0]
+
     def paint_gl(self, program, view_state):
         is_complete = True  # start optimistic
-        for tile in self.tiles:
+        for tile in self.display_tiles():
             GL.glUniformMatrix3fv(program.tile_X_img_location, 1, True, tile.tile_X_img)
             GL.glUniform4f(program.uv_bounds_location, *tile.uv_bounds)
             if not tile.paint_gl(view_state):
                 is_complete = False
-            if is_complete and self.load_progress != LoadProgress.DISPLAYED:
-                self.load_progress = LoadProgress.DISPLAYED
-                self.sq.image_displayed.emit(self)  # noqa
             # break  # just one tile for testing
+        if is_complete:
+            self.set_display_complete()
 
     def set_display_complete(self):
         if self.load_progress == LoadProgress.DISPLAYED:
             return  # Already done
+        if len(self.tiles) < self.expected_tile_count:
+            return  # Remaining tiles are still being uploaded
         self.load_progress = LoadProgress.DISPLAYED
         self.sq.image_displayed.emit(self)  # noqa
 
@@ -203,13 +633,20 @@ class TileCreateInfo:
         self.internal_format: GLenum = GL.GL_RGBA
         self.tex_format: GLenum = self.internal_format
         self.data_type: GLenum = GL.GL_UNSIGNED_BYTE
+        self.pixel_buffers: Optional[PixelBufferRing] = None  # None means upload directly from client memory
+        self.texture_array: Optional[TileTextureArray] = None  # None means the tile gets its own texture
+        self.layer: int = 0  # index into texture_array
 
 
 class Tile(TileLike):
+    max_mip_level: Optional[int] = None  # None means a full mipmap chain
+
     def __init__(self, tci: TileCreateInfo):
         self.tci = tci
         self.vao = None
+        self.render_vao = None
         self.vbo = None
+        self.gpu_byte_count = 0  # video memory charged to vram_budget
         self.padded_width = tci.width + tci.left_pad + tci.right_pad
         self.padded_height = tci.height + tci.top_pad + tci.bottom_pad
         # Convert to oriented image pixel coordinates (opx)
@@ -251,7 +688,9 @@ class Tile(TileLike):
                 ],
                 dtype=numpy.float32,
             ).flatten()
-        self.texture_id = None
+        self.texture_id = None  # stays None for tiles stored in a texture array
+        self.texture_array = tci.texture_array
+        self.layer = tci.layer
         self.load_sync = None
 
         iw, ih = tci.image.md.size_rpx
@@ -265,13 +704,47 @@ class Tile(TileLike):
             tci.top_pad / self.padded_height,
             (tci.left_pad + tci.width) / self.padded_width,
             (tci.top_pad + tci.height) / self.padded_height)
+        self.rtc_bounds = (  # region of the full image texture covered by this tile, (u_min, v_min, u_max, v_max)
+            tci.left / iw,
+            tci.top / ih,
+            (tci.left + tci.width) / iw,
+            (tci.top + tci.height) / ih)
         self.boundary_ebo = None
 
     def initialize_gl(self):
         self.vbo = GL.glGenBuffers(1)  # noqa
         GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vbo)
         GL.glBufferData(GL.GL_ARRAY_BUFFER, len(self.vertexes) * sizeof(c_float), self.vertexes, GL.GL_STATIC_DRAW)
-        self.texture_id = GL.glGenTextures(1)  # noqa
+        if self.texture_array is not None:
+            self.texture_array.bind()
+            self._tex_sub_image_3d()
+            self.texture_array.layer_uploaded()
+            texture_bytes = 0  # charged to the array
+        else:
+            self._initialize_texture()
+            texture_bytes = texture_byte_count(self.padded_width, self.padded_height, self.tci.internal_format)
+
+        # Tile boundaries
+        self.boundary_ebo = GL.glGenBuffers(1)  # noqa
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.boundary_ebo)
+        indices = numpy.array([
+            0, 1, 3, 2,
+        ], dtype=numpy.uint32)
+        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL.GL_STATIC_DRAW)
+        self._charge_vram(texture_bytes + self.vertexes.nbytes + indices.nbytes)
+        self.load_sync = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glFlush()
+
+    def _texture_key(self) -> tuple[int, int, int, int, int]:
+        """Size and format of this tile's texture, for recycling it through texture_pool"""
+        return GL.GL_TEXTURE_2D, self.padded_width, self.padded_height, 1, self.tci.internal_format
+
+    def _initialize_texture(self):
+        """Create and fill a texture for this tile alone, recycling a released one if possible"""
+        self.texture_id = texture_pool.take(self._texture_key())
+        is_recycled = self.texture_id is not None
+        if not is_recycled:
+            self.texture_id = GL.glGenTextures(1)  # noqa
         GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
         GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # In case width is odd
         # Show monochrome images as gray, not red
@@ -279,23 +752,13 @@ class Tile(TileLike):
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_SWIZZLE_G, GL.GL_RED)
             GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_SWIZZLE_B, GL.GL_RED)
         # TODO: use preferred internal format in image data...
-        # row stride required for horizontal tiling
-        iw, ih = self.tci.image.md.size_rpx
-        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, iw)
-        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, self.tci.left - self.tci.left_pad)
-        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, self.tci.top - self.tci.top_pad)
-        GL.glTexImage2D(
-            GL.GL_TEXTURE_2D,
-            0,
-            self.tci.internal_format,
-            self.padded_width,
-            self.padded_height,
-            0,
-            self.tci.tex_format,
-            self.tci.data_type,
-            self.tci.image.array,
-        )
-        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+        if is_recycled:
+            self._tex_sub_image_2d()  # same size and format, so keep the storage
+        else:
+            self._tex_image_2d(self.tci.internal_format, self.tci.tex_format, self.tci.data_type)
+        max_level = self.max_mip_level if self.max_mip_level is not None else 1000  # 1000 is the GL default
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, max_level)
+        self._fill_mipmaps()
         # Anisotropic filtering
         f_largest = GL.glGetFloatv(GL_MAX_TEXTURE_MAX_ANISOTROPY_EXT)  # noqa
         GL.glTexParameterf(GL.GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, f_largest)
@@ -304,20 +767,156 @@ class Tile(TileLike):
         # TODO: test and debug 360 boundary conditions with tiled image
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
         GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+
+    def _fill_mipmaps(self):
+        """Fill the mipmap levels of the texture bound to GL_TEXTURE_2D, after level 0"""
+        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+
+    def _tex_image_2d(self, internal_format: GLenum, tex_format: GLenum, data_type: GLenum):
+        """Upload this tile's padded pixels to the texture bound to GL_TEXTURE_2D"""
+        tci = self.tci
+        if tci.pixel_buffers is not None:
+            region = padded_region(
+                tci.image.array,
+                tci.left - tci.left_pad,
+                self._array_top,
+                self.padded_width,
+                self.padded_height,
+            )
+            tci.pixel_buffers.tex_image_2d(region, internal_format, tex_format, data_type)
+            return
+        # row stride required for horizontal tiling
+        iw, ih = tci.image.md.size_rpx
+        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, int(iw))
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, tci.left - tci.left_pad)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, self._array_top)
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            internal_format,
+            self.padded_width,
+            self.padded_height,
+            0,
+            tex_format,
+            data_type,
+            tci.image.array,
+        )
         # Restore normal unpack settings
         GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
         GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, 0)
         GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, 0)
 
-        # Tile boundaries
-        self.boundary_ebo = GL.glGenBuffers(1)  # noqa
-        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.boundary_ebo)
-        indices = numpy.array([
-            0, 1, 3, 2,
-        ], dtype=numpy.uint32)
-        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL.GL_STATIC_DRAW)
-        self.load_sync = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
-        GL.glFlush()
+    def _tex_sub_image_2d(self):
+        """Replace the pixels of the recycled texture bound to GL_TEXTURE_2D with this tile's padded pixels"""
+        tci = self.tci
+        if tci.pixel_buffers is not None:
+            region = padded_region(
+                tci.image.array,
+                tci.left - tci.left_pad,
+                self._array_top,
+                self.padded_width,
+                self.padded_height,
+            )
+            tci.pixel_buffers.tex_sub_image_2d(region, tci.tex_format, tci.data_type)
+            return
+        iw, ih = tci.image.md.size_rpx
+        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, int(iw))
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, tci.left - tci.left_pad)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, self._array_top)
+        GL.glTexSubImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            0, 0,  # x, y offsets
+            self.padded_width,
+            self.padded_height,
+            tci.tex_format,
+            tci.data_type,
+            tci.image.array,
+        )
+        # Restore normal unpack settings
+        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, 0)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, 0)
+
+    def _tex_sub_image_3d(self):
+        """Upload this tile's padded pixels to its layer of the texture array bound to GL_TEXTURE_2D_ARRAY"""
+        tci = self.tci
+        if tci.pixel_buffers is not None:
+            region = padded_region(
+                tci.image.array,
+                tci.left - tci.left_pad,
+                self._array_top,
+                self.padded_width,
+                self.padded_height,
+            )
+            tci.pixel_buffers.tex_sub_image_3d(region, self.layer, tci.tex_format, tci.data_type)
+            return
+        iw, ih = tci.image.md.size_rpx
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # In case width is odd
+        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, int(iw))
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, tci.left - tci.left_pad)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, self._array_top)
+        GL.glTexSubImage3D(
+            GL.GL_TEXTURE_2D_ARRAY,
+            0,
+            0, 0, self.layer,  # x, y, z offsets
+            self.padded_width,
+            self.padded_height,
+            1,  # depth
+            tci.tex_format,
+            tci.data_type,
+            tci.image.array,
+        )
+        # Restore normal unpack settings
+        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, 0)
+        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, 0)
+
+    def refresh_texture(self):
+        """Replace this tile's pixels from the image array, keeping the texture storage"""
+        if self.texture_array is not None:
+            self.texture_array.bind()
+            self._tex_sub_image_3d()
+            return  # the image regenerates the mipmaps of the whole array afterward
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # In case width is odd
+        self._tex_sub_image_2d()
+        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+
+    @property
+    def _array_top(self) -> int:
+        """Row of the image array holding the top padding row of this tile"""
+        return self.tci.top - self.tci.top_pad - self.tci.image.array_top
+
+    def _charge_vram(self, byte_count: int):
+        self.gpu_byte_count += byte_count
+        vram_budget.allocate(byte_count)
+
+    def release_gl(self):
+        """Delete textures and buffers; run in the loader thread, with the offscreen context current"""
+        if self.texture_id is not None:
+            texture_bytes = texture_byte_count(self.padded_width, self.padded_height, self.tci.internal_format)
+            if not texture_pool.put(self._texture_key(), self.texture_id, texture_bytes):
+                GL.glDeleteTextures([self.texture_id])
+            self.texture_id = None
+        for buffer in (self.vbo, self.boundary_ebo):
+            if buffer is not None:
+                GL.glDeleteBuffers(1, [buffer])
+        self.vbo = None
+        self.boundary_ebo = None
+        if self.load_sync is not None:
+            GL.glDeleteSync(self.load_sync)
+            self.load_sync = None
+        vram_budget.free(self.gpu_byte_count)
+        self.gpu_byte_count = 0
+
+    def release_render_gl(self):
+        """Delete vertex arrays; run in the UI thread, with the widget context current"""
+        vao = self.render_vao if self.render_vao is not None else self.vao
+        if vao is not None:
+            GL.glDeleteVertexArrays(1, [vao])
+        self.render_vao = None
+        self.vao = None
 
     def initialize_arrays(self):
         if self.vao is not None:
@@ -419,15 +1018,147 @@ class Tile(TileLike):
         return self._tile_X_img
 
 
-def generate_tiles(
+class PyramidTile(Tile):
+    """
+    Tile of one level of a TilePyramid, or of a preview.
+    Vertexes are in full resolution oriented pixels, so every level draws in the same place.
+    Only the coarsest level generates a full mipmap chain. Finer levels are only displayed near their own
+    resolution, and take their few mipmap levels from the coarser pyramid levels, padded with pixels of
+    the neighboring tiles at each level, so no seams show.
+    """
+    def __init__(self, tci: TileCreateInfo, index: int):
+        super().__init__(tci)
+        level: PyramidLevel = tci.image
+        self.pyramid_key = (level.level, index)
+        self.max_mip_level = level.mip_level_count
+        vertexes = self.vertexes.reshape(4, 4)
+        vertexes[:, 0:2] *= level.opx_scale
+        self.vertexes = vertexes.flatten()
+
+    def _pixels(self, mip_level: int) -> NDArray:
+        return self.tci.image.pyramid.tile_pixels(self.pyramid_key, mip_level)
+
+    def _tex_image_2d(self, internal_format: GLenum, tex_format: GLenum, data_type: GLenum):
+        if self.tci.image.pyramid is None:
+            super()._tex_image_2d(internal_format, tex_format, data_type)
+            return
+        pixels = self._pixels(0)  # from the store, for fine tiles, so not in the level array
+        if self.tci.pixel_buffers is not None:
+            self.tci.pixel_buffers.tex_image_2d(pixels, internal_format, tex_format, data_type)
+            return
+        GL.glTexImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            internal_format,
+            self.padded_width,
+            self.padded_height,
+            0,
+            tex_format,
+            data_type,
+            numpy.ascontiguousarray(pixels),
+        )
+
+    def _tex_sub_image_2d(self):
+        tci = self.tci
+        if tci.image.pyramid is None:
+            super()._tex_sub_image_2d()
+            return
+        pixels = self._pixels(0)
+        if tci.pixel_buffers is not None:
+            tci.pixel_buffers.tex_sub_image_2d(pixels, tci.tex_format, tci.data_type)
+            return
+        GL.glTexSubImage2D(
+            GL.GL_TEXTURE_2D,
+            0,
+            0, 0,  # x, y offsets
+            self.padded_width,
+            self.padded_height,
+            tci.tex_format,
+            tci.data_type,
+            numpy.ascontiguousarray(pixels),
+        )
+
+    def _fill_mipmaps(self):
+        if self.max_mip_level is None:
+            super()._fill_mipmaps()
+            return
+        tci = self.tci
+        for mip_level in range(1, self.max_mip_level + 1):
+            pixels = numpy.ascontiguousarray(self._pixels(mip_level))
+            height, width = pixels.shape[:2]
+            GL.glTexImage2D(
+                GL.GL_TEXTURE_2D,
+                mip_level,
+                tci.internal_format,
+                width,
+                height,
+                0,
+                tci.tex_format,
+                tci.data_type,
+                pixels,
+            )
+
+
+def main_tiff_page(tif: tifffile.TiffFile) -> tuple[tifffile.TiffPage, tifffile.TiffPage]:
+    """The page holding the full image, and the root page, which holds the file metadata"""
+    root_page = tif.pages[0]
+    # Find raw image in ricoh theta Z1
+    page = None
+    for ix, series in enumerate(tif.series):
+        # print(f"Series {ix}: Shape {series.shape}, Dtype {series.dtype}")  # noqa
+        if series.dtype == numpy.uint16:
+            page = series.pages[0]
+    if page is None:
+        page = root_page
+    return page, root_page
+
+
+def embedded_preview_page(tif: tifffile.TiffFile) -> Optional[tifffile.TiffPage]:
+    """
+    Largest reduced resolution 8-bit RGB page of a TIFF, such as a DNG preview or thumbnail IFD, or None.
+    Looks in the SubIFDs too, where DNG keeps the raw image and the larger previews.
+    """
+    best = None
+    for top_page in tif.pages:
+        for page in [top_page, *(getattr(top_page, "pages", None) or [])]:
+            if not (
+                page.is_reduced
+                and page.dtype == numpy.uint8
+                and page.samplesperpixel == 3
+                and page.photometric in (tifffile.PHOTOMETRIC.RGB, tifffile.PHOTOMETRIC.YCBCR)
+            ):
+                continue
+            if best is None or page.imagewidth * page.imagelength > best.imagewidth * best.imagelength:
+                best = page
+    return best
+
+
+def decode_tiff_page(page, cancel_token: Optional[CancellationToken] = None) -> NDArray:
+    """
+    Like page.asarray(), but decoding the strips or tiles in parallel,
+    raising LoadCanceled between segments once the token is canceled.
+    """
+    if not page.dataoffsets:
+        return page.asarray()
+    keyframe = getattr(page, "keyframe", page)
+    out = numpy.zeros(keyframe.shape, dtype=keyframe.dtype)
+    for _row_count in iter_decode_segments(page, out, cancel_token):
+        pass
+    return out
+
+
+def tile_count(width: int, height: int, tile_size: int = TILE_SIZE) -> int:
+    """Number of tiles generate_tiles() will create for an image of this size"""
+    return -(-width // tile_size) * -(-height // tile_size)
+
+
+def tile_layout(
         image: TiledImage,
         tile_size: int = TILE_SIZE,
         pad: int = 2,
         tex_format=None,
-        tile_class: type = Tile,
-) -> Iterator[Tile]:
-    max_texture_size = GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE)  # noqa
-    assert max_texture_size >= tile_size
+) -> list[TileCreateInfo]:
+    """Parameters of every tile of the image, in row-major order"""
     # Loop over tiles
     w, h = (int(x) for x in image.md.size_rpx)
     assert image.array is not None
@@ -438,7 +1169,10 @@ def generate_tiles(
     else:
         internal_format = internal_format_for_channel_count[channel_count]
     if tex_format is None:
-        tex_format = internal_format_for_channel_count[channel_count]  # TODO: BGR, GL_RGB16 etc.
+        tex_format = image.tex_format
+    if tex_format is None:
+        tex_format = internal_format_for_channel_count[channel_count]  # TODO: GL_RGB16 etc.
+    result = []
     top = 0
     top_pad = 0
     while top < h:
@@ -467,14 +1201,95 @@ def generate_tiles(
             tci.internal_format = internal_format
             tci.tex_format = tex_format
             tci.data_type = data_type
-            tile = tile_class(tci)
-            tile.initialize_gl()
-            yield tile
+            result.append(tci)
             # advance
             left += tile_size
             left_pad = pad
         top += tile_size
         top_pad = pad
+    return result
+
+
+def generate_tiles(
+        image: TiledImage,
+        tile_size: int = TILE_SIZE,
+        pad: int = 2,
+        tex_format=None,
+        tile_class: type = Tile,
+        view_hint=None,
+        pixel_buffers: Optional[PixelBufferRing] = None,
+        use_texture_arrays: bool = False,
+        cancel_token: Optional[CancellationToken] = None,
+        wait_for_rows: Optional[Callable[[int], None]] = None,
+        upload_contexts: Optional[UploadContextPool] = None,
+) -> Iterator[Tile]:
+    """
+    Create and upload each tile.
+    With a ViewHint, tiles nearest the current view come first, re-sorted whenever the view changes.
+    Otherwise tiles come in row-major order.
+    With use_texture_arrays, tiles are layers of the texture arrays in image.texture_arrays.
+    With a cancel_token, raises LoadCanceled before the next tile once it is canceled.
+    With wait_for_rows, calls it with the number of top image rows each tile needs, before creating the tile.
+    With upload_contexts, tiles upload in parallel, in the pool's threads, and arrive in the order they finish.
+    """
+    max_texture_size = GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE)  # noqa
+    assert max_texture_size >= tile_size
+    layout = tile_layout(image, tile_size, pad, tex_format)
+    if use_texture_arrays:
+        max_layer_count = int(GL.glGetIntegerv(GL.GL_MAX_ARRAY_TEXTURE_LAYERS))
+        image.texture_arrays = plan_texture_arrays(layout, max_layer_count)
+    tiles = _iter_created_tiles(image, layout, tile_class, view_hint, pixel_buffers, cancel_token, wait_for_rows)
+    if upload_contexts is None:
+        for tile in tiles:
+            tile.initialize_gl()
+            yield tile
+        return
+    # Allocate each texture array here, before the upload threads fill in its layers,
+    # and generate its mipmaps here, once every layer is in
+    for texture_array in image.texture_arrays:
+        texture_array.initialize_gl()
+        texture_array.is_mipmap_deferred = True
+    GL.glFinish()  # so the other contexts see the storage
+    uploaded = []
+    for tile in upload_contexts.upload(tiles):
+        uploaded.append(tile)
+        yield tile
+    if len(image.texture_arrays) > 0:
+        for tile in uploaded:
+            GL.glWaitSync(tile.load_sync, 0, GL.GL_TIMEOUT_IGNORED)
+        for texture_array in image.texture_arrays:
+            texture_array.generate_mipmaps()
+        GL.glFinish()  # before the display samples the new levels
+
+
+def _iter_created_tiles(
+        image: TiledImage,
+        layout: list[TileCreateInfo],
+        tile_class: type,
+        view_hint,
+        pixel_buffers: Optional[PixelBufferRing],
+        cancel_token: Optional[CancellationToken],
+        wait_for_rows: Optional[Callable[[int], None]],
+) -> Iterator[Tile]:
+    """Tiles for generate_tiles(), in the order to upload them, not yet uploaded"""
+    # Pending tiles are popped from the end
+    pending = layout[::-1]
+    revision = None
+    while len(pending) > 0:
+        if cancel_token is not None:
+            cancel_token.raise_if_canceled()
+        if view_hint is not None:
+            latest_revision, view = view_hint.view_for(image)
+            if latest_revision != revision:
+                revision = latest_revision
+                if view is not None:
+                    # Stable sort keeps row-major order among equal priorities
+                    pending.sort(key=lambda t: view.key(t, image), reverse=True)
+        tci = pending.pop()
+        if wait_for_rows is not None:
+            wait_for_rows(tci.top + tci.height + tci.bottom_pad)
+        tci.pixel_buffers = pixel_buffers
+        yield tile_class(tci)
 
 
 class DngTile(Tile):
@@ -487,7 +1302,6 @@ class DngTile(Tile):
         super().__init__(tci)
         self.bayer_texture_id = None
         self.texture_id = None  # alias for bayer_texture_id
-        self.bayer_array = tci.image.array
         self.demosaic_texture_id = None
         self.render_vao = None
 
@@ -499,21 +1313,10 @@ class DngTile(Tile):
         self.texture_id = self.bayer_texture_id
         GL.glBindTexture(GL.GL_TEXTURE_2D, self.bayer_texture_id)
         GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)  # In case width is odd
-        bayer_w, bayer_h = self.tci.image.md.size_rpx
-        GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, int(bayer_w))
-        GL.glPixelStorei(GL.GL_UNPACK_SKIP_PIXELS, self.tci.left - self.tci.left_pad)
-        GL.glPixelStorei(GL.GL_UNPACK_SKIP_ROWS, self.tci.top - self.tci.top_pad)
-
-        GL.glTexImage2D(
-            GL.GL_TEXTURE_2D,
-            0,  # base mipmap
+        self._tex_image_2d(
             GL.GL_R16,  # single channel
-            self.padded_width,
-            self.padded_height,
-            0,  # border
             GL.GL_RED,
             GL.GL_UNSIGNED_SHORT,  # 16 bit
-            self.bayer_array,
         )
 
         # We always want literally exact texel values, and no mipmapping
@@ -607,6 +1410,12 @@ class DngTile(Tile):
             0, 1, 3, 2,
         ], dtype=numpy.uint32)
         GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL.GL_STATIC_DRAW)
+        self._charge_vram(
+            texture_byte_count(self.padded_width, self.padded_height, GL.GL_R16, mipmapped=False)
+            + texture_byte_count(demosaic_w, demosaic_h, GL.GL_RGBA16)
+            + self.vertexes.nbytes
+            + indices.nbytes
+        )
 
         # Clean up
         # GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
@@ -615,6 +1424,28 @@ class DngTile(Tile):
         GL.glFlush()  # macOS probably
         logger.debug("DNG demosaic complete")
 
+    def release_gl(self):
+        """Delete textures, buffers, and demosaic objects; run in the loader thread"""
+        if self.demosaic_texture_id is not None:
+            GL.glDeleteTextures([self.demosaic_texture_id])
+            self.demosaic_texture_id = None
+        # The demosaic framebuffer and vertex array belong to the loader context
+        if self.demosaic_framebuffer is not None:
+            GL.glDeleteFramebuffers(1, [self.demosaic_framebuffer])
+            self.demosaic_framebuffer = None
+        if self.demosaic_vao is not None:
+            GL.glDeleteVertexArrays(1, [self.demosaic_vao])
+            self.demosaic_vao = None
+        if self.demosaic_program is not None:
+            GL.glDeleteProgram(self.demosaic_program)
+            self.demosaic_program = None
+        # Bayer textures are not recycled, because demosaicing needs their exact sampling parameters
+        if self.bayer_texture_id is not None:
+            GL.glDeleteTextures([self.bayer_texture_id])
+            self.bayer_texture_id = None
+            self.texture_id = None
+        super().release_gl()
+
     def paint_gl(self, _view_state) -> bool:
         """Run in ui thread"""
         if not self.is_ready_for_display():
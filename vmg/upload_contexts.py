@@ -0,0 +1,127 @@
+"""
+Extra offscreen contexts, in the share group of the display, for uploading the
+tiles of one image in parallel.
+
+Each context stays current in a thread of its own. The loader thread still
+chooses the order of the tiles, and hands each one to whichever upload thread
+is free. Every tile upload ends with a fence in its upload context, which the
+render thread checks before drawing that tile, just as for tiles uploaded by
+the loader. Only objects shared between contexts, textures and buffers, are
+created here, so tiles needing framebuffers or vertex arrays, such as the
+demosaicked tiles of raw images, are uploaded by the loader alone.
+
+Whether uploads actually overlap depends on the driver; see
+scripts/upload_context_benchmark.py.
+"""
+
+import logging
+import queue
+from typing import Iterator, Optional
+
+from PySide6 import QtCore
+
+from vmg.interfaces import TileLike
+from vmg.offscreen_context import OffscreenContext
+from vmg.pixel_buffers import PixelBufferRing
+
+logger = logging.getLogger(__name__)
+
+# No extra contexts: the loader uploads every tile itself
+DEFAULT_UPLOAD_CONTEXT_COUNT = 0
+# Tiles handed to the upload threads ahead of those finished, per thread; more
+# keeps every thread busy, fewer follows changes of view more closely
+TILES_IN_FLIGHT_PER_CONTEXT = 2
+
+
+class _UploadThread(QtCore.QThread):
+    def __init__(self, context: OffscreenContext, jobs: queue.SimpleQueue):
+        super().__init__()
+        self.context = context
+        self.jobs = jobs
+        self._pixel_buffers: Optional[PixelBufferRing] = None
+
+    def pixel_buffers(self) -> PixelBufferRing:
+        """Pixel buffers of this thread's own, as a ring's state belongs to one context"""
+        if self._pixel_buffers is None:
+            self._pixel_buffers = PixelBufferRing()
+        return self._pixel_buffers
+
+    def run(self):
+        with self.context:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                job(self)
+            if self._pixel_buffers is not None:
+                self._pixel_buffers.release_gl()
+
+
+def _upload_tile(tile: TileLike, done: queue.SimpleQueue, thread: _UploadThread) -> None:
+    try:
+        if tile.tci.pixel_buffers is not None:
+            tile.tci.pixel_buffers = thread.pixel_buffers()
+        tile.initialize_gl()
+        done.put((tile, None))
+    except Exception as exc:
+        done.put((tile, exc))
+
+
+class UploadContextPool(object):
+    """Upload threads, each with its own shared offscreen context; create in the UI thread"""
+    def __init__(self, contexts: list[OffscreenContext]):
+        self._jobs = queue.SimpleQueue()
+        self._threads = [_UploadThread(context, self._jobs) for context in contexts]
+        for thread in self._threads:
+            thread.context.context.moveToThread(thread)
+            thread.start()
+
+    def __len__(self):
+        return len(self._threads)
+
+    def upload(self, tiles: Iterator[TileLike]) -> Iterator[TileLike]:
+        """
+        Call initialize_gl() on each tile in the upload threads, yielding each tile once its upload is submitted,
+        with its fence, in the order they finish. Takes the next tile only when an upload thread is ready for it.
+        Run in the loader thread, with its offscreen context current.
+        """
+        done = queue.SimpleQueue()
+        max_in_flight = TILES_IN_FLIGHT_PER_CONTEXT * len(self._threads)
+        in_flight = 0
+        try:
+            for tile in tiles:
+                self._jobs.put(lambda thread, t=tile: _upload_tile(t, done, thread))
+                in_flight += 1
+                while in_flight >= max_in_flight or (in_flight > 0 and not done.empty()):
+                    in_flight -= 1
+                    yield self._finished(*done.get())
+            while in_flight > 0:
+                in_flight -= 1
+                yield self._finished(*done.get())
+        finally:
+            # Canceled or failed; the tiles still uploading never reach the image, so release them here
+            while in_flight > 0:
+                in_flight -= 1
+                tile, exc = done.get()
+                if exc is None:
+                    tile.release_gl()
+
+    @staticmethod
+    def _finished(tile: TileLike, exc: Optional[Exception]) -> TileLike:
+        if exc is not None:
+            raise exc
+        return tile
+
+    def stop(self) -> None:
+        """Finish the uploads in progress and end the threads; run in the UI thread"""
+        for _thread in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.wait()
+        self._threads.clear()
+
+
+__all__ = [
+    "DEFAULT_UPLOAD_CONTEXT_COUNT",
+    "UploadContextPool",
+]